@@ -0,0 +1,16 @@
+"""Общие помощники бенчмарков: каталог backend и загрузка index.py функции как модуля."""
+import importlib.util
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_function(name: str):
+    function_dir = os.path.join(BACKEND_DIR, name)
+    if function_dir not in sys.path:
+        sys.path.insert(0, function_dir)
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(function_dir, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
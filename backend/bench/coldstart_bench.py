@@ -0,0 +1,94 @@
+"""Холодный старт функций: время импорта index.py, первые вызовы OPTIONS и с ошибкой валидации.
+
+Каждый замер - отдельный процесс интерпретатора, как при запуске нового экземпляра функции.
+
+Запуск: python backend/bench/coldstart_bench.py [--runs N] [--function NAME ...]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from _loader import BACKEND_DIR
+
+HEAVY_MODULES = ('smtplib', 'ssl', 'asyncio', 'email.mime.base', 'email.generator', 'psycopg2')
+
+# Запросы, которые не должны требовать SMTP и базы данных
+VALIDATION_EVENTS = {
+    'contact': {'httpMethod': 'POST', 'body': '{}'},
+    'send-email': {'httpMethod': 'POST', 'body': '{}'},
+    'send-invitation': {'httpMethod': 'POST', 'body': '{}'},
+    'user-data': {'httpMethod': 'GET', 'queryStringParameters': {}},
+    'mail-outbox': {'httpMethod': 'GET'}
+}
+
+PROBE = '''
+import json, sys, time, timeit
+start = time.perf_counter()
+import index
+imported = time.perf_counter()
+options = {'httpMethod': 'OPTIONS'}
+index.handler(options, None)
+first_options = time.perf_counter()
+status = index.handler(VALIDATION_EVENT, None)['statusCode']
+first_invalid = time.perf_counter()
+warm = timeit.repeat(lambda: index.handler(options, None), number=2000, repeat=3)
+warm_invalid = timeit.repeat(lambda: index.handler(VALIDATION_EVENT, None), number=2000, repeat=3)
+print(json.dumps({
+    'import_ms': (imported - start) * 1e3,
+    'first_options_us': (first_options - imported) * 1e6,
+    'first_invalid_us': (first_invalid - first_options) * 1e6,
+    'warm_options_us': min(warm) / 2000 * 1e6,
+    'warm_invalid_us': min(warm_invalid) / 2000 * 1e6,
+    'invalid_status': status,
+    'heavy_loaded': [name for name in HEAVY_MODULES if name in sys.modules]
+}))
+'''
+
+
+def functions() -> list:
+    return sorted(name for name in os.listdir(BACKEND_DIR)
+                  if os.path.isfile(os.path.join(BACKEND_DIR, name, 'index.py')))
+
+
+def probe(name: str) -> dict:
+    code = (f'VALIDATION_EVENT = {VALIDATION_EVENTS.get(name, {"httpMethod": "GET"})!r}\n'
+            f'HEAVY_MODULES = {HEAVY_MODULES!r}\n' + PROBE)
+    env = {key: value for key, value in os.environ.items()
+           if key not in ('DATABASE_URL', 'SMTP_USER', 'SMTP_EMAIL', 'SMTP_PASSWORD')}
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.join(BACKEND_DIR, name),
+                            env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])  # выше - строки лога telemetry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--function', action='append', help='имя функции; по умолчанию все')
+    parser.add_argument('--json', action='store_true', help='вывести медианы в JSON')
+    args = parser.parse_args()
+
+    report = {}
+    for name in args.function or functions():
+        probe(name)  # прогрев кэша байткода, чтобы не мерить компиляцию .pyc
+        runs = [probe(name) for _ in range(args.runs)]
+        report[name] = {key: round(statistics.median(run[key] for run in runs), 2)
+                        for key in runs[0] if key.endswith(('_ms', '_us'))}
+        report[name]['invalid_status'] = runs[0]['invalid_status']
+        report[name]['heavy_loaded'] = runs[0]['heavy_loaded']
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f'{"function":16s} {"import":>9s} {"1st OPTIONS":>12s} {"1st 4xx":>10s} '
+          f'{"warm OPTIONS":>13s} {"warm 4xx":>9s}  heavy modules loaded')
+    for name, row in report.items():
+        print(f'{name:16s} {row["import_ms"]:7.1f}ms {row["first_options_us"]:10.1f}us '
+              f'{row["first_invalid_us"]:8.1f}us {row["warm_options_us"]:11.2f}us '
+              f'{row["warm_invalid_us"]:7.2f}us  {", ".join(row["heavy_loaded"]) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
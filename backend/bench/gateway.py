@@ -0,0 +1,450 @@
+"""Локальный шлюз: все функции из func2url.json в одном HTTP-сервере, как на платформе.
+
+HTTP-запрос превращается в event, который ждёт handler, ответ handler - в HTTP-ответ.
+Функция доступна по имени (/user-data?email=...) и по пути своего URL из func2url.json
+(/e7c5eaf3-...?email=...): фронтенду достаточно заменить хост https://functions.poehali.dev
+на адрес шлюза.
+
+Экземпляры функций повторяют масштабирование платформы: экземпляр обрабатывает один
+запрос за раз, новый создаётся, когда все заняты (холодный старт), их число ограничено
+--concurrency, сверх него запросы ждут --queue-timeout и получают 429. Экземпляры,
+простаивающие дольше --idle-timeout, закрываются, и следующий всплеск снова стартует холодным.
+
+--executor thread: модули загружаются один раз и остаются тёплыми, handler-ы выполняются
+в пуле из --workers потоков, холодный старт имитируется задержкой --cold-start-ms.
+--executor process: каждый экземпляр - отдельный процесс со своими импортами, пулами и
+кэшами, холодный старт настоящий (запуск интерпретатора и импорт index.py).
+
+Запуск:
+    python backend/bench/gateway.py --port 8000
+    python backend/bench/gateway.py --executor process --concurrency 2 --concurrency user-data=8 \\
+        --idle-timeout 30
+
+Счётчики экземпляров: GET /_gateway/stats.
+"""
+import argparse
+import base64
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from _loader import BACKEND_DIR, load_function
+
+# Тела этих типов передаются в event строкой, остальные - в base64 с isBase64Encoded, как на платформе
+TEXT_TYPES = ('application/json', 'application/x-ndjson', 'application/x-www-form-urlencoded', 'text/')
+# Заголовки соединения выставляет сам сервер шлюза
+HOP_BY_HOP = frozenset(('connection', 'keep-alive', 'transfer-encoding', 'content-length'))
+STATS_PATH = '/_gateway/stats'
+
+
+class InstanceError(Exception):
+    '''Экземпляр больше не может обрабатывать запросы (процесс завершился)'''
+
+
+class Context:
+    '''Минимальный context вызова: handler-ы функций его почти не используют'''
+
+    def __init__(self, function_name: str, request_id: str):
+        self.function_name = function_name
+        self.request_id = request_id
+        self.function_version = '$latest'
+        self.memory_limit_in_mb = 128
+
+
+def discover(include_all: bool = False) -> dict:
+    '''Маршруты шлюза: имя функции и путь её URL из func2url.json -> имя функции'''
+    with open(os.path.join(BACKEND_DIR, 'func2url.json')) as f:
+        urls = json.load(f)
+    names = set(urls)
+    if include_all:
+        names.update(os.listdir(BACKEND_DIR))
+    routes = {}
+    for name in sorted(names):
+        if not os.path.isfile(os.path.join(BACKEND_DIR, name, 'index.py')):
+            continue
+        routes[name] = name
+        url_path = urlsplit(urls.get(name, '')).path.strip('/')
+        if url_path:
+            routes[url_path] = name
+    return routes
+
+
+def make_event(method: str, target: str, headers: dict, body: bytes, client_ip: str) -> tuple:
+    '''HTTP-запрос в event функции; возвращает (первый сегмент пути - маршрут, event)'''
+    url = urlsplit(target)
+    route, _, rest = url.path.strip('/').partition('/')
+    query = parse_qs(url.query, keep_blank_values=True)
+    content_type = next((value for key, value in headers.items() if key.lower() == 'content-type'), '')
+    text = None
+    if content_type.startswith(TEXT_TYPES):
+        try:
+            text = body.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+    encoded = bool(body) and text is None
+    return route, {
+        'httpMethod': method,
+        'path': '/' + rest,
+        'headers': headers,
+        'queryStringParameters': {key: values[-1] for key, values in query.items()},
+        'multiValueQueryStringParameters': query,
+        'body': base64.b64encode(body).decode('ascii') if encoded else (text or ''),
+        'isBase64Encoded': encoded,
+        'requestContext': {
+            'requestId': str(uuid.uuid4()),
+            'httpMethod': method,
+            'identity': {'sourceIp': client_ip}
+        }
+    }
+
+
+def http_response(result: dict) -> tuple:
+    '''Ответ handler в (статус, заголовки, тело в байтах)'''
+    headers = dict(result.get('headers') or {})
+    for key, values in (result.get('multiValueHeaders') or {}).items():
+        headers[key] = ', '.join(values)
+    body = result.get('body') or ''
+    if result.get('isBase64Encoded'):
+        payload = base64.b64decode(body)
+    elif isinstance(body, (dict, list)):
+        payload = json.dumps(body, ensure_ascii=False).encode()
+    else:
+        payload = str(body).encode('utf-8')
+    return int(result.get('statusCode', 200)), headers, payload
+
+
+def error_response(status: int, message: str) -> tuple:
+    return status, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}, \
+        json.dumps({'error': message}).encode()
+
+
+class ThreadInstance:
+    '''Экземпляр в процессе шлюза: модуль функции общий и тёплый, handler выполняется в пуле потоков'''
+
+    def __init__(self, module, executor: ThreadPoolExecutor):
+        self.module = module
+        self.executor = executor
+
+    def invoke(self, event: dict, context: Context) -> dict:
+        return self.executor.submit(self.module.handler, event, context).result()
+
+    def close(self) -> None:
+        pass
+
+
+def _instance_main(name: str, conn) -> None:
+    '''Цикл процесса-экземпляра: загружает функцию и обрабатывает запросы по одному'''
+    module = load_function(name)
+    conn.send('ready')
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        event, function_name, request_id = message
+        try:
+            result = module.handler(event, Context(function_name, request_id))
+        except Exception as e:
+            result = {'statusCode': 502, 'body': json.dumps({'error': f'{type(e).__name__}: {e}'})}
+        conn.send(result)
+
+
+class ProcessInstance:
+    '''Экземпляр в отдельном процессе (spawn): свой интерпретатор, импорты и состояние модулей'''
+
+    def __init__(self, name: str, mp_context):
+        self.conn, child = mp_context.Pipe()
+        self.process = mp_context.Process(target=_instance_main, args=(name, child),
+                                          name=f'{name}-instance', daemon=True)
+        self.process.start()
+        child.close()
+        try:
+            self.conn.recv()
+        except EOFError:
+            self.process.join()
+            raise InstanceError(f'{name}: instance exited with code {self.process.exitcode}')
+
+    def invoke(self, event: dict, context: Context) -> dict:
+        try:
+            self.conn.send((event, context.function_name, context.request_id))
+            return self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise InstanceError(f'{context.function_name}: instance died ({e or type(e).__name__})')
+
+    def close(self) -> None:
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class FunctionPool:
+    '''Экземпляры одной функции: свободные переиспользуются, новые создаются до limit, дальше - очередь'''
+
+    def __init__(self, name: str, limit: int, factory, cold_start: float, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.factory = factory
+        self.cold_start = cold_start
+        self.queue_timeout = queue_timeout
+        self.invocations = 0
+        self.cold_starts = 0
+        self.throttled = 0
+        self.peak = 0
+        self._idle = []
+        self._count = 0
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        '''(экземпляр, холодный ли вызов) или None, если за queue_timeout экземпляр не освободился'''
+        deadline = time.monotonic() + self.queue_timeout
+        with self._cond:
+            self.invocations += 1
+            while not self._idle and self._count >= self.limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    self.throttled += 1
+                    return None
+            if self._idle:
+                # Последний освободившийся - самый тёплый; давно простаивающие успевают закрыться
+                return self._idle.pop()[0], False
+            self._count += 1
+            self.peak = max(self.peak, self._count)
+            self.cold_starts += 1
+
+        try:
+            instance = self.factory()
+        except Exception:
+            self._forget()
+            raise
+        instance.id = next(self._ids)
+        if self.cold_start:
+            time.sleep(self.cold_start)
+        return instance, True
+
+    def _forget(self) -> None:
+        with self._cond:
+            self._count -= 1
+            self._cond.notify()
+
+    def release(self, instance, broken: bool = False) -> None:
+        if broken:
+            self._forget()
+            instance.close()
+            return
+        with self._cond:
+            self._idle.append((instance, time.monotonic()))
+            self._cond.notify()
+
+    def reap(self, idle_timeout: float) -> None:
+        '''Закрывает экземпляры, простаивающие дольше idle_timeout'''
+        threshold = time.monotonic() - idle_timeout
+        with self._cond:
+            expired = [instance for instance, released_at in self._idle if released_at < threshold]
+            self._idle = [(instance, released_at) for instance, released_at in self._idle if released_at >= threshold]
+            self._count -= len(expired)
+        for instance in expired:
+            instance.close()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'invocations': self.invocations,
+                'coldStarts': self.cold_starts,
+                'throttled': self.throttled,
+                'instances': self._count,
+                'idle': len(self._idle),
+                'peakInstances': self.peak,
+                'limit': self.limit
+            }
+
+    def close(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+        for instance, _ in idle:
+            instance.close()
+
+
+class Gateway:
+    '''Маршрутизация запросов к пулам экземпляров функций и перевод HTTP в event и обратно'''
+
+    def __init__(self, routes: dict, executor: str, workers: int, limits: dict, default_limit: int,
+                 cold_start: float, queue_timeout: float, log: bool = True):
+        self.routes = routes
+        self.executor = executor
+        self.log = log
+        self._modules = {}
+        self._modules_lock = threading.Lock()
+        if executor == 'thread':
+            self._threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='handler')
+        else:
+            self._mp = multiprocessing.get_context('spawn')
+        self.pools = {
+            name: FunctionPool(name, limits.get(name, default_limit), self._factory(name), cold_start, queue_timeout)
+            for name in sorted(set(routes.values()))
+        }
+
+    def _module(self, name: str):
+        # Модуль загружается при первом вызове функции и живёт до остановки шлюза
+        with self._modules_lock:
+            if name not in self._modules:
+                self._modules[name] = load_function(name)
+            return self._modules[name]
+
+    def _factory(self, name: str):
+        if self.executor == 'thread':
+            return lambda: ThreadInstance(self._module(name), self._threads)
+        return lambda: ProcessInstance(name, self._mp)
+
+    def stats(self) -> dict:
+        return {'executor': self.executor, 'functions': {name: pool.stats() for name, pool in self.pools.items()}}
+
+    def handle(self, method: str, target: str, headers: dict, body: bytes, client_ip: str) -> tuple:
+        if method == 'GET' and urlsplit(target).path == STATS_PATH:
+            return 200, {'Content-Type': 'application/json'}, json.dumps(self.stats()).encode()
+        route, event = make_event(method, target, headers, body, client_ip)
+        name = self.routes.get(route)
+        if name is None:
+            return error_response(404, f'Function not found: /{route}')
+
+        pool = self.pools[name]
+        started = time.perf_counter()
+        try:
+            acquired = pool.acquire()
+        except Exception as e:
+            return error_response(502, f'{name}: instance failed to start ({type(e).__name__}: {e})')
+        if acquired is None:
+            return error_response(429, 'Too many requests')
+        instance, cold = acquired
+        broken = False
+        try:
+            status, response_headers, payload = http_response(
+                instance.invoke(event, Context(name, event['requestContext']['requestId']))
+            )
+        except InstanceError as e:
+            broken = True
+            status, response_headers, payload = error_response(502, str(e))
+        except Exception as e:
+            status, response_headers, payload = error_response(502, f'{type(e).__name__}: {e}')
+        finally:
+            pool.release(instance, broken)
+
+        elapsed = (time.perf_counter() - started) * 1e3
+        response_headers['X-Gateway-Instance'] = f'{name}#{instance.id}'
+        response_headers['X-Gateway-Cold-Start'] = '1' if cold else '0'
+        if self.log:
+            print(f'{name:16s} {method:7s} {status} {elapsed:8.1f} ms #{instance.id}{" cold" if cold else ""}',
+                  file=sys.stderr)
+        return status, response_headers, payload
+
+    def reap_forever(self, idle_timeout: float) -> None:
+        while True:
+            time.sleep(min(idle_timeout, 1.0))
+            for pool in self.pools.values():
+                pool.reap(idle_timeout)
+
+    def close(self) -> None:
+        for pool in self.pools.values():
+            pool.close()
+
+
+class GatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Очередь соединений по умолчанию (5) переполняется при параллельных клиентах: SYN повторяется через 1 с
+    request_queue_size = 128
+
+
+def make_request_handler(gateway: Gateway):
+    class RequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def handle_request(self) -> None:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            status, headers, payload = gateway.handle(self.command, self.path, dict(self.headers.items()),
+                                                      body, self.client_address[0])
+            self.send_response(status)
+            for key, value in headers.items():
+                if key.lower() not in HOP_BY_HOP:
+                    self.send_header(key, value)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(payload)
+
+        do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = do_HEAD = handle_request
+
+        def log_message(self, format: str, *args) -> None:
+            pass  # строка на запрос печатает Gateway.handle
+
+    return RequestHandler
+
+
+def parse_limits(values: list) -> tuple:
+    '''--concurrency N и --concurrency имя=N: (лимит по умолчанию, лимиты функций)'''
+    default_limit, limits = 4, {}
+    for value in values or ():
+        name, _, limit = value.rpartition('=')
+        if name:
+            limits[name] = int(limit)
+        else:
+            default_limit = int(limit)
+    return default_limit, limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--executor', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--workers', type=int, default=16, help='потоков для handler-ов в режиме thread')
+    parser.add_argument('--concurrency', action='append',
+                        help='экземпляров на функцию: N для всех или имя=N; по умолчанию 4')
+    parser.add_argument('--cold-start-ms', type=float, default=0.0,
+                        help='дополнительная задержка первого вызова нового экземпляра')
+    parser.add_argument('--idle-timeout', type=float, default=0.0,
+                        help='закрывать экземпляры, простаивающие дольше N секунд (0 - никогда)')
+    parser.add_argument('--queue-timeout', type=float, default=10.0,
+                        help='сколько запрос ждёт свободного экземпляра, прежде чем получить 429')
+    parser.add_argument('--all', action='store_true', help='добавить функции, которых нет в func2url.json')
+    parser.add_argument('--quiet', action='store_true', help='не печатать строку на каждый запрос')
+    args = parser.parse_args()
+
+    routes = discover(args.all)
+    default_limit, limits = parse_limits(args.concurrency)
+    gateway = Gateway(routes, args.executor, args.workers, limits, default_limit,
+                      args.cold_start_ms / 1000, args.queue_timeout, log=not args.quiet)
+    if args.idle_timeout:
+        threading.Thread(target=gateway.reap_forever, args=(args.idle_timeout,), daemon=True).start()
+
+    server = GatewayServer((args.host, args.port), make_request_handler(gateway))
+    for route, name in sorted(routes.items(), key=lambda item: (item[1], item[0] != item[1])):
+        print(f'http://{args.host}:{args.port}/{route} -> {name}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(gateway.stats(), indent=2), file=sys.stderr)
+        gateway.close()
+
+
+if __name__ == '__main__':
+    main()
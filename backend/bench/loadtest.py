@@ -0,0 +1,422 @@
+"""Нагрузочный тест функций backend: синтетические события, параллельные вызовы handler, локальные SMTP и PostgreSQL.
+
+Каждый сценарий вызывает handler функции из нескольких потоков и считает задержку
+(p50/p95/p99), пропускную способность и память на запрос. Письма уходят в локальную
+SMTP-заглушку (bench/smtp_sink.py), данные user-data берутся из локальной базы,
+заполненной --seed (миграции db_migrations должны быть применены).
+
+Запуск:
+    python backend/bench/loadtest.py --dsn postgresql://localhost/bench --seed \\
+        --concurrency 8 --requests 500 --output bench-baseline.json
+    python backend/bench/loadtest.py --dsn ... --baseline bench-baseline.json --output bench-new.json
+
+Без --dsn выполняются только сценарии, которым база не нужна.
+"""
+import argparse
+import base64
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+from _loader import BACKEND_DIR, load_function
+from smtp_sink import SMTPSink
+
+Scenario = namedtuple('Scenario', 'name function needs_db env make_event setup')
+
+BENCH_USER = 'bench-user-{}@example.com'
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'rps', 'mem_per_request_kb')
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    '''Процентиль по ближайшему рангу'''
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+@contextmanager
+def patched_env(overrides: dict):
+    '''Временно меняет окружение; None удаляет переменную'''
+    saved = {key: os.environ.get(key) for key in overrides}
+    for key, value in overrides.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def seed_database(dsn: str, users: int, projects_per_user: int, legal_entities: int) -> None:
+    '''Заполняет базу синтетическими юрлицами, проектами и связями bench-пользователей'''
+    import psycopg2
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cursor:
+        cursor.execute("DELETE FROM user_projects WHERE user_email LIKE 'bench-user-%'")
+        cursor.execute("DELETE FROM projects WHERE title LIKE 'bench-project-%'")
+        cursor.execute("DELETE FROM legal_entities WHERE name LIKE 'bench-le-%'")
+        cursor.execute(
+            """
+            INSERT INTO legal_entities (name, inn, kpp, ogrn, legal_address, actual_address,
+                                        director_name, phone, email)
+            SELECT 'bench-le-' || g, '99' || lpad(g::text, 10, '0'), '770101001', lpad(g::text, 13, '1'),
+                   'г. Москва, ул. Тестовая, д. ' || g, 'г. Москва, ул. Тестовая, д. ' || g,
+                   'Иванов Иван Иванович', '+7 495 000-00-00', 'le' || g || '@example.com'
+            FROM generate_series(1, %s) AS g
+            """,
+            (legal_entities,)
+        )
+        cursor.execute(
+            """
+            WITH entities AS (
+                SELECT array_agg(id ORDER BY id) AS ids FROM legal_entities WHERE name LIKE 'bench-le-%%'
+            )
+            INSERT INTO projects (title, description, legal_entity_id, status, start_date, end_date, budget, created_at)
+            SELECT 'bench-project-' || g,
+                   'Монтаж слаботочных систем, этап ' || g,
+                   CASE WHEN g %% 10 = 0 THEN NULL ELSE entities.ids[1 + g %% array_length(entities.ids, 1)] END,
+                   (ARRAY['active', 'completed', 'paused', 'planning'])[1 + g %% 4],
+                   DATE '2024-01-01' + (g %% 365),
+                   DATE '2024-06-01' + (g %% 365),
+                   100000 + (g * 7919) %% 9000000 + 0.5,
+                   CURRENT_TIMESTAMP - g * INTERVAL '17 minutes'
+            FROM generate_series(1, %s) AS g, entities
+            """,
+            (users * projects_per_user,)
+        )
+        cursor.execute(
+            """
+            INSERT INTO user_projects (user_email, project_id, role)
+            SELECT 'bench-user-' || (substring(p.title from 15)::int %% %s) || '@example.com', p.id,
+                   CASE WHEN p.id %% 7 = 0 THEN 'employee' ELSE 'client' END
+            FROM projects p WHERE p.title LIKE 'bench-project-%%'
+            """,
+            (users,)
+        )
+
+
+def multipart_body(fields: dict, files: list, boundary: str) -> bytes:
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, content_type, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts)
+
+
+def build_scenarios(args) -> list:
+    rng_lock = threading.Lock()
+    rng = random.Random(args.random_seed)
+    attachment = os.urandom(args.attachment_kb * 1024)
+    attachment_b64 = base64.b64encode(attachment).decode()
+    direct = {'DATABASE_URL': None} if args.mode == 'direct' else {}
+
+    def client_ip(index: int) -> dict:
+        return {'identity': {'sourceIp': f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}'}}
+
+    def lead(index: int) -> dict:
+        return {
+            'name': f'Нагрузочный тест {index}',
+            'email': f'lead{index}@example.com',
+            'phone': '+7 999 123-45-67',
+            'company': 'ООО "Тест"',
+            'message': f'Интересует монтаж СКУД и видеонаблюдения, заявка {index} {time.time_ns()}',
+            'systems': ['skud', 'sot']
+        }
+
+    def contact_event(index: int) -> dict:
+        return {'httpMethod': 'POST', 'requestContext': client_ip(index), 'body': json.dumps(lead(index))}
+
+    def send_email_event(index: int) -> dict:
+        body = {**lead(index), 'file': {'name': 'spec.pdf', 'type': 'application/pdf', 'content': attachment_b64}}
+        return {'httpMethod': 'POST', 'requestContext': client_ip(index), 'body': json.dumps(body)}
+
+    def send_email_multipart_event(index: int) -> dict:
+        fields = lead(index)
+        systems = fields.pop('systems')
+        body = multipart_body({**fields, 'systems': systems[0]},
+                              [('file', 'spec.pdf', 'application/pdf', attachment)], 'bench-boundary')
+        return {
+            'httpMethod': 'POST',
+            'requestContext': client_ip(index),
+            'headers': {'Content-Type': 'multipart/form-data; boundary=bench-boundary'},
+            'body': base64.b64encode(body).decode(),
+            'isBase64Encoded': True
+        }
+
+    def invitation_event(index: int) -> dict:
+        return {'httpMethod': 'POST', 'body': json.dumps({
+            'email': f'invitee{index}@example.com', 'name': f'Пользователь {index}',
+            'password': 'Bench-Passw0rd', 'role': ('client', 'employee', 'editor')[index % 3]
+        })}
+
+    def random_user() -> str:
+        with rng_lock:
+            return BENCH_USER.format(rng.randrange(args.users))
+
+    def user_data_page_event(index: int) -> dict:
+        return {'httpMethod': 'GET', 'queryStringParameters': {'email': random_user(), 'limit': '50'}}
+
+    def user_data_full_event(index: int) -> dict:
+        return {'httpMethod': 'GET', 'queryStringParameters': {'email': random_user()}}
+
+    def outbox_event(index: int) -> dict:
+        return {'httpMethod': 'POST'}
+
+    def fill_outbox() -> None:
+        from shared import outbox
+        from shared.templates import Rendered
+        for index in range(args.requests * int(os.environ['OUTBOX_BATCH_SIZE'])):
+            msg = Rendered(f'<p>Письмо {index}</p>', f'Письмо {index}\n').mime()
+            msg['Subject'] = f'bench {index}'
+            msg['From'] = 'bench@example.com'
+            msg['To'] = 'inbox@example.com'
+            outbox.enqueue(msg, 'bench', 'bench@example.com')
+
+    return [
+        Scenario('contact', 'contact', False, direct, contact_event, None),
+        Scenario('send-email', 'send-email', False, direct, send_email_event, None),
+        Scenario('send-email-multipart', 'send-email', False, direct, send_email_multipart_event, None),
+        Scenario('send-invitation', 'send-invitation', False, {}, invitation_event, None),
+        Scenario('user-data-page', 'user-data', True, {}, user_data_page_event, None),
+        Scenario('user-data-full', 'user-data', True, {}, user_data_full_event, None),
+        Scenario('mail-outbox', 'mail-outbox', True, {}, outbox_event, fill_outbox),
+    ]
+
+
+def measure_memory(handler, make_event, samples: int) -> float:
+    '''Средний пик выделенной памяти на один вызов, КБ (отдельный последовательный прогон под tracemalloc)'''
+    tracemalloc.start()
+    peaks = []
+    try:
+        for index in range(samples):
+            event = make_event(10_000_000 + index)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            handler(event, None)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return sum(peaks) / len(peaks) / 1024 if peaks else 0.0
+
+
+def run_scenario(scenario: Scenario, handler, args) -> dict:
+    for index in range(args.warmup):
+        handler(scenario.make_event(20_000_000 + index), None)
+
+    latencies = [0.0] * args.requests
+    statuses = Counter()
+    statuses_lock = threading.Lock()
+    counter = itertools.count()
+
+    def worker() -> None:
+        local = Counter()
+        while True:
+            index = next(counter)
+            if index >= args.requests:
+                break
+            event = scenario.make_event(index)
+            start = time.perf_counter()
+            try:
+                status = handler(event, None)['statusCode']
+            except Exception as e:
+                status = f'exception:{type(e).__name__}'
+            latencies[index] = time.perf_counter() - start
+            local[status] += 1
+        with statuses_lock:
+            statuses.update(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    errors = sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 500)
+    return {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'errors': errors,
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        'rps': round(args.requests / wall, 1),
+        'p50_ms': round(percentile(ordered, 50) * 1e3, 3),
+        'p95_ms': round(percentile(ordered, 95) * 1e3, 3),
+        'p99_ms': round(percentile(ordered, 99) * 1e3, 3),
+        'max_ms': round(ordered[-1] * 1e3, 3),
+        'mem_per_request_kb': round(measure_memory(handler, scenario.make_event, args.memory_samples), 1),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    '''Печатает изменения относительно базового прогона и возвращает сценарии с регрессией'''
+    regressions = []
+    print(f'\n{"scenario":22s}' + ''.join(f'{metric:>22s}' for metric in METRICS))
+    for name, row in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base or 'skipped' in row or 'skipped' in base:
+            continue
+        cells = []
+        for metric in METRICS:
+            old, new = base.get(metric), row.get(metric)
+            if not old:
+                cells.append(f'{"-":>22s}')
+                continue
+            change = (new - old) / old
+            cells.append(f'{old:>9.2f} -> {new:<9.2f}{change:+.0%}'.rjust(22))
+            worse = -change if metric == 'rps' else change
+            if metric in ('p95_ms', 'rps') and worse > max_regression:
+                regressions.append(f'{name}: {metric} {old} -> {new}')
+        print(f'{name:22s}' + ''.join(cells))
+    return regressions
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--scenario', action='append', help='имя сценария; по умолчанию все')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help='запросов на сценарий')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--memory-samples', type=int, default=20)
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'), help='PostgreSQL для user-data и очереди')
+    parser.add_argument('--seed', action='store_true', help='заполнить базу синтетическими данными')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--projects-per-user', type=int, default=25)
+    parser.add_argument('--legal-entities', type=int, default=300)
+    parser.add_argument('--mode', choices=('direct', 'outbox'), default='direct',
+                        help='direct - формы отправляют письма сразу, outbox - ставят в очередь (нужен --dsn)')
+    parser.add_argument('--io', choices=('sync', 'async'), default='sync',
+                        help='async - функции с ASYNC_IO=1 (асинхронные SMTP и PostgreSQL)')
+    parser.add_argument('--smtp-latency-ms', type=float, default=0.0, help='задержка SMTP-заглушки на DATA')
+    parser.add_argument('--smtp', help='host:port внешней заглушки (smtp_sink.py в отдельном процессе не делит GIL с функциями)')
+    parser.add_argument('--attachment-kb', type=int, default=64)
+    parser.add_argument('--random-seed', type=int, default=1)
+    parser.add_argument('--output', help='куда записать результаты в JSON')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='допустимое ухудшение p95 и rps (доля), иначе код выхода 1')
+    args = parser.parse_args()
+
+    sink = None
+    if args.smtp:
+        smtp_host, _, smtp_port = args.smtp.rpartition(':')
+    else:
+        sink = SMTPSink(latency=args.smtp_latency_ms / 1000).start()
+        smtp_host, smtp_port = sink.host, sink.port
+    os.environ.update({
+        'SMTP_HOST': smtp_host,
+        'SMTP_PORT': str(smtp_port),
+        'SMTP_STARTTLS': '0',
+        'SMTP_USER': 'bench@example.com',
+        'SMTP_EMAIL': 'bench@example.com',
+        'SMTP_PASSWORD': 'bench',
+        'RECIPIENT_EMAIL': 'inbox@example.com',
+        'RATE_LIMIT_PER_IP': '0',
+        'RATE_LIMIT_PER_EMAIL': '0',
+        'OUTBOX_BATCH_SIZE': '10',
+        'TELEMETRY_LOG': '0',
+        'ASYNC_IO': '1' if args.io == 'async' else '0'
+    })
+    # Модуль общий для всех функций (shared - симлинки на один каталог); импорт после TELEMETRY_LOG
+    sys.path.insert(0, BACKEND_DIR)
+    from shared import telemetry
+    if args.dsn:
+        os.environ['DATABASE_URL'] = args.dsn
+        if args.seed:
+            seed_database(args.dsn, args.users, args.projects_per_user, args.legal_entities)
+    else:
+        os.environ.pop('DATABASE_URL', None)
+
+    handlers = {}
+    results = {}
+    for scenario in build_scenarios(args):
+        if args.scenario and scenario.name not in args.scenario:
+            continue
+        if (scenario.needs_db or args.mode == 'outbox') and not args.dsn:
+            results[scenario.name] = {'skipped': 'нужен --dsn'}
+            continue
+        if scenario.function not in handlers:
+            handlers[scenario.function] = load_function(scenario.function).handler
+        with patched_env(scenario.env):
+            if scenario.setup:
+                scenario.setup()
+            sent_before = sink.messages if sink else 0
+            long_before = sink.long_lines if sink else 0
+            telemetry.reset()
+            row = run_scenario(scenario, handlers[scenario.function], args)
+            if sink:
+                row['smtp_messages'] = sink.messages - sent_before
+                # Должно быть 0: длинные строки почтовые серверы отклоняют или портят
+                row['smtp_long_lines'] = sink.long_lines - long_before
+            row['phases_mean_ms'] = {
+                phase: round(data['sum_ms'] / data['count'], 3)
+                for phase, data in telemetry.histograms().get(scenario.function, {}).items()
+            }
+        results[scenario.name] = row
+        print(f'{scenario.name:22s} rps={row["rps"]:>8.1f} p50={row["p50_ms"]:>8.2f}ms p95={row["p95_ms"]:>8.2f}ms '
+              f'p99={row["p99_ms"]:>8.2f}ms mem={row["mem_per_request_kb"]:>8.1f}KB '
+              f'errors={row["errors"]} statuses={row["statuses"]}')
+
+    if sink:
+        sink.stop()
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'mode': args.mode,
+            'io': args.io,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'smtp_latency_ms': args.smtp_latency_ms,
+            'attachment_kb': args.attachment_kb,
+            'database': bool(args.dsn),
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print('\nРегрессии:\n  ' + '\n  '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Микробенчмарк сериализации ответа user-data на 10 000 проектов: прежний путь против shared.serializer.
+
+Прежний путь - float/str для каждой строки и json.dumps; новый - Decimal и date как есть,
+shared.serializer со stdlib json и с orjson (если установлен).
+
+Запуск: python backend/bench/serializer_bench.py [--projects N] [--number N]
+"""
+import argparse
+import datetime
+import json
+import random
+import timeit
+from decimal import Decimal
+
+from _loader import load_function
+
+
+def make_rows(count: int) -> list:
+    '''Строки в том виде, в каком их отдаёт RealDictCursor для PROJECTS_QUERY'''
+    rng = random.Random(1)
+    rows = []
+    for index in range(count):
+        start = datetime.date(2023, 1, 1) + datetime.timedelta(days=rng.randrange(700))
+        legal_entity_id = rng.randrange(1, 300) if index % 5 else None
+        rows.append({
+            'project_id': index + 1,
+            'title': f'Проект {index}',
+            'description': 'Монтаж слаботочных систем на объекте заказчика, этап работ ' * 2,
+            'status': rng.choice(('active', 'completed', 'paused')),
+            'start_date': start,
+            'end_date': start + datetime.timedelta(days=rng.randrange(30, 365)),
+            'budget': Decimal(rng.randrange(10 ** 5, 10 ** 13)) / 100,
+            'created_at': datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=index),
+            'user_role': 'client',
+            'legal_entity_id': legal_entity_id,
+            'legal_entity_name': f'ООО "Компания {legal_entity_id}"',
+            'inn': f'{7700000000 + (legal_entity_id or 0)}',
+            'kpp': '770001001',
+            'ogrn': '1027700000000',
+            'legal_address': 'г. Москва, ул. Примерная, д. 1',
+            'actual_address': 'г. Москва, ул. Примерная, д. 1',
+            'director_name': 'Иванов Иван Иванович',
+            'legal_entity_phone': '+7 495 000-00-00',
+            'legal_entity_email': 'office@example.com'
+        })
+    return rows
+
+
+def legacy_project_payload(row: dict) -> dict:
+    '''project_payload до shared.serializer: преобразование типов в каждой строке'''
+    return {
+        'id': row['project_id'],
+        'title': row['title'],
+        'description': row['description'],
+        'status': row['status'],
+        'startDate': str(row['start_date']) if row['start_date'] else None,
+        'endDate': str(row['end_date']) if row['end_date'] else None,
+        'budget': float(row['budget']) if row['budget'] else None,
+        'userRole': row['user_role']
+    }
+
+
+def payload(module, rows: list, project_payload) -> dict:
+    return {
+        'userEmail': 'bench@example.com',
+        'projects': [
+            {
+                'project': project_payload(row),
+                'legalEntity': module.legal_entity_payload(row) if row['legal_entity_id'] else None
+            }
+            for row in rows
+        ],
+        'nextCursor': None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--projects', type=int, default=10000)
+    parser.add_argument('--number', type=int, default=5)
+    args = parser.parse_args()
+
+    module = load_function('user-data')
+    from shared import serializer
+    rows = make_rows(args.projects)
+
+    def legacy() -> str:
+        return json.dumps(payload(module, rows, legacy_project_payload))
+
+    def with_backend(name: str):
+        def run() -> str:
+            serializer.use(name)
+            return serializer.dumps(payload(module, rows, module.project_payload))
+        return run
+
+    cases = [('legacy float/str + json.dumps', legacy), ('serializer, stdlib json', with_backend('json'))]
+    serializer.use('orjson')
+    if serializer.backend() == 'orjson':
+        cases.append(('serializer, orjson', with_backend('orjson')))
+    else:
+        print('orjson не установлен - сравнивается только stdlib')
+
+    reference = json.loads(legacy())
+    for label, fn in cases:
+        body = fn()
+        assert json.loads(body) == reference, f'{label}: ответ отличается от прежнего'
+        best = min(timeit.repeat(fn, number=args.number, repeat=5)) / args.number
+        print(f'{label:34s} {best * 1e3:8.2f} ms/response {len(body.encode()) / 1024:8.0f} KB')
+
+
+if __name__ == '__main__':
+    main()
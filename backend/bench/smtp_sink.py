@@ -0,0 +1,114 @@
+"""Локальная SMTP-заглушка для нагрузочных тестов: принимает любые письма и только считает их.
+
+Поддерживает подмножество SMTP, которым пользуется shared.smtp_pool: EHLO, AUTH PLAIN/LOGIN,
+MAIL, RCPT, DATA, NOOP, RSET, QUIT. TLS нет - функции запускаются с SMTP_STARTTLS=0.
+
+Запуск отдельно: python backend/bench/smtp_sink.py [--port 2525] [--latency-ms 0]
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+# Строки письма длиннее этого считаются ошибкой формирования (RFC 5322 рекомендует не больше 78 символов)
+MAX_LINE = 78
+EHLO_REPLY = b'250-bench-sink\r\n250-AUTH PLAIN LOGIN\r\n250-8BITMIME\r\n250 SIZE 104857600\r\n'
+
+
+class _Session(socketserver.StreamRequestHandler):
+    def reply(self, line: bytes) -> None:
+        self.wfile.write(line)
+        self.wfile.flush()
+
+    def handle(self):
+        sink = self.server.sink
+        self.reply(b'220 bench-sink ESMTP\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.reply(EHLO_REPLY)
+            elif command == b'AUTH':
+                if line.split()[1:2] == [b'LOGIN']:
+                    self.reply(b'334 VXNlcm5hbWU6\r\n')
+                    self.rfile.readline()
+                    self.reply(b'334 UGFzc3dvcmQ6\r\n')
+                    self.rfile.readline()
+                elif len(line.split()) < 3:
+                    self.reply(b'334 \r\n')
+                    self.rfile.readline()
+                self.reply(b'235 Authentication successful\r\n')
+            elif command == b'DATA':
+                self.reply(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                size = long_lines = 0
+                for data_line in self.rfile:
+                    if data_line == b'.\r\n':
+                        break
+                    size += len(data_line)
+                    if len(data_line.rstrip(b'\r\n')) > MAX_LINE:
+                        long_lines += 1
+                if sink.latency:
+                    time.sleep(sink.latency)
+                sink.record(size, long_lines)
+                self.reply(b'250 OK queued\r\n')
+            elif command == b'QUIT':
+                self.reply(b'221 Bye\r\n')
+                return
+            elif command in (b'HELO', b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                self.reply(b'250 OK\r\n')
+            else:
+                self.reply(b'502 Command not implemented\r\n')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    '''SMTP-сервер в фоновом потоке; latency - задержка ответа на DATA, как у реального провайдера'''
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        self.latency = latency
+        self.messages = 0
+        self.bytes = 0
+        self.long_lines = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Session)
+        self._server.sink = self
+        self.host, self.port = self._server.server_address
+
+    def record(self, size: int, long_lines: int = 0) -> None:
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+            self.long_lines += long_lines
+
+    def start(self) -> 'SMTPSink':
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    args = parser.parse_args()
+    sink = SMTPSink(port=args.port, latency=args.latency_ms / 1000).start()
+    print(f'SMTP sink on {sink.host}:{sink.port}')
+    try:
+        while True:
+            time.sleep(5)
+            print(f'messages={sink.messages} bytes={sink.bytes} long_lines={sink.long_lines}')
+    except KeyboardInterrupt:
+        sink.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Микробенчмарк отрисовки письма send-email: f-строки в обработчике против скомпилированного шаблона.
+
+Запуск: python backend/bench/templates_bench.py [--number N]
+"""
+import argparse
+import html
+import timeit
+
+from _loader import load_function
+
+FIELDS = {
+    'name': 'Иван Петров',
+    'email': 'ivan@example.com',
+    'phone': '+7 999 123-45-67',
+    'company': 'ООО "Тест" & партнёры',
+    'message': 'Интересует монтаж системы видеонаблюдения и СКУД на объекте <площадью 2000 м2>',
+    'systems': ['sot', 'skud', 'sks', 'unknown']
+}
+
+
+def render_legacy(name, email, phone, company, message, systems):
+    '''Отрисовка в том виде, в каком она была в обработчике до перехода на shared.templates'''
+    systems_labels = {
+        'sks': 'СКС - Структурированные кабельные системы',
+        'saps': 'САПС - Система автоматической пожарной сигнализации',
+        'soue': 'СОУЭ - Система оповещения и управления эвакуацией',
+        'skud': 'СКУД - Система контроля и управления доступом',
+        'sots': 'СОТС - Система охранно-тревожной сигнализации',
+        'sot': 'СОТ - Система охранного телевидения',
+        'askue': 'АСКУЭ - Автоматизированная система коммерческого учета электроэнергии',
+        'eom': 'ЭОМ - Электрооборудование и молниезащита',
+        'ovik': 'ОВИК - Отопление, вентиляция и кондиционирование'
+    }
+
+    systems_text = ''
+    if systems:
+        systems_list = '<ul style="margin: 5px 0; padding-left: 20px;">'
+        for sys_id in systems:
+            systems_list += f'<li>{systems_labels.get(sys_id, sys_id)}</li>'
+        systems_list += '</ul>'
+        systems_text = f"""
+            <tr>
+                <td style="padding: 10px; border-bottom: 1px solid #eee; vertical-align: top;"><strong>Интересующие системы:</strong></td>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;">{systems_list}</td>
+            </tr>
+        """
+
+    company_text = ''
+    if company:
+        company_text = f"""
+            <tr>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;"><strong>Компания:</strong></td>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;">{company}</td>
+            </tr>
+        """
+
+    return f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+        <h2 style="color: #ff6b35;">Новая заявка с сайта</h2>
+        <table style="width: 100%; border-collapse: collapse;">
+            <tr>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;"><strong>Имя:</strong></td>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;">{name}</td>
+            </tr>
+            <tr>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;"><strong>Email:</strong></td>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;"><a href="mailto:{email}">{email}</a></td>
+            </tr>
+            <tr>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;"><strong>Телефон:</strong></td>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;">{phone if phone else 'Не указан'}</td>
+            </tr>
+            {company_text}
+            {systems_text}
+            <tr>
+                <td style="padding: 10px; vertical-align: top;"><strong>Сообщение:</strong></td>
+                <td style="padding: 10px;">{message}</td>
+            </tr>
+        </table>
+    </body>
+    </html>
+    """
+
+
+def render_legacy_equivalent(name, email, phone, company, message, systems):
+    '''То же, что делает шаблон сейчас, но без предкомпиляции: экранирование и текстовая часть на каждый вызов'''
+    from shared.templates import html_to_text
+    escaped = {key: html.escape(value) for key, value in (('name', name), ('email', email), ('phone', phone),
+                                                          ('company', company), ('message', message))}
+    html_body = render_legacy(systems=systems, **escaped)
+    return html_body, html_to_text(html_body)
+
+
+def render_compiled(module, name, email, phone, company, message, systems):
+    return module.LEAD_TEMPLATE.render(
+        name=name,
+        email=email,
+        phone=phone or 'Не указан',
+        company_row=module.COMPANY_ROW.render(company=company) if company else '',
+        systems_row=module.render_systems_row(tuple(str(sys_id) for sys_id in systems)) if systems else '',
+        message=message
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    module = load_function('send-email')
+    cases = [
+        ('legacy f-string (html only, no escaping)', lambda: render_legacy(**FIELDS)),
+        ('legacy f-string + escaping + text part', lambda: render_legacy_equivalent(**FIELDS)),
+        ('compiled template (html + text, escaped)', lambda: render_compiled(module, **FIELDS)),
+    ]
+    for label, fn in cases:
+        best = min(timeit.repeat(fn, number=args.number, repeat=5)) / args.number
+        print(f'{label:42s} {best * 1e6:8.2f} us/render')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,137 +1,117 @@
-import json
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from shared import aio, digest, idempotency, leads, outbox, ratelimit
+from shared.http import HttpError, endpoint, json_body, response
+from shared.smtp_router import get_router
+from shared.telemetry import span
+from shared.templates import EmailTemplate
 
+CONTACT_TEMPLATE = EmailTemplate("""
+    <html>
+    <body style="font-family: Arial, sans-serif; color: #333;">
+        <h2 style="color: #0EA5E9;">Новая заявка с сайта TechIntegrator</h2>
+        <table style="border-collapse: collapse; width: 100%; max-width: 600px;">
+            <tr>
+                <td style="padding: 10px; border-bottom: 1px solid #eee; font-weight: bold;">Имя:</td>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;">{{ name }}</td>
+            </tr>
+            <tr>
+                <td style="padding: 10px; border-bottom: 1px solid #eee; font-weight: bold;">Email:</td>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;">{{ email }}</td>
+            </tr>
+            <tr>
+                <td style="padding: 10px; border-bottom: 1px solid #eee; font-weight: bold;">Телефон:</td>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;">{{ phone }}</td>
+            </tr>
+            <tr>
+                <td style="padding: 10px; border-bottom: 1px solid #eee; font-weight: bold;">Компания:</td>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;">{{ company }}</td>
+            </tr>
+            <tr>
+                <td style="padding: 10px; vertical-align: top; font-weight: bold;">Сообщение:</td>
+                <td style="padding: 10px;">{{ message }}</td>
+            </tr>
+        </table>
+    </body>
+    </html>
+    """)
+
+@endpoint(methods=('POST',), allow_headers='Content-Type, Idempotency-Key', max_age=86400,
+          error_prefix='Ошибка отправки: ', bad_body='Неверный формат данных')
 def handler(event: dict, context) -> dict:
     """Обработка заявок с контактной формы и отправка на email"""
     
-    method = event.get('httpMethod', 'POST')
+    ip = ratelimit.source_ip(event)
+    limited = ratelimit.check('contact', 'ip', ip)
+    if limited is not None:
+        return limited
+    
+    body = json_body(event)
+    
+    name = body.get('name', '').strip()
+    email = body.get('email', '').strip()
+    phone = body.get('phone', '').strip()
+    company = body.get('company', '').strip()
+    message = body.get('message', '').strip()
+    
+    if not name or not email or not message:
+        raise HttpError(400, 'Заполните обязательные поля: имя, email, сообщение')
+    
+    too_long = leads.too_long(body)
+    if too_long:
+        raise HttpError(400, f'Слишком длинное поле: {too_long}')
+    
+    request_key = idempotency.request_key(event, 'contact', (name, email, message))
+    limited = ratelimit.check('contact', 'email', email)
+    if limited is not None:
+        # Повтор уже принятой заявки получает сохранённый ответ, а не 429
+        return idempotency.stored(request_key) or limited
+    
+    smtp_host = os.environ.get('SMTP_HOST', 'smtp.mail.ru')
+    smtp_port = int(os.environ.get('SMTP_PORT', '465'))
+    smtp_email = os.environ.get('SMTP_EMAIL')
+    smtp_password = os.environ.get('SMTP_PASSWORD')
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+    if not smtp_email or not smtp_password:
+        raise HttpError(500, 'SMTP не настроен')
     
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+    replay = idempotency.claim(request_key)
+    if replay is not None:
+        ratelimit.refund('contact', ('ip', ip), ('email', email))
+        return replay
     
+    fields = {'name': name, 'email': email, 'phone': phone, 'company': company, 'message': message}
     try:
-        body = json.loads(event.get('body', '{}'))
-        
-        name = body.get('name', '').strip()
-        email = body.get('email', '').strip()
-        phone = body.get('phone', '').strip()
-        company = body.get('company', '').strip()
-        message = body.get('message', '').strip()
-        
-        if not name or not email or not message:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Заполните обязательные поля: имя, email, сообщение'})
-            }
-        
-        smtp_email = os.environ.get('SMTP_EMAIL')
-        smtp_password = os.environ.get('SMTP_PASSWORD')
-        
-        if not smtp_email or not smtp_password:
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'SMTP не настроен'})
-            }
-        
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = f'Новая заявка с сайта от {name}'
-        msg['From'] = smtp_email
-        msg['To'] = smtp_email
-        
-        html_body = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; color: #333;">
-            <h2 style="color: #0EA5E9;">Новая заявка с сайта TechIntegrator</h2>
-            <table style="border-collapse: collapse; width: 100%; max-width: 600px;">
-                <tr>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee; font-weight: bold;">Имя:</td>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee;">{name}</td>
-                </tr>
-                <tr>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee; font-weight: bold;">Email:</td>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee;">{email}</td>
-                </tr>
-                <tr>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee; font-weight: bold;">Телефон:</td>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee;">{phone if phone else 'Не указан'}</td>
-                </tr>
-                <tr>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee; font-weight: bold;">Компания:</td>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee;">{company if company else 'Не указана'}</td>
-                </tr>
-                <tr>
-                    <td style="padding: 10px; vertical-align: top; font-weight: bold;">Сообщение:</td>
-                    <td style="padding: 10px;">{message}</td>
-                </tr>
-            </table>
-        </body>
-        </html>
-        """
-        
-        html_part = MIMEText(html_body, 'html', 'utf-8')
-        msg.attach(html_part)
-        
-        with smtplib.SMTP_SSL('smtp.mail.ru', 465) as server:
-            server.login(smtp_email, smtp_password)
-            server.send_message(msg)
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'success': True,
-                'message': 'Заявка успешно отправлена'
-            })
-        }
+        if digest.is_enabled():
+            # Отдельное письмо не собирается: заявка попадёт в сводное
+            digest.add('contact', fields, smtp_email, smtp_email)
+            result = response(200, {'success': True, 'message': 'Заявка принята'})
+        else:
+            with span('render'):
+                rendered = CONTACT_TEMPLATE.render(
+                    name=name,
+                    email=email,
+                    phone=phone or 'Не указан',
+                    company=company or 'Не указана',
+                    message=message
+                )
+                msg = rendered.mime()
+                msg['Subject'] = f'Новая заявка с сайта от {name}'
+                msg['From'] = smtp_email
+                msg['To'] = smtp_email
+            
+            if outbox.is_enabled():
+                leads.enqueue(msg, 'contact', smtp_email, fields)
+                result = response(200, {'success': True, 'message': 'Заявка принята'})
+            else:
+                router = get_router(smtp_host, smtp_port, smtp_email, smtp_password)
+                if aio.ENABLED:
+                    aio.run(router.send_message_async(msg))
+                else:
+                    router.send_message(msg)
+                result = response(200, {'success': True, 'message': 'Заявка успешно отправлена'})
+    except Exception:
+        idempotency.release(request_key)
+        raise
     
-    except json.JSONDecodeError:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Неверный формат данных'})
-        }
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': f'Ошибка отправки: {str(e)}'})
-        }
+    idempotency.complete(request_key, result)
+    return result
@@ -0,0 +1,206 @@
+import base64
+import csv
+import hmac
+import io
+import json
+import os
+from datetime import date, datetime, timedelta
+from shared import serializer
+from shared.db import get_pool
+from shared.http import CORS_HEADERS, HttpError, endpoint, request_headers, response
+from shared.telemetry import annotate
+
+# Строк в одном ответе; продолжение выгрузки - по курсору из заголовка X-Next-Cursor
+PAGE_ROWS = int(os.environ.get('EXPORT_PAGE_ROWS', '20000'))
+# Строк за одно обращение к серверному курсору: память функции не зависит от размера периода
+FETCH_ROWS = 2000
+
+LEADS_QUERY = """
+    SELECT
+        l.id,
+        l.created_at,
+        l.source,
+        l.name,
+        l.email,
+        l.phone,
+        l.company,
+        l.message,
+        l.systems,
+        l.attachments,
+        o.status AS delivery
+    FROM leads l
+    LEFT JOIN mail_outbox o ON o.id = l.outbox_id
+    WHERE l.created_at >= %s AND l.created_at < %s {after}
+    ORDER BY l.created_at, l.id
+    LIMIT %s
+"""
+
+AFTER_CONDITION = 'AND (l.created_at, l.id) > (%s, %s)'
+
+CSV_COLUMNS = ('id', 'created_at', 'source', 'name', 'email', 'phone', 'company', 'message',
+               'systems', 'attachments', 'delivery')
+# Ячейки с такого символа Excel считает формулой: в начало добавляется апостроф
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+def encode_cursor(created_at: datetime, lead_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), lead_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    created_at, lead_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    return datetime.fromisoformat(created_at), int(lead_id)
+
+
+def check_token(event: dict) -> None:
+    token = os.environ.get('EXPORT_TOKEN')
+    if not token:
+        raise HttpError(500, 'Export token not configured')
+    if not hmac.compare_digest(request_headers(event).get('x-export-token', ''), token):
+        raise HttpError(401, 'Invalid export token')
+
+
+def read_request(params: dict) -> tuple:
+    '''Период (to включительно), формат и курсор продолжения; ошибки - HttpError 400'''
+    export_format = params.get('format', 'csv')
+    if export_format not in CONTENT_TYPES:
+        raise HttpError(400, 'Format must be csv or ndjson')
+    if not params.get('from'):
+        raise HttpError(400, 'Parameter from is required')
+    try:
+        start = date.fromisoformat(params['from'])
+        end = date.fromisoformat(params['to']) if params.get('to') else date.today()
+        after = decode_cursor(params['cursor']) if params.get('cursor') else None
+    except (ValueError, TypeError):
+        raise HttpError(400, 'Invalid date range or cursor')
+    if end < start:
+        raise HttpError(400, 'Invalid date range or cursor')
+    return start, end, export_format, after
+
+
+def csv_cell(value) -> str:
+    if value is None:
+        return ''
+    text = str(value)
+    return "'" + text if text.startswith(FORMULA_PREFIXES) else text
+
+
+def csv_row(row: tuple) -> list:
+    lead_id, created_at, source, name, email, phone, company, message, systems, attachments, delivery = row
+    return [
+        lead_id,
+        created_at.isoformat(sep=' ', timespec='seconds'),
+        source,
+        csv_cell(name),
+        csv_cell(email),
+        csv_cell(phone),
+        csv_cell(company),
+        csv_cell(message),
+        csv_cell(';'.join(systems)),
+        csv_cell(';'.join(attachment['name'] or '' for attachment in attachments)),
+        delivery or ''
+    ]
+
+
+def ndjson_line(row: tuple) -> str:
+    lead_id, created_at, source, name, email, phone, company, message, systems, attachments, delivery = row
+    return serializer.dumps({
+        'id': lead_id,
+        'createdAt': created_at,
+        'source': source,
+        'name': name,
+        'email': email,
+        'phone': phone,
+        'company': company,
+        'message': message,
+        'systems': systems,
+        'attachments': attachments,
+        'delivery': delivery
+    }) + '\n'
+
+
+def open_sink(compress: bool) -> tuple:
+    '''Текстовый поток для строк выгрузки и буфер с результатом; с gzip в памяти копится только сжатый текст'''
+    buffer = io.BytesIO() if compress else io.StringIO()
+    if not compress:
+        return buffer, buffer
+    import gzip
+    archive = gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6)
+    return io.TextIOWrapper(archive, encoding='utf-8', newline=''), buffer
+
+
+def write_export(cursor, sink, export_format: str) -> tuple:
+    '''Переносит строки курсора в sink порциями по FETCH_ROWS; возвращает (число строк, последняя строка, есть ли ещё)'''
+    writer = None
+    if export_format == 'csv':
+        # BOM нужен Excel, чтобы открыть UTF-8 без мастера импорта
+        sink.write('\ufeff')
+        writer = csv.writer(sink, lineterminator='\r\n')
+        writer.writerow(CSV_COLUMNS)
+    count, last, more = 0, None, False
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        if count + len(rows) > PAGE_ROWS:
+            # Запрос берёт на строку больше страницы: лишняя строка означает, что есть продолжение
+            rows, more = rows[:PAGE_ROWS - count], True
+        if not rows:
+            break
+        if writer is not None:
+            writer.writerows(csv_row(row) for row in rows)
+        else:
+            sink.writelines(ndjson_line(row) for row in rows)
+        count += len(rows)
+        last = rows[-1]
+    return count, last, more
+
+
+def export(conn, start: date, end: date, after, export_format: str, compress: bool) -> tuple:
+    '''Страница выгрузки через именованный (серверный) курсор: строки не загружаются в память целиком'''
+    query = LEADS_QUERY.format(after=AFTER_CONDITION if after else '')
+    params = (start, end + timedelta(days=1), *(after or ()), PAGE_ROWS + 1)
+    sink, buffer = open_sink(compress)
+    with conn.cursor(name='export_leads') as cursor:
+        cursor.itersize = FETCH_ROWS
+        cursor.execute(query, params)
+        count, last, more = write_export(cursor, sink, export_format)
+    sink.flush()
+    if compress:
+        sink.close()
+    next_cursor = encode_cursor(last[1], last[0]) if more else None
+    return count, next_cursor, buffer.getvalue()
+
+
+@endpoint(methods=('GET',), allow_headers='Content-Type, X-Export-Token', default_method='GET')
+def handler(event: dict, context) -> dict:
+    '''Выгрузка заявок за период в CSV или NDJSON для отдела продаж'''
+    check_token(event)
+    params = event.get('queryStringParameters') or {}
+    start, end, export_format, after = read_request(params)
+    compress = 'gzip' in request_headers(event).get('accept-encoding', '')
+
+    count, next_cursor, body = get_pool().run(
+        lambda conn: export(conn, start, end, after, export_format, compress)
+    )
+    annotate(rows=count, format=export_format, gzip=compress)
+
+    headers = {
+        **CORS_HEADERS,
+        'Content-Type': CONTENT_TYPES[export_format],
+        'Content-Disposition': f'attachment; filename="leads-{start}-{end}.{export_format}"',
+        'Access-Control-Expose-Headers': 'Content-Disposition, X-Next-Cursor'
+    }
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+    if not compress:
+        return response(200, headers=headers, body=body)
+
+    headers['Content-Encoding'] = 'gzip'
+    return {'statusCode': 200, 'headers': headers, 'body': base64.b64encode(body).decode('ascii'), 'isBase64Encoded': True}
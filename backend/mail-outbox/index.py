@@ -0,0 +1,69 @@
+import json
+import os
+from shared import digest
+from shared.db import get_pool as get_db_pool
+from shared.http import HttpError, endpoint, response
+from shared.outbox import drain
+from shared.smtp_router import get_router
+from shared.telemetry import annotate
+
+# Учётные записи других функций, письма которых стоят в очереди: JSON-список
+# [{"host": "smtp.mail.ru", "port": 465, "user": ..., "password": ...}, ...]
+ACCOUNTS_ENV = 'OUTBOX_SMTP_ACCOUNTS'
+
+
+def configured_accounts() -> list:
+    '''(host, port, user, password) учётных записей: своя из SMTP_* и перечисленные в OUTBOX_SMTP_ACCOUNTS'''
+    accounts = []
+    if os.environ.get('SMTP_USER') and os.environ.get('SMTP_PASSWORD'):
+        accounts.append((
+            os.environ.get('SMTP_HOST', 'smtp.yandex.ru'),
+            int(os.environ.get('SMTP_PORT', '465')),
+            os.environ['SMTP_USER'],
+            os.environ['SMTP_PASSWORD']
+        ))
+    for item in json.loads(os.environ.get(ACCOUNTS_ENV) or '[]'):
+        accounts.append((item['host'], int(item.get('port', 465)), item['user'], item['password']))
+    return accounts
+
+
+@endpoint(methods=('POST',))
+def handler(event: dict, context) -> dict:
+    '''Отправка писем из очереди mail_outbox пачками через одну SMTP-сессию (вызывается по таймеру)'''
+
+    batch_size = int(os.environ.get('OUTBOX_BATCH_SIZE', '50'))
+    accounts = configured_accounts()
+
+    if not accounts:
+        raise HttpError(500, 'SMTP credentials not configured')
+
+    stats = {'sent': 0, 'retry': 0, 'dead': 0}
+    providers, unavailable = [], []
+    with get_db_pool().connection() as conn:
+        # Сводки, у которых истекло окно, попадают в очередь до отправки и уходят этим же вызовом
+        digests = digest.flush_due(conn)
+        # Письмо уходит только через учётную запись, записанную в очереди: чужой адрес в From
+        # почтовый сервис отклонит. Письма учётных записей, которых здесь нет, остаются в очереди
+        for host, port, user, password in accounts:
+            # Только через саму учётную запись: запасной провайдер из SMTP_PROVIDERS отклонит отправителя,
+            # записанного в очереди, и письма зря израсходуют попытки. Пока её автомат открыт,
+            # письма ждут в очереди
+            provider = get_router(host, port, user, password).primary
+            if not provider.allow():
+                unavailable.append(user)
+                continue
+            try:
+                account_stats = drain(conn, provider.pool(), user, batch_size)
+            finally:
+                provider.release_probe()
+            # Пустая очередь ничего не говорит о провайдере и не должна закрывать его автомат
+            if account_stats['sent']:
+                provider.succeeded()
+            elif account_stats['retry'] or account_stats['dead']:
+                provider.failed()
+            providers.append(provider.name)
+            for key, value in account_stats.items():
+                stats[key] += value
+    annotate(smtp_providers=providers, smtp_unavailable=unavailable, digests=digests, **stats)
+
+    return response(200, {**stats, 'digests': digests})
@@ -1,197 +1,180 @@
-import json
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
 import os
-import base64
-
+from functools import lru_cache
+from shared import aio, digest, formdata, idempotency, leads, outbox, ratelimit
+from shared.attachments import collect as collect_attachments
+from shared.http import HttpError, endpoint, json_body, request_headers, response
+from shared.leads import SYSTEMS_LABELS
+from shared.smtp_router import get_router
+from shared.telemetry import annotate, span
+from shared.templates import EmailTemplate, Rendered, join
+
+SYSTEM_ITEM = EmailTemplate('<li>{{ label }}</li>')
+
+# Пункты списка систем неизменны, поэтому отрисовываются один раз при импорте
+SYSTEM_ITEMS = {sys_id: SYSTEM_ITEM.render(label=label) for sys_id, label in SYSTEMS_LABELS.items()}
+
+SYSTEMS_ROW = EmailTemplate("""
+    <tr>
+        <td style="padding: 10px; border-bottom: 1px solid #eee; vertical-align: top;"><strong>Интересующие системы:</strong></td>
+        <td style="padding: 10px; border-bottom: 1px solid #eee;"><ul style="margin: 5px 0; padding-left: 20px;">{{ items|raw }}</ul></td>
+    </tr>
+""")
+
+COMPANY_ROW = EmailTemplate("""
+    <tr>
+        <td style="padding: 10px; border-bottom: 1px solid #eee;"><strong>Компания:</strong></td>
+        <td style="padding: 10px; border-bottom: 1px solid #eee;">{{ company }}</td>
+    </tr>
+""")
+
+@lru_cache(maxsize=256)
+def render_systems_row(systems: tuple) -> Rendered:
+    '''Строка со списком систем; набор систем ограничен, поэтому результат кэшируется'''
+    items = join([SYSTEM_ITEMS.get(sys_id) or SYSTEM_ITEM.render(label=sys_id) for sys_id in systems])
+    return SYSTEMS_ROW.render(items=items)
+
+LEAD_TEMPLATE = EmailTemplate("""
+    <html>
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+        <h2 style="color: #ff6b35;">Новая заявка с сайта</h2>
+        <table style="width: 100%; border-collapse: collapse;">
+            <tr>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;"><strong>Имя:</strong></td>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;">{{ name }}</td>
+            </tr>
+            <tr>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;"><strong>Email:</strong></td>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;"><a href="mailto:{{ email }}">{{ email }}</a></td>
+            </tr>
+            <tr>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;"><strong>Телефон:</strong></td>
+                <td style="padding: 10px; border-bottom: 1px solid #eee;">{{ phone }}</td>
+            </tr>
+            {{ company_row|raw }}
+            {{ systems_row|raw }}
+            <tr>
+                <td style="padding: 10px; vertical-align: top;"><strong>Сообщение:</strong></td>
+                <td style="padding: 10px;">{{ message }}</td>
+            </tr>
+        </table>
+        <p style="margin-top: 20px; color: #666; font-size: 12px;">
+            Это письмо отправлено автоматически с формы обратной связи сайта.
+        </p>
+    </body>
+    </html>
+""")
+
+def read_request(event: dict) -> tuple:
+    '''Поля заявки из JSON или multipart/form-data и функция, возвращающая (вложения, отклонённые файлы).
+
+    Вложения собираются отдельно, после проверки лимитов: проверка base64 и сборка частей MIME -
+    самая дорогая часть запроса.
+    '''
+    content_type = request_headers(event).get('content-type', '')
+    if content_type.lower().startswith('multipart/form-data'):
+        try:
+            form = formdata.parse(event, content_type)
+        except formdata.RequestTooLarge as e:
+            raise HttpError(413, str(e))
+        except formdata.FormDataError:
+            raise HttpError(400, 'Некорректный формат данных')
+        body = {key: values[0] for key, values in form.fields.items() if key not in ('systems', 'systems[]')}
+        body['systems'] = form.fields.get('systems', []) + form.fields.get('systems[]', [])
+        return body, lambda: (form.attachment_parts(), form.rejected)
+
+    body = json_body(event)
+    if not isinstance(body, dict):
+        raise HttpError(400, 'Некорректный формат данных')
+    return body, lambda: collect_attachments(body)
+
+
+@endpoint(methods=('POST',), allow_headers='Content-Type, Idempotency-Key', max_age=86400,
+          default_method='GET', error_prefix='Ошибка отправки: ')
 def handler(event: dict, context) -> dict:
     """
     Отправка заявок с формы обратной связи на email
     """
-    method = event.get('httpMethod', 'GET')
-
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+    # IP проверяется до разбора тела: запрос сверх лимита не должен стоить разбора multipart и вложений
+    ip = ratelimit.source_ip(event)
+    limited = ratelimit.check('send-email', 'ip', ip)
+    if limited is not None:
+        return limited
+
+    body, read_attachments = read_request(event)
+    name = body.get('name', '')
+    email = body.get('email', '')
+    phone = body.get('phone', '')
+    company = body.get('company', '')
+    message = body.get('message', '')
+    systems = body.get('systems', [])
+
+    if not name or not email or not message:
+        raise HttpError(400, 'Заполните все обязательные поля')
+    too_long = leads.too_long(body)
+    if too_long:
+        raise HttpError(400, f'Слишком длинное поле: {too_long}')
+
+    request_key = idempotency.request_key(event, 'send-email', (name, email, message))
+    limited = ratelimit.check('send-email', 'email', email)
+    if limited is not None:
+        # Повтор уже принятой заявки получает сохранённый ответ, а не 429
+        return idempotency.stored(request_key) or limited
+
+    smtp_host = os.environ.get('SMTP_HOST', 'smtp.yandex.ru')
+    smtp_port = int(os.environ.get('SMTP_PORT', '465'))
+    smtp_user = os.environ.get('SMTP_USER')
+    smtp_password = os.environ.get('SMTP_PASSWORD')
+    recipient_email = os.environ.get('RECIPIENT_EMAIL', 'info@systemcraft.ru')
+
+    if not smtp_user or not smtp_password:
+        raise HttpError(500, 'Настройки почты не заданы. Обратитесь к администратору.')
+
+    replay = idempotency.claim(request_key)
+    if replay is not None:
+        ratelimit.refund('send-email', ('ip', ip), ('email', email))
+        return replay
 
     try:
-        body = json.loads(event.get('body', '{}'))
-        name = body.get('name', '')
-        email = body.get('email', '')
-        phone = body.get('phone', '')
-        company = body.get('company', '')
-        message = body.get('message', '')
-        systems = body.get('systems', [])
-        file_data = body.get('file')
-
-        if not name or not email or not message:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Заполните все обязательные поля'}),
-                'isBase64Encoded': False
-            }
-
-        smtp_host = os.environ.get('SMTP_HOST', 'smtp.yandex.ru')
-        smtp_port = int(os.environ.get('SMTP_PORT', '465'))
-        smtp_user = os.environ.get('SMTP_USER')
-        smtp_password = os.environ.get('SMTP_PASSWORD')
-        recipient_email = os.environ.get('RECIPIENT_EMAIL', 'info@systemcraft.ru')
-
-        if not smtp_user or not smtp_password:
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Настройки почты не заданы. Обратитесь к администратору.'}),
-                'isBase64Encoded': False
-            }
-
-        msg = MIMEMultipart()
-        msg['From'] = smtp_user
-        msg['To'] = recipient_email
-        msg['Subject'] = f'Новая заявка с сайта от {name}'
-
-        systems_labels = {
-            'sks': 'СКС - Структурированные кабельные системы',
-            'saps': 'САПС - Система автоматической пожарной сигнализации',
-            'soue': 'СОУЭ - Система оповещения и управления эвакуацией',
-            'skud': 'СКУД - Система контроля и управления доступом',
-            'sots': 'СОТС - Система охранно-тревожной сигнализации',
-            'sot': 'СОТ - Система охранного телевидения',
-            'askue': 'АСКУЭ - Автоматизированная система коммерческого учета электроэнергии',
-            'eom': 'ЭОМ - Электрооборудование и молниезащита',
-            'ovik': 'ОВИК - Отопление, вентиляция и кондиционирование'
-        }
-
-        systems_text = ''
-        if systems:
-            systems_list = '<ul style="margin: 5px 0; padding-left: 20px;">'
-            for sys_id in systems:
-                systems_list += f'<li>{systems_labels.get(sys_id, sys_id)}</li>'
-            systems_list += '</ul>'
-            systems_text = f"""
-                <tr>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee; vertical-align: top;"><strong>Интересующие системы:</strong></td>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee;">{systems_list}</td>
-                </tr>
-            """
-
-        company_text = ''
-        if company:
-            company_text = f"""
-                <tr>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee;"><strong>Компания:</strong></td>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee;">{company}</td>
-                </tr>
-            """
-
-        email_body = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <h2 style="color: #ff6b35;">Новая заявка с сайта</h2>
-            <table style="width: 100%; border-collapse: collapse;">
-                <tr>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee;"><strong>Имя:</strong></td>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee;">{name}</td>
-                </tr>
-                <tr>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee;"><strong>Email:</strong></td>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee;"><a href="mailto:{email}">{email}</a></td>
-                </tr>
-                <tr>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee;"><strong>Телефон:</strong></td>
-                    <td style="padding: 10px; border-bottom: 1px solid #eee;">{phone if phone else 'Не указан'}</td>
-                </tr>
-                {company_text}
-                {systems_text}
-                <tr>
-                    <td style="padding: 10px; vertical-align: top;"><strong>Сообщение:</strong></td>
-                    <td style="padding: 10px;">{message}</td>
-                </tr>
-            </table>
-            <p style="margin-top: 20px; color: #666; font-size: 12px;">
-                Это письмо отправлено автоматически с формы обратной связи сайта.
-            </p>
-        </body>
-        </html>
-        """
-
-        msg.attach(MIMEText(email_body, 'html'))
-
-        if file_data:
-            try:
-                file_content = base64.b64decode(file_data['content'])
-                file_name = file_data['name']
-                file_type = file_data.get('type', 'application/octet-stream')
-
-                attachment = MIMEBase('application', 'octet-stream')
-                attachment.set_payload(file_content)
-                encoders.encode_base64(attachment)
-                attachment.add_header('Content-Disposition', f'attachment; filename="{file_name}"')
-                msg.attach(attachment)
-            except Exception as e:
-                pass
-
-        with smtplib.SMTP_SSL(smtp_host, smtp_port) as server:
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
-
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'success': True, 'message': 'Заявка успешно отправлена'}),
-            'isBase64Encoded': False
-        }
-
-    except json.JSONDecodeError:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Некорректный формат данных'}),
-            'isBase64Encoded': False
-        }
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': f'Ошибка отправки: {str(e)}'}),
-            'isBase64Encoded': False
-        }
\ No newline at end of file
+        attachments, rejected = read_attachments()
+        annotate(attachments=len(attachments), rejected_attachments=len(rejected))
+        if digest.is_enabled() and not digest.is_urgent(attachments):
+            # Отдельное письмо не собирается: заявка попадёт в сводное
+            digest.add('send-email', body, smtp_user, recipient_email, systems)
+            result = response(200, {'success': True, 'message': 'Заявка принята', 'rejectedAttachments': rejected})
+        else:
+            with span('render'):
+                from email.mime.multipart import MIMEMultipart
+                msg = MIMEMultipart()
+                msg['From'] = smtp_user
+                msg['To'] = recipient_email
+                msg['Subject'] = f'Новая заявка с сайта от {name}'
+
+                rendered = LEAD_TEMPLATE.render(
+                    name=name,
+                    email=email,
+                    phone=phone or 'Не указан',
+                    company_row=COMPANY_ROW.render(company=company) if company else '',
+                    systems_row=render_systems_row(tuple(str(sys_id) for sys_id in systems)) if systems else '',
+                    message=message
+                )
+                msg.attach(rendered.mime())
+
+                for attachment in attachments:
+                    msg.attach(attachment)
+
+            if outbox.is_enabled():
+                leads.enqueue(msg, 'send-email', smtp_user, body, systems, attachments)
+                result = response(200, {'success': True, 'message': 'Заявка принята', 'rejectedAttachments': rejected})
+            else:
+                router = get_router(smtp_host, smtp_port, smtp_user, smtp_password)
+                if aio.ENABLED:
+                    aio.run(router.send_message_async(msg))
+                else:
+                    router.send_message(msg)
+                result = response(200, {'success': True, 'message': 'Заявка успешно отправлена', 'rejectedAttachments': rejected})
+    except Exception:
+        idempotency.release(request_key)
+        raise
+
+    idempotency.complete(request_key, result)
+    return result
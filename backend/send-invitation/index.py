@@ -1,98 +1,39 @@
+import contextvars
 import json
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from shared import aio
+from shared.http import HttpError, endpoint, request_headers, response
+from shared.smtp_router import get_router
+from shared.telemetry import annotate, span
+from shared.templates import EmailTemplate
 
-def handler(event: dict, context) -> dict:
-    '''API для отправки приглашения пользователю с логином и паролем'''
-    
-    method = event.get('httpMethod', 'POST')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            },
-            'body': ''
-        }
-    
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
-    
-    body = {}
-    user_email = None
-    user_name = None
-    user_password = None
-    user_role = 'client'
-    login_url = 'https://systemcraft.ru/login'
-    
-    try:
-        body_str = event.get('body', '{}')
-        
-        if body_str:
-            if isinstance(body_str, dict):
-                body = body_str
-            elif isinstance(body_str, str):
-                try:
-                    body = json.loads(body_str)
-                except json.JSONDecodeError:
-                    body = {}
-        
-        if isinstance(body, dict):
-            user_email = body.get('email')
-            user_name = body.get('name')
-            user_password = body.get('password')
-            user_role = body.get('role', 'client')
-            login_url = body.get('loginUrl', 'https://systemcraft.ru/login')
-        
-        if not user_email or not user_name or not user_password:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Email, name and password are required'})
-            }
-        
-        smtp_host = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
-        smtp_port = int(os.environ.get('SMTP_PORT', '587'))
-        smtp_user = os.environ.get('SMTP_USER')
-        smtp_password = os.environ.get('SMTP_PASSWORD')
-        from_email = os.environ.get('FROM_EMAIL', smtp_user)
-        
-        if not smtp_user or not smtp_password:
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'SMTP credentials not configured'})
-            }
-        
-        role_names = {
-            'admin': 'Администратор',
-            'editor': 'Редактор',
-            'client': 'Клиент',
-            'employee': 'Сотрудник'
-        }
-        
-        html_content = f"""
+DEFAULT_LOGIN_URL = 'https://systemcraft.ru/login'
+BATCH_LIMIT = int(os.environ.get('INVITE_BATCH_LIMIT', '500'))
+CONCURRENCY = int(os.environ.get('INVITE_CONCURRENCY', '4'))
+
+ROLE_NAMES = {
+    'admin': 'Администратор',
+    'editor': 'Редактор',
+    'client': 'Клиент',
+    'employee': 'Сотрудник'
+}
+
+INVITATION_TEMPLATE = EmailTemplate("""
         <!DOCTYPE html>
         <html>
         <head>
             <meta charset="utf-8">
             <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }}
-                .content {{ background: #f9fafb; padding: 30px; border-radius: 0 0 10px 10px; }}
-                .credentials {{ background: white; padding: 20px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #667eea; }}
-                .button {{ display: inline-block; background: #667eea; color: white; padding: 12px 30px; text-decoration: none; border-radius: 6px; margin-top: 20px; }}
-                .footer {{ text-align: center; margin-top: 20px; color: #666; font-size: 12px; }}
+                body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+                .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+                .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }
+                .content { background: #f9fafb; padding: 30px; border-radius: 0 0 10px 10px; }
+                .credentials { background: white; padding: 20px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #667eea; }
+                .button { display: inline-block; background: #667eea; color: white; padding: 12px 30px; text-decoration: none; border-radius: 6px; margin-top: 20px; }
+                .footer { text-align: center; margin-top: 20px; color: #666; font-size: 12px; }
             </style>
         </head>
         <body>
@@ -101,20 +42,20 @@ def handler(event: dict, context) -> dict:
                     <h1>Добро пожаловать в СистемКрафт!</h1>
                 </div>
                 <div class="content">
-                    <p>Здравствуйте, {user_name}!</p>
-                    <p>Для вас создан аккаунт в системе СистемКрафт с ролью <strong>{role_names.get(user_role, user_role)}</strong>.</p>
-                    
+                    <p>Здравствуйте, {{ user_name }}!</p>
+                    <p>Для вас создан аккаунт в системе СистемКрафт с ролью <strong>{{ role_name }}</strong>.</p>
+
                     <div class="credentials">
                         <h3 style="margin-top: 0;">Данные для входа:</h3>
-                        <p><strong>Логин (Email):</strong> {user_email}</p>
-                        <p><strong>Пароль:</strong> {user_password}</p>
-                        <p><strong>Ссылка для входа:</strong> <a href="{login_url}">{login_url}</a></p>
+                        <p><strong>Логин (Email):</strong> {{ user_email }}</p>
+                        <p><strong>Пароль:</strong> {{ user_password }}</p>
+                        <p><strong>Ссылка для входа:</strong> <a href="{{ login_url }}">{{ login_url }}</a></p>
                     </div>
-                    
+
                     <p>Рекомендуем изменить пароль после первого входа в систему.</p>
-                    
-                    <a href="{login_url}" class="button">Войти в систему</a>
-                    
+
+                    <a href="{{ login_url }}" class="button">Войти в систему</a>
+
                     <div class="footer">
                         <p>Если у вас возникли вопросы, свяжитесь с администратором.</p>
                         <p>© 2024 СистемКрафт. Все права защищены.</p>
@@ -123,33 +64,190 @@ def handler(event: dict, context) -> dict:
             </div>
         </body>
         </html>
-        """
-        
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = f'Приглашение в систему СистемКрафт - {role_names.get(user_role, user_role)}'
+        """)
+
+
+@lru_cache(maxsize=len(ROLE_NAMES))
+def role_template(role: str) -> EmailTemplate:
+    '''Шаблон письма с уже подставленным названием роли, собирается один раз на роль из ROLE_NAMES'''
+    return INVITATION_TEMPLATE.bind(role_name=ROLE_NAMES[role])
+
+
+def build_message(user: dict, from_email: str):
+    role = user.get('role') or 'client'
+    login_url = user.get('loginUrl') or DEFAULT_LOGIN_URL
+    fields = {
+        'user_name': user['name'],
+        'user_email': user['email'],
+        'user_password': user['password'],
+        'login_url': login_url
+    }
+    with span('render'):
+        if role in ROLE_NAMES:
+            rendered = role_template(role).render(**fields)
+        else:
+            # Роль приходит от клиента: для неизвестных шаблон не собирается, иначе кэш растёт без границ
+            rendered = INVITATION_TEMPLATE.render(role_name=role, **fields)
+
+        msg = rendered.mime()
+        msg['Subject'] = f'Приглашение в систему СистемКрафт - {ROLE_NAMES.get(role, role)}'
         msg['From'] = from_email
-        msg['To'] = user_email
-        
-        html_part = MIMEText(html_content, 'html')
-        msg.attach(html_part)
-        
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'success': True,
-                'message': f'Invitation sent to {user_email}'
+        msg['To'] = user['email']
+    return msg
+
+
+def iter_batch(body, content_type: str):
+    '''Перебирает приглашения пакета: JSON-массив, {"users": [...]} или NDJSON построчно'''
+    if 'ndjson' in content_type:
+        for line in body.splitlines():
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    yield None
+        return
+
+    defaults = {}
+    if isinstance(body, dict):
+        defaults = {key: body[key] for key in ('role', 'loginUrl') if body.get(key)}
+        body = body.get('users', [])
+    for item in body:
+        yield {**defaults, **item} if isinstance(item, dict) else None
+
+
+def iter_valid(users, results: list):
+    '''Записывает в results строку для каждого приглашения пакета и выдаёт (index, user) тех, что можно отправить'''
+    for index, user in enumerate(users):
+        if index >= BATCH_LIMIT:
+            results.append({'index': index, 'status': 'skipped', 'error': f'Batch limit is {BATCH_LIMIT}'})
+            continue
+        if not isinstance(user, dict) or not user.get('email') or not user.get('name') or not user.get('password'):
+            results.append({
+                'index': index,
+                'email': user.get('email') if isinstance(user, dict) else None,
+                'status': 'invalid',
+                'error': 'Email, name and password are required'
             })
-        }
-        
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+            continue
+        results.append({'index': index, 'email': user['email'], 'status': 'pending'})
+        yield index, user
+
+
+def send_batch(users, send, from_email: str) -> list:
+    '''Рассылает приглашения с ограниченным параллелизмом; ошибка одного адресата не прерывает пакет'''
+    results = []
+    slots = threading.BoundedSemaphore(CONCURRENCY)
+
+    def send_one(index: int, user: dict) -> None:
+        try:
+            send(build_message(user, from_email))
+            results[index]['status'] = 'sent'
+        except Exception as e:
+            results[index].update(status='error', error=str(e))
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        for index, user in iter_valid(users, results):
+            slots.acquire()
+            # Копия контекста переносит замеры telemetry в поток; фазы потоков суммируются
+            executor.submit(contextvars.copy_context().run, send_one, index, user)
+
+    return results
+
+
+async def send_batch_async(users, send, from_email: str) -> list:
+    '''send_batch на асинхронных пулах: CONCURRENCY SMTP-сессий без отдельных потоков'''
+    import asyncio
+    results = []
+    slots = asyncio.Semaphore(CONCURRENCY)
+
+    async def send_one(index: int, user: dict) -> None:
+        try:
+            await send(build_message(user, from_email))
+            results[index]['status'] = 'sent'
+        except Exception as e:
+            results[index].update(status='error', error=str(e))
+        finally:
+            slots.release()
+
+    tasks = []
+    for index, user in iter_valid(users, results):
+        await slots.acquire()
+        tasks.append(asyncio.create_task(send_one(index, user)))
+    await asyncio.gather(*tasks)
+    return results
+
+
+def batch_response(results: list) -> dict:
+    sent = sum(1 for result in results if result['status'] == 'sent')
+    annotate(batch=len(results), sent=sent)
+    return response(200, {
+        'success': sent == len(results),
+        'total': len(results),
+        'sent': sent,
+        'failed': len(results) - sent,
+        'results': results
+    })
+
+
+async def deliver_async(body: dict, batch, router, from_email: str) -> dict:
+    if batch is not None:
+        return batch_response(await send_batch_async(batch, router.send_message_async, from_email))
+    await router.send_message_async(build_message(body, from_email))
+    return response(200, {
+        'success': True,
+        'message': f'Invitation sent to {body["email"]}'
+    })
+
+
+@endpoint(methods=('POST',))
+def handler(event: dict, context) -> dict:
+    '''API для отправки приглашений пользователям с логином и паролем (по одному или пакетом)'''
+
+    body = {}
+    batch = None
+
+    body_str = event.get('body', '{}')
+    content_type = request_headers(event).get('content-type', '')
+
+    if body_str:
+        if isinstance(body_str, (dict, list)):
+            body = body_str
+        elif isinstance(body_str, str) and 'ndjson' in content_type:
+            batch = iter_batch(body_str, content_type)
+        elif isinstance(body_str, str):
+            try:
+                body = json.loads(body_str)
+            except json.JSONDecodeError:
+                body = {}
+
+    if isinstance(body, list) or (isinstance(body, dict) and isinstance(body.get('users'), list)):
+        batch = iter_batch(body, content_type)
+
+    if batch is None and not (isinstance(body, dict) and body.get('email') and body.get('name') and body.get('password')):
+        raise HttpError(400, 'Email, name and password are required')
+
+    smtp_host = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+    smtp_port = int(os.environ.get('SMTP_PORT', '587'))
+    smtp_user = os.environ.get('SMTP_USER')
+    smtp_password = os.environ.get('SMTP_PASSWORD')
+    from_email = os.environ.get('FROM_EMAIL', smtp_user)
+
+    if not smtp_user or not smtp_password:
+        raise HttpError(500, 'SMTP credentials not configured')
+
+    router = get_router(smtp_host, smtp_port, smtp_user, smtp_password, size=CONCURRENCY)
+    if aio.ENABLED:
+        return aio.run(deliver_async(body, batch, router, from_email))
+
+    if batch is not None:
+        return batch_response(send_batch(batch, router.send_message, from_email))
+
+    router.send_message(build_message(body, from_email))
+
+    return response(200, {
+        'success': True,
+        'message': f'Invitation sent to {body["email"]}'
+    })
@@ -0,0 +1,42 @@
+import contextvars
+import os
+import threading
+
+# ASYNC_IO=1 переводит функции на асинхронные SMTP и PostgreSQL: вызовы экземпляра
+# выполняются в одном цикле событий и ждут сеть, не занимая потоки
+ENABLED = os.environ.get('ASYNC_IO', '0') == '1'
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> 'asyncio.AbstractEventLoop':
+    '''Цикл событий экземпляра в фоновом потоке; живёт между тёплыми вызовами вместе с пулами соединений.
+
+    asyncio загружается только в этом режиме: синхронным функциям он не нужен при холодном старте.
+    '''
+    import asyncio
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='aio-loop', daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+async def _with_context(coro, context: contextvars.Context):
+    # Задача цикла получает копию контекста потока цикла, а не вызывающего: переносим
+    # значения (например, замеры shared.telemetry текущего вызова) вручную
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+def run(coro):
+    '''Выполняет корутину в цикле экземпляра и ждёт результат; синхронный handler остаётся тонкой обёрткой'''
+    import asyncio
+    loop = get_loop()
+    if threading.current_thread().name == 'aio-loop':
+        raise RuntimeError('aio.run нельзя вызывать из цикла событий')
+    return asyncio.run_coroutine_threadsafe(_with_context(coro, contextvars.copy_context()), loop).result()
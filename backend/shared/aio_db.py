@@ -0,0 +1,155 @@
+import asyncio
+import os
+import time
+
+from shared.db import disconnect_errors
+from shared.telemetry import register_pool, span
+
+
+async def wait(conn) -> None:
+    '''Ждёт готовности асинхронного соединения psycopg2, отдавая управление циклу, пока сокет занят'''
+    import psycopg2.extensions
+    loop = asyncio.get_running_loop()
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        ready = loop.create_future()
+        fd = conn.fileno()
+        if state == psycopg2.extensions.POLL_READ:
+            loop.add_reader(fd, ready.set_result, None)
+            remove = loop.remove_reader
+        else:
+            loop.add_writer(fd, ready.set_result, None)
+            remove = loop.remove_writer
+        try:
+            await ready
+        finally:
+            remove(fd)
+
+
+class AsyncConnectionPool:
+    '''Пул асинхронных соединений PostgreSQL (psycopg2 async_=True) для цикла shared.aio.
+
+    Асинхронные соединения работают в autocommit: пул предназначен для чтения.
+    '''
+
+    def __init__(self, dsn: str, size: int = 4, max_idle: float = 300.0, wait_timeout: float = 10.0):
+        self.dsn = dsn
+        self.size = size
+        self.max_idle = max_idle
+        self.wait_timeout = wait_timeout
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.discards = 0
+        self._idle = []
+        self._in_use = 0
+        self._slots = asyncio.Semaphore(size)
+
+    async def _connect(self):
+        import psycopg2
+        with span('db.connect'):
+            conn = psycopg2.connect(self.dsn, async_=True)
+            await wait(conn)
+        return conn
+
+    def _discard(self, conn) -> None:
+        self.discards += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    async def acquire(self):
+        if self._slots.locked():
+            self.waits += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.wait_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError('Database pool exhausted')
+        self._in_use += 1
+        try:
+            now = time.monotonic()
+            while self._idle:
+                conn, released_at = self._idle.pop()
+                if not conn.closed and now - released_at <= self.max_idle:
+                    self.hits += 1
+                    return conn
+                self._discard(conn)
+            self.misses += 1
+            return await self._connect()
+        except BaseException:
+            self._in_use -= 1
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken: bool = False) -> None:
+        self._in_use -= 1
+        if broken or conn.closed:
+            self._discard(conn)
+        else:
+            self._idle.append((conn, time.monotonic()))
+        self._slots.release()
+
+    async def _execute(self, conn, query: str, params) -> list:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            await wait(conn)
+            if cursor.description is None:
+                return []
+            columns = [column.name for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    async def fetch(self, query: str, params=None) -> list:
+        '''Строки запроса как словари; если сервер разорвал соединение, повторяет один раз на новом'''
+        for attempt in (1, 2):
+            with span('db.acquire'):
+                conn = await self.acquire()
+            broken = False
+            try:
+                with span('db.query'):
+                    return await self._execute(conn, query, params)
+            except disconnect_errors():
+                broken = True
+                if not conn.closed or attempt == 2:
+                    raise
+            except asyncio.CancelledError:
+                # Запрос остался на сервере незавершённым - соединение повторно не используется
+                broken = True
+                raise
+            finally:
+                self.release(conn, broken)
+
+    async def fetchone(self, query: str, params=None):
+        rows = await self.fetch(query, params)
+        return rows[0] if rows else None
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'waits': self.waits,
+            'discards': self.discards,
+            'idle': len(self._idle),
+            'inUse': self._in_use,
+            'size': self.size
+        }
+
+
+_pools = {}
+
+
+def get_pool(dsn: str = None, **options) -> AsyncConnectionPool:
+    '''Возвращает асинхронный пул для DSN (по умолчанию DATABASE_URL); вызывается только из цикла shared.aio'''
+    dsn = dsn or os.environ['DATABASE_URL']
+    pool = _pools.get(dsn)
+    if pool is None:
+        options.setdefault('size', int(os.environ.get('DB_POOL_SIZE', '4')))
+        pool = AsyncConnectionPool(dsn, **options)
+        _pools[dsn] = pool
+        register_pool(f'async-{len(_pools)}', pool.stats)
+    return pool
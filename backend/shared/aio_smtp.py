@@ -0,0 +1,260 @@
+import asyncio
+import base64
+import os
+import socket
+import time
+
+from shared.smtp_pool import envelope, iter_message, to_wire
+from shared.telemetry import span
+
+_ssl_context = None
+_local_hostname = None
+
+
+def ssl_context():
+    '''Общий SSL-контекст: загрузка корневых сертификатов занимает десятки мс и блокировала бы цикл'''
+    global _ssl_context
+    if _ssl_context is None:
+        import ssl
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+def local_hostname() -> str:
+    global _local_hostname
+    if _local_hostname is None:
+        _local_hostname = socket.getfqdn()
+    return _local_hostname
+
+
+class AsyncSMTP:
+    '''SMTP-сессия на потоках asyncio: подмножество протокола, которым пользуются функции'''
+
+    def __init__(self, host: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, timeout: float):
+        self.host = host
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.features = {}
+        self.created_at = time.monotonic()
+
+    @classmethod
+    async def connect(cls, host: str, port: int, timeout: float, starttls: bool = True,
+                      connect_timeout: float = None) -> 'AsyncSMTP':
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl_context() if port == 465 else None), connect_timeout or timeout
+        )
+        server = cls(host, reader, writer, timeout)
+        try:
+            await server.expect(220)
+            await server.ehlo()
+            if port != 465 and starttls:
+                await server.expect(220, 'STARTTLS')
+                await asyncio.wait_for(writer.start_tls(ssl_context(), server_hostname=host), connect_timeout or timeout)
+                await server.ehlo()
+            # DATA передаётся несколькими write подряд - без задержек Нейгла на неполных сегментах
+            writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except BaseException:
+            server.close()
+            raise
+        return server
+
+    async def reply(self) -> tuple:
+        import smtplib
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                return int(line[:3]), b'\n'.join(lines)
+
+    async def command(self, line: str) -> tuple:
+        self.writer.write(line.encode('utf-8') + b'\r\n')
+        await self.writer.drain()
+        return await self.reply()
+
+    async def expect(self, code: int, line: str = None) -> bytes:
+        import smtplib
+        reply_code, text = await (self.command(line) if line else self.reply())
+        if reply_code != code:
+            raise smtplib.SMTPResponseException(reply_code, text)
+        return text
+
+    async def ehlo(self) -> None:
+        text = await self.expect(250, f'EHLO {local_hostname()}')
+        self.features = {}
+        for feature in text.decode('latin-1').splitlines()[1:]:
+            keyword, _, params = feature.partition(' ')
+            self.features[keyword.upper()] = params.upper().split()
+
+    async def login(self, user: str, password: str) -> None:
+        import smtplib
+        methods = self.features.get('AUTH', [])
+        if 'PLAIN' in methods or 'LOGIN' not in methods:
+            token = base64.b64encode(f'\0{user}\0{password}'.encode()).decode()
+            code, text = await self.command(f'AUTH PLAIN {token}')
+        else:
+            code, text = await self.command('AUTH LOGIN')
+            if code == 334:
+                code, text = await self.command(base64.b64encode(user.encode()).decode())
+            if code == 334:
+                code, text = await self.command(base64.b64encode(password.encode()).decode())
+        if code != 235:
+            raise smtplib.SMTPAuthenticationError(code, text)
+
+    async def noop(self) -> int:
+        return (await self.command('NOOP'))[0]
+
+    async def send_message(self, msg, from_addr: str = None, to_addrs=None) -> dict:
+        '''Аналог shared.smtp_pool.stream_message: большие части письма уходят в сокет кусками'''
+        import smtplib
+        from_addr, to_addrs = envelope(msg, from_addr, to_addrs)
+        code, text = await self.command(f'MAIL FROM:<{from_addr}>')
+        if code != 250:
+            await self.command('RSET')
+            raise smtplib.SMTPSenderRefused(code, text, from_addr)
+        refused = {}
+        for addr in to_addrs:
+            code, text = await self.command(f'RCPT TO:<{addr}>')
+            if code not in (250, 251):
+                refused[addr] = (code, text)
+        if len(refused) == len(to_addrs):
+            await self.command('RSET')
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, text = await self.command('DATA')
+        if code != 354:
+            await self.command('RSET')
+            raise smtplib.SMTPDataError(code, text)
+
+        # Последний кусок уходит вместе с точкой - как в синхронной версии
+        pending = b''
+        for chunk in iter_message(msg):
+            if pending:
+                self.writer.write(pending)
+                await self.writer.drain()
+            pending = to_wire(chunk)
+        self.writer.write(pending + (b'.\r\n' if not pending or pending.endswith(b'\n') else b'\r\n.\r\n'))
+        await self.writer.drain()
+        code, text = await self.reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, text)
+        return refused
+
+    async def quit(self) -> None:
+        try:
+            await self.command('QUIT')
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class AsyncSMTPPool:
+    '''Асинхронный аналог shared.smtp_pool.SMTPPool; все сессии принадлежат циклу shared.aio'''
+
+    def __init__(self, host: str, port: int, user: str, password: str,
+                 size: int = 2, max_idle: float = 60.0, max_age: float = 300.0,
+                 timeout: float = 15.0, starttls: bool = None, connect_timeout: float = None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.size = size
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout or timeout
+        self.starttls = os.environ.get('SMTP_STARTTLS', '1') != '0' if starttls is None else starttls
+        self._idle = []
+
+    async def _connect(self) -> AsyncSMTP:
+        with span('smtp.connect'):
+            server = await AsyncSMTP.connect(self.host, self.port, self.timeout, self.starttls, self.connect_timeout)
+        try:
+            with span('smtp.login'):
+                await server.login(self.user, self.password)
+        except BaseException:
+            server.close()
+            raise
+        return server
+
+    @staticmethod
+    async def _discard(server: AsyncSMTP) -> None:
+        try:
+            await server.quit()
+        except Exception:
+            pass
+
+    async def _is_alive(self, server: AsyncSMTP) -> bool:
+        import smtplib
+        try:
+            with span('smtp.noop'):
+                return await server.noop() == 250
+        except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+            server.close()
+            return False
+
+    async def acquire(self) -> AsyncSMTP:
+        now = time.monotonic()
+        while self._idle:
+            server, released_at = self._idle.pop()
+            expired = now - released_at > self.max_idle or now - server.created_at > self.max_age
+            if not expired and await self._is_alive(server):
+                return server
+            await self._discard(server)
+        return await self._connect()
+
+    async def release(self, server: AsyncSMTP, broken: bool = False) -> None:
+        if broken:
+            server.close()
+            return
+        if time.monotonic() - server.created_at <= self.max_age and len(self._idle) < self.size:
+            self._idle.append((server, time.monotonic()))
+            return
+        await self._discard(server)
+
+    async def _send(self, msg, from_addr: str, to_addrs) -> dict:
+        import smtplib
+        server = await self.acquire()
+        try:
+            with span('smtp.send'):
+                refused = await server.send_message(msg, from_addr, to_addrs)
+        except (smtplib.SMTPServerDisconnected, OSError, asyncio.TimeoutError):
+            await self.release(server, broken=True)
+            raise
+        except BaseException:
+            await self.release(server)
+            raise
+        await self.release(server)
+        return refused
+
+    async def send_message(self, msg, from_addr: str = None, to_addrs=None) -> dict:
+        import smtplib
+        try:
+            return await self._send(msg, from_addr, to_addrs)
+        except smtplib.SMTPServerDisconnected:
+            return await self._send(msg, from_addr, to_addrs)
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for server, _ in idle:
+            await self._discard(server)
+
+
+_pools = {}
+
+
+def get_pool(host: str, port: int, user: str, password: str, **options) -> AsyncSMTPPool:
+    '''Возвращает пул для учётной записи; вызывается только из цикла shared.aio, поэтому без блокировки'''
+    key = (host, port, user)
+    pool = _pools.get(key)
+    if pool is None or pool.password != password:
+        if pool is not None:
+            asyncio.get_running_loop().create_task(pool.close())
+        pool = AsyncSMTPPool(host, port, user, password, **options)
+        _pools[key] = pool
+    return pool
+
@@ -0,0 +1,100 @@
+import base64
+import binascii
+import os
+
+MAX_ATTACHMENT_BYTES = int(os.environ.get('ATTACHMENT_MAX_BYTES', str(10 * 1024 * 1024)))
+MAX_ATTACHMENTS = int(os.environ.get('ATTACHMENT_MAX_COUNT', '5'))
+# Совпадает с accept у поля файла в ContactForm
+ALLOWED_EXTENSIONS = frozenset(
+    os.environ.get('ATTACHMENT_ALLOWED_EXTENSIONS', 'pdf,doc,docx,jpg,jpeg,png,zip').lower().split(',')
+)
+# Размер куска для проверки base64: кратен 4 символам, декодированные данные не накапливаются
+CHUNK_CHARS = 64 * 1024
+LINE_CHARS = 76
+
+
+class AttachmentError(ValueError):
+    pass
+
+
+def decoded_size(content: str, max_bytes: int = MAX_ATTACHMENT_BYTES) -> int:
+    '''Проверяет base64 по кускам и возвращает размер исходных данных, не собирая их в памяти'''
+    if len(content) % 4:
+        raise AttachmentError('Некорректная кодировка base64')
+    if len(content) // 4 * 3 - 2 > max_bytes:
+        raise AttachmentError(f'Файл больше {max_bytes // (1024 * 1024)} МБ')
+    size = 0
+    for start in range(0, len(content), CHUNK_CHARS):
+        try:
+            size += len(base64.b64decode(content[start:start + CHUNK_CHARS], validate=True))
+        except binascii.Error:
+            raise AttachmentError('Некорректная кодировка base64')
+    if size > max_bytes:
+        raise AttachmentError(f'Файл больше {max_bytes // (1024 * 1024)} МБ')
+    return size
+
+
+def check_allowed(filename: str) -> None:
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension not in ALLOWED_EXTENSIONS:
+        raise AttachmentError(f'Недопустимый тип файла: {extension or "без расширения"}')
+
+
+def mime_part(content: str, filename: str, content_type: str = None):
+    from email.mime.base import MIMEBase
+    maintype, _, subtype = (content_type or '').partition('/')
+    if not maintype or not subtype:
+        maintype, subtype = 'application', 'octet-stream'
+    part = MIMEBase(maintype, subtype)
+    # Строка хранится без переносов: shared.smtp_pool разбивает её на строки при отправке
+    part.set_payload(content)
+    part.wrap_at = LINE_CHARS
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', 'attachment', filename=filename)
+    return part
+
+
+def describe(part) -> dict:
+    '''Имя, тип и размер вложения без декодирования: размер считается по длине base64'''
+    content = part.get_payload()
+    return {
+        'name': part.get_filename(),
+        'type': part.get_content_type(),
+        'size': len(content) // 4 * 3 - content[-2:].count('=')
+    }
+
+
+def base64_part(content: str, filename: str, content_type: str = None,
+                max_bytes: int = MAX_ATTACHMENT_BYTES):
+    '''Вложение из base64 без декодирования и повторного кодирования: строка только проверяется'''
+    check_allowed(filename)
+    if '\n' in content or '\r' in content or ' ' in content:
+        content = ''.join(content.split())
+    decoded_size(content, max_bytes)
+    return mime_part(content, filename, content_type)
+
+
+def bytes_part(data, filename: str, content_type: str = None):
+    '''Вложение из исходных байтов (multipart/form-data): кодируются в base64 один раз'''
+    return mime_part(base64.b64encode(data).decode('ascii'), filename, content_type)
+
+
+def collect(body: dict, max_count: int = MAX_ATTACHMENTS) -> tuple:
+    '''Собирает вложения из полей file и files; возвращает (части MIME, отклонённые файлы с причиной)'''
+    files = list(body.get('files') or [])
+    if body.get('file'):
+        files.insert(0, body['file'])
+
+    parts = []
+    rejected = []
+    for index, file_data in enumerate(files):
+        name = file_data.get('name') if isinstance(file_data, dict) else None
+        try:
+            if not isinstance(file_data, dict) or not name or not isinstance(file_data.get('content'), str):
+                raise AttachmentError('Нужны поля name и content')
+            if index >= max_count:
+                raise AttachmentError(f'Можно приложить не более {max_count} файлов')
+            parts.append(base64_part(file_data['content'], name, file_data.get('type')))
+        except AttachmentError as e:
+            rejected.append({'name': name, 'error': str(e)})
+    return parts, rejected
@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from shared.telemetry import register_pool, span
+
+
+def disconnect_errors() -> tuple:
+    '''Ошибки, после которых соединение считается разорванным сервером.
+
+    psycopg2 импортируется при первом подключении, а не при импорте модуля:
+    вызовы, которым база не нужна (OPTIONS, ошибки валидации), её не загружают.
+    '''
+    import psycopg2
+    return psycopg2.OperationalError, psycopg2.InterfaceError
+
+
+class ConnectionPool:
+    '''Пул соединений PostgreSQL, переживающий тёплые вызовы функции'''
+
+    def __init__(self, dsn: str, size: int = 4, max_idle: float = 300.0,
+                 validate_after: float = 5.0, wait_timeout: float = 10.0):
+        self.dsn = dsn
+        self.size = size
+        self.max_idle = max_idle
+        self.validate_after = validate_after
+        self.wait_timeout = wait_timeout
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.discards = 0
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        import psycopg2
+        with span('db.connect'):
+            return psycopg2.connect(self.dsn)
+
+    def _discard(self, conn) -> None:
+        self.discards += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_alive(self, conn, idle_for: float) -> bool:
+        if conn.closed:
+            return False
+        if idle_for < self.validate_after:
+            return True
+        try:
+            with span('db.ping'), conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except disconnect_errors():
+            return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.wait_timeout
+        with self._cond:
+            while not self._idle and self._in_use >= self.size:
+                self.waits += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    raise TimeoutError('Database pool exhausted')
+            self._in_use += 1
+
+        try:
+            while True:
+                with self._cond:
+                    if not self._idle:
+                        break
+                    conn, released_at = self._idle.pop()
+                idle_for = time.monotonic() - released_at
+                if idle_for <= self.max_idle and self._is_alive(conn, idle_for):
+                    self.hits += 1
+                    return conn
+                self._discard(conn)
+            self.misses += 1
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn) -> None:
+        from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+        broken = bool(conn.closed)
+        if not broken:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except disconnect_errors():
+                broken = True
+        with self._cond:
+            self._in_use -= 1
+            if not broken:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+        if conn is not None:
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def run(self, fn):
+        '''Выполняет fn(conn); если сервер разорвал соединение, повторяет один раз на новом'''
+        for attempt in (1, 2):
+            with span('db.acquire'):
+                conn = self.acquire()
+            try:
+                with span('db.query'):
+                    return fn(conn)
+            except disconnect_errors():
+                if not conn.closed or attempt == 2:
+                    raise
+            finally:
+                self.release(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'discards': self.discards,
+                'idle': len(self._idle),
+                'inUse': self._in_use,
+                'size': self.size
+            }
+
+    def close(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn: str = None, **options) -> ConnectionPool:
+    '''Возвращает пул для DSN (по умолчанию DATABASE_URL), создавая его при первом обращении'''
+    dsn = dsn or os.environ['DATABASE_URL']
+    with _pools_lock:
+        pool = _pools.get(dsn)
+        if pool is None:
+            options.setdefault('size', int(os.environ.get('DB_POOL_SIZE', '4')))
+            pool = ConnectionPool(dsn, **options)
+            _pools[dsn] = pool
+            # DSN содержит пароль, поэтому в метриках пул называется по номеру
+            register_pool(f'sync-{len(_pools)}', pool.stats)
+        return pool
@@ -0,0 +1,174 @@
+import os
+
+from shared import leads, outbox
+from shared.db import get_pool
+from shared.leads import SYSTEMS_LABELS
+from shared.telemetry import annotate
+from shared.templates import EmailTemplate, join
+
+# LEAD_DIGEST=1 - заявки без вложений уходят сводными письмами, а не по одному письму на заявку
+ENABLED = os.environ.get('LEAD_DIGEST', '0') == '1'
+MAX_LEADS = int(os.environ.get('LEAD_DIGEST_MAX', '20'))
+WINDOW_SECONDS = int(os.environ.get('LEAD_DIGEST_WINDOW', '600'))
+# Больше заявок в одно письмо не попадает, даже если их накопилось больше (например, за время сбоя)
+BATCH_LIMIT = 100
+
+DIGEST_ITEM = EmailTemplate("""
+    <tr>
+        <td style="padding: 10px; border-bottom: 1px solid #eee; vertical-align: top; white-space: nowrap;">{{ created_at }}</td>
+        <td style="padding: 10px; border-bottom: 1px solid #eee; vertical-align: top;">
+            <strong>{{ name }}</strong><br>
+            <a href="mailto:{{ email }}">{{ email }}</a><br>
+            {{ phone }}<br>
+            {{ company }}
+        </td>
+        <td style="padding: 10px; border-bottom: 1px solid #eee; vertical-align: top;">{{ systems }}</td>
+        <td style="padding: 10px; border-bottom: 1px solid #eee; vertical-align: top;">{{ message }}</td>
+    </tr>
+""")
+
+DIGEST_TEMPLATE = EmailTemplate("""
+    <html>
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+        <h2 style="color: #ff6b35;">Новые заявки с сайта: {{ count }}</h2>
+        <table style="width: 100%; border-collapse: collapse;">
+            <tr>
+                <th style="padding: 10px; border-bottom: 2px solid #ddd; text-align: left;">Время</th>
+                <th style="padding: 10px; border-bottom: 2px solid #ddd; text-align: left;">Контакты</th>
+                <th style="padding: 10px; border-bottom: 2px solid #ddd; text-align: left;">Системы</th>
+                <th style="padding: 10px; border-bottom: 2px solid #ddd; text-align: left;">Сообщение</th>
+            </tr>
+            {{ items|raw }}
+        </table>
+        <p style="margin-top: 20px; color: #666; font-size: 12px;">
+            Сводка заявок с форм сайта; заявки с вложениями приходят отдельными письмами.
+        </p>
+    </body>
+    </html>
+""")
+
+# Заявка сохраняется и сразу проверяется её группа: число ожидающих с учётом новой и возраст самой старой
+ADD_QUERY = """
+    WITH added AS (
+        INSERT INTO leads (source, name, email, phone, company, message, systems, attachments,
+                           digest_sender, digest_recipient, digest_pending)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, TRUE)
+        RETURNING id
+    )
+    SELECT count(*) + 1 >= %s OR min(created_at) < CURRENT_TIMESTAMP - make_interval(secs => %s)
+    FROM leads
+    WHERE digest_pending AND source = %s AND digest_sender = %s AND digest_recipient = %s
+"""
+
+# Условие готовности проверяется на взятых строках: параллельные вызовы, увидевшие одну и ту же
+# полную группу, не разбирают её остаток на мелкие сводки
+CLAIM_QUERY = """
+    WITH batch AS (
+        SELECT id, created_at FROM leads
+        WHERE digest_pending AND source = %s AND digest_sender = %s AND digest_recipient = %s
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ),
+    ready AS (
+        SELECT 1 FROM batch
+        HAVING count(*) >= %s OR min(created_at) < CURRENT_TIMESTAMP - make_interval(secs => %s)
+    )
+    UPDATE leads
+    SET digest_pending = FALSE
+    WHERE id IN (SELECT id FROM batch) AND EXISTS (SELECT 1 FROM ready)
+    RETURNING id, created_at, name, email, phone, company, message, systems
+"""
+
+DUE_GROUPS_QUERY = """
+    SELECT source, digest_sender, digest_recipient
+    FROM leads
+    WHERE digest_pending
+    GROUP BY source, digest_sender, digest_recipient
+    HAVING count(*) >= %s OR min(created_at) < CURRENT_TIMESTAMP - make_interval(secs => %s)
+"""
+
+
+def is_enabled() -> bool:
+    '''Сводки копятся в таблице leads, поэтому без базы режим недоступен'''
+    return ENABLED and outbox.is_enabled()
+
+
+def is_urgent(attachments) -> bool:
+    '''Заявки с вложениями не ждут сводки: файлы в общем письме неудобно разбирать'''
+    return bool(attachments)
+
+
+def render(rows: list):
+    '''Сводное письмо по строкам CLAIM_QUERY'''
+    items = join([
+        DIGEST_ITEM.render(
+            created_at=created_at.strftime('%d.%m %H:%M'),
+            name=name,
+            email=email,
+            phone=phone or 'Телефон не указан',
+            company=company or 'Компания не указана',
+            systems=', '.join(SYSTEMS_LABELS.get(sys_id, sys_id).split(' - ')[0] for sys_id in systems) or '-',
+            message=message
+        )
+        for _, created_at, name, email, phone, company, message, systems in rows
+    ])
+    msg = DIGEST_TEMPLATE.render(count=len(rows), items=items).mime()
+    msg['Subject'] = f'Новые заявки с сайта: {len(rows)}'
+    return msg
+
+
+def flush_group(conn, source: str, sender: str, recipient: str) -> int:
+    '''Ставит в mail_outbox сводные письма по ожидающим заявкам группы; возвращает число писем'''
+    digests = 0
+    while True:
+        with conn, conn.cursor() as cursor:
+            cursor.execute(CLAIM_QUERY, (source, sender, recipient, BATCH_LIMIT, MAX_LEADS, WINDOW_SECONDS))
+            rows = sorted(cursor.fetchall())
+            if not rows:
+                return digests
+            msg = render(rows)
+            msg['From'] = sender
+            msg['To'] = recipient
+            # Отправитель сводки - логин учётной записи функции, принявшей заявки
+            cursor.execute(outbox.ENQUEUE_QUERY, outbox.enqueue_params(msg, source, sender))
+            cursor.execute('UPDATE leads SET outbox_id = %s WHERE id = ANY(%s)',
+                           (cursor.fetchone()[0], [row[0] for row in rows]))
+        digests += 1
+        if len(rows) < BATCH_LIMIT:
+            return digests
+
+
+def flush_due(conn) -> int:
+    '''Сводки всех групп, где набралось MAX_LEADS заявок или истекло окно; вызывается функцией mail-outbox'''
+    with conn, conn.cursor() as cursor:
+        cursor.execute(DUE_GROUPS_QUERY, (MAX_LEADS, WINDOW_SECONDS))
+        groups = cursor.fetchall()
+    return sum(flush_group(conn, *group) for group in groups)
+
+
+def add(source: str, fields: dict, sender: str, recipient: str, systems=()) -> bool:
+    '''Сохраняет заявку в ожидание сводки; если группа готова, сразу ставит сводку в очередь.
+
+    Возвращает True, если сводка поставлена в очередь этим вызовом.
+    '''
+    params = (
+        leads.lead_params(source, fields, systems)
+        + (sender, recipient, MAX_LEADS, WINDOW_SECONDS, source, sender, recipient)
+    )
+
+    def insert(conn) -> bool:
+        with conn, conn.cursor() as cursor:
+            cursor.execute(ADD_QUERY, params)
+            due = cursor.fetchone()[0]
+        if not due:
+            return False
+        try:
+            flush_group(conn, source, sender, recipient)
+        except Exception as e:
+            # Заявка уже сохранена: сводку отправит следующий вызов или таймер mail-outbox
+            annotate(digest_error=str(e))
+            return False
+        return True
+
+    return get_pool().run(insert)
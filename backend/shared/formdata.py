@@ -0,0 +1,192 @@
+import base64
+import binascii
+import os
+
+from shared.attachments import (
+    MAX_ATTACHMENT_BYTES, MAX_ATTACHMENTS, AttachmentError, bytes_part, check_allowed
+)
+from shared.telemetry import span
+
+MAX_REQUEST_BYTES = int(os.environ.get('FORM_MAX_REQUEST_BYTES', str(MAX_ATTACHMENTS * MAX_ATTACHMENT_BYTES)))
+MAX_FIELD_BYTES = 64 * 1024
+MAX_HEADER_BYTES = 16 * 1024
+# Кратно 4, чтобы тело в base64 можно было декодировать по кускам
+FEED_CHUNK = 64 * 1024
+
+
+class FormDataError(ValueError):
+    pass
+
+
+class RequestTooLarge(FormDataError):
+    pass
+
+
+def boundary_from(content_type: str) -> bytes:
+    from email.message import Message
+    from email.utils import collapse_rfc2231_value
+    header = Message()
+    header['Content-Type'] = content_type
+    boundary = header.get_param('boundary')
+    if not boundary:
+        raise FormDataError('Не указан boundary')
+    return collapse_rfc2231_value(boundary).encode('latin-1')
+
+
+class FormDataParser:
+    '''Потоковый разбор multipart/form-data: тело подаётся кусками через feed().
+
+    Файл недопустимого типа или сверх лимита отбрасывается сразу, как только
+    это становится известно, - его оставшиеся байты не накапливаются.
+    '''
+
+    def __init__(self, boundary: bytes, max_file_bytes: int = MAX_ATTACHMENT_BYTES,
+                 max_files: int = MAX_ATTACHMENTS):
+        self.delimiter = b'\r\n--' + boundary
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.fields = {}
+        self.files = []
+        self.rejected = []
+        self._buffer = bytearray(b'\r\n')
+        self._state = 'preamble'
+        self._part = None
+
+    def feed(self, chunk: bytes) -> None:
+        self._buffer += chunk
+        while self._step():
+            pass
+
+    def close(self) -> None:
+        if self._state != 'end':
+            raise FormDataError('Тело multipart/form-data оборвано')
+
+    def _step(self) -> bool:
+        buffer = self._buffer
+        if self._state == 'end':
+            buffer.clear()
+            return False
+
+        if self._state == 'headers':
+            index = buffer.find(b'\r\n\r\n')
+            if index < 0:
+                if len(buffer) > MAX_HEADER_BYTES:
+                    raise FormDataError('Слишком длинные заголовки части')
+                return False
+            self._start_part(bytes(buffer[:index]))
+            del buffer[:index + 4]
+            self._state = 'body'
+            return True
+
+        index = buffer.find(self.delimiter)
+        if index < 0:
+            keep = len(self.delimiter) + 1
+            if len(buffer) > keep:
+                if self._state == 'body':
+                    self._data(buffer[:-keep])
+                del buffer[:-keep]
+            return False
+
+        if self._state == 'body':
+            self._data(buffer[:index])
+            self._finish_part()
+            self._state = 'preamble'
+        after = index + len(self.delimiter)
+        if len(buffer) < after + 2:
+            del buffer[:index]
+            return False
+        marker = bytes(buffer[after:after + 2])
+        del buffer[:after + 2]
+        if marker == b'--':
+            self._state = 'end'
+        elif marker == b'\r\n':
+            self._state = 'headers'
+        else:
+            raise FormDataError('Некорректный разделитель multipart')
+        return True
+
+    def _start_part(self, raw_headers: bytes) -> None:
+        from email.message import Message
+        from email.utils import collapse_rfc2231_value
+        headers = Message()
+        for line in raw_headers.decode('utf-8', 'replace').split('\r\n'):
+            key, _, value = line.partition(':')
+            if key.strip():
+                headers[key.strip()] = value.strip()
+        name = headers.get_param('name', header='content-disposition')
+        filename = headers.get_param('filename', header='content-disposition')
+        part = {
+            'name': collapse_rfc2231_value(name) if name else None,
+            'filename': collapse_rfc2231_value(filename) if filename is not None else None,
+            'contentType': headers.get_content_type() if headers['Content-Type'] else None,
+            'data': bytearray(),
+            'error': None
+        }
+        if part['filename']:
+            try:
+                if len(self.files) + len(self.rejected) >= self.max_files:
+                    raise AttachmentError(f'Можно приложить не более {self.max_files} файлов')
+                check_allowed(part['filename'])
+            except AttachmentError as e:
+                part['data'] = None
+                part['error'] = str(e)
+        self._part = part
+
+    def _data(self, chunk) -> None:
+        part = self._part
+        if part['data'] is None:
+            return
+        limit = self.max_file_bytes if part['filename'] is not None else MAX_FIELD_BYTES
+        if len(part['data']) + len(chunk) > limit:
+            if part['filename'] is None:
+                raise RequestTooLarge(f'Поле {part["name"]} слишком длинное')
+            part['data'] = None
+            part['error'] = f'Файл больше {limit // (1024 * 1024)} МБ'
+            return
+        part['data'] += chunk
+
+    def _finish_part(self) -> None:
+        part, self._part = self._part, None
+        if part['filename'] is None:
+            if part['name']:
+                self.fields.setdefault(part['name'], []).append(part['data'].decode('utf-8', 'replace'))
+        elif part['error']:
+            self.rejected.append({'name': part['filename'], 'error': part['error']})
+        elif part['filename'] and part['data']:
+            self.files.append((part['data'], part['filename'], part['contentType']))
+
+    def attachment_parts(self) -> list:
+        '''Части MIME принятых файлов: base64 кодируется не при разборе, а когда заявка прошла лимиты'''
+        return [bytes_part(data, filename, content_type) for data, filename, content_type in self.files]
+
+
+def iter_body(event: dict):
+    '''Тело события кусками байтов; тело в base64 декодируется по кускам, а не целиком'''
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        if '\n' in body or '\r' in body:
+            body = ''.join(body.split())
+        for start in range(0, len(body), FEED_CHUNK):
+            yield base64.b64decode(body[start:start + FEED_CHUNK])
+    elif isinstance(body, bytes):
+        for start in range(0, len(body), FEED_CHUNK):
+            yield body[start:start + FEED_CHUNK]
+    else:
+        for start in range(0, len(body), FEED_CHUNK):
+            yield body[start:start + FEED_CHUNK].encode('utf-8', 'surrogateescape')
+
+
+def parse(event: dict, content_type: str) -> FormDataParser:
+    body = event.get('body') or ''
+    size = len(body) // 4 * 3 if event.get('isBase64Encoded') else len(body)
+    if size > MAX_REQUEST_BYTES:
+        raise RequestTooLarge(f'Запрос больше {MAX_REQUEST_BYTES // (1024 * 1024)} МБ')
+    parser = FormDataParser(boundary_from(content_type))
+    with span('parse'):
+        try:
+            for chunk in iter_body(event):
+                parser.feed(chunk)
+        except binascii.Error:
+            raise FormDataError('Некорректная кодировка base64') from None
+        parser.close()
+    return parser
@@ -0,0 +1,116 @@
+import binascii
+import functools
+import json
+import os
+from shared import serializer, telemetry
+
+# Заголовки ответов собираются один раз при импорте и не копируются на каждый вызов
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+# Ошибки разбора тела запроса, которые означают 400, а не сбой функции; ловятся только при чтении тела
+BAD_BODY_ERRORS = (json.JSONDecodeError, UnicodeDecodeError, binascii.Error)
+METHOD_NOT_ALLOWED = json.dumps({'error': 'Method not allowed'})
+
+
+class HttpError(Exception):
+    '''Ошибка, которую endpoint превращает в ответ с кодом status и {"error": message}'''
+
+    def __init__(self, status: int, message: str, headers: dict = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers
+
+    def response(self) -> dict:
+        return error(self.status, self.message, self.headers)
+
+
+class BadBody(HttpError):
+    '''Тело запроса не разбирается; endpoint отвечает 400 со своим текстом bad_body'''
+
+    def __init__(self):
+        super().__init__(400, 'Некорректный формат данных')
+
+
+def response(status: int, payload=None, headers: dict = None, body: str = None) -> dict:
+    '''Ответ функции; payload сериализуется в JSON (shared.serializer), если не передано готовое тело body'''
+    return {
+        'statusCode': status,
+        'headers': JSON_HEADERS if headers is None else headers,
+        'body': body if body is not None else serializer.dumps(payload),
+        'isBase64Encoded': False
+    }
+
+
+def error(status: int, message: str, headers: dict = None) -> dict:
+    return response(status, {'error': message}, headers)
+
+
+def request_headers(event: dict) -> dict:
+    return {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+
+
+def json_body(event: dict, default: str = '{}'):
+    '''Тело запроса как JSON; тело с isBase64Encoded сначала декодируется'''
+    raw = event.get('body') or default
+    if isinstance(raw, (dict, list)):
+        return raw
+    with telemetry.span('parse'):
+        try:
+            if event.get('isBase64Encoded'):
+                import base64
+                raw = base64.b64decode(raw)
+            return serializer.loads(raw)
+        except BAD_BODY_ERRORS:
+            raise BadBody() from None
+
+
+def metrics_response(event: dict) -> dict:
+    '''Гистограммы экземпляра в формате Prometheus, если запрос пришёл с верным X-Metrics-Token'''
+    token = telemetry.METRICS_TOKEN
+    if not token:
+        return None
+    import hmac
+    if not hmac.compare_digest(request_headers(event).get('x-metrics-token', ''), token):
+        return None
+    return response(200, headers={'Content-Type': 'text/plain; version=0.0.4'}, body=telemetry.prometheus())
+
+
+def endpoint(methods=('POST',), allow_headers: str = 'Content-Type', max_age: int = None,
+             default_method: str = 'POST', error_prefix: str = '', bad_body: str = 'Некорректный формат данных'):
+    '''Оборачивает handler: отвечает на CORS preflight и чужие методы, не вызывая его,
+    и превращает HttpError (BadBody из json_body - в 400 с текстом bad_body) и прочие исключения в ответы.
+
+    Каждый вызов замеряется shared.telemetry под именем каталога функции.'''
+    allowed = frozenset(methods)
+    preflight = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': ', '.join((*methods, 'OPTIONS')),
+        'Access-Control-Allow-Headers': allow_headers
+    }
+    if max_age:
+        preflight['Access-Control-Max-Age'] = str(max_age)
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def handler(event: dict, context) -> dict:
+            method = event.get('httpMethod', default_method)
+            if method == 'OPTIONS':
+                return response(200, headers=preflight, body='')
+            if method == 'GET' and telemetry.METRICS_TOKEN and event.get('headers'):
+                metrics = metrics_response(event)
+                if metrics is not None:
+                    return metrics
+            if method not in allowed:
+                return response(405, body=METHOD_NOT_ALLOWED)
+            try:
+                return fn(event, context)
+            except BadBody:
+                return error(400, bad_body)
+            except HttpError as e:
+                return e.response()
+            except Exception as e:
+                return error(500, f'{error_prefix}{e}')
+        name = os.path.basename(os.path.dirname(os.path.abspath(fn.__code__.co_filename)))
+        return functools.wraps(fn)(telemetry.traced(name, handler))
+    return decorate
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import random
+from collections import namedtuple
+
+from shared.cache import TTLCache
+from shared.db import get_pool
+from shared.http import JSON_HEADERS, error
+from shared.telemetry import span
+
+# Окно для запросов с Idempotency-Key и для совпадающих по содержимому заявок без него
+KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', str(24 * 60 * 60)))
+DUPLICATE_WINDOW = int(os.environ.get('IDEMPOTENCY_DUPLICATE_WINDOW', '600'))
+# Сколько повторный запрос ждёт завершения первого, прежде чем взять заявку себе
+LOCK_SECONDS = 60
+PURGE_PROBABILITY = 0.01
+
+RequestKey = namedtuple('RequestKey', 'digest scope ttl')
+
+responses = TTLCache(maxsize=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '1024')), ttl=KEY_TTL)
+
+
+def is_persistent() -> bool:
+    return bool(os.environ.get('DATABASE_URL'))
+
+
+def request_key(event: dict, scope: str, fields) -> RequestKey:
+    '''Ключ заявки: заголовок Idempotency-Key, а без него - хэш полей формы'''
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    client_key = (headers.get('idempotency-key') or '').strip()
+    if client_key:
+        source, ttl = f'{scope}\0key\0{client_key}', KEY_TTL
+    else:
+        normalized = (' '.join(str(value).split()).lower() for value in fields)
+        source, ttl = f'{scope}\0body\0' + '\0'.join(normalized), DUPLICATE_WINDOW
+    return RequestKey(hashlib.sha256(source.encode('utf-8')).hexdigest(), scope, ttl)
+
+
+def replayed(response: dict) -> dict:
+    return {**response, 'headers': {**response.get('headers', {}), 'Idempotent-Replayed': 'true'}}
+
+
+def in_progress() -> dict:
+    return error(409, 'Заявка уже обрабатывается', {**JSON_HEADERS, 'Retry-After': '5'})
+
+
+def _claim_row(conn, key: RequestKey):
+    with conn, conn.cursor() as cursor:
+        if random.random() < PURGE_PROBABILITY:
+            cursor.execute('DELETE FROM idempotency_keys WHERE expires_at < CURRENT_TIMESTAMP')
+        cursor.execute(
+            """
+            INSERT INTO idempotency_keys (key, scope, locked_until, expires_at)
+            VALUES (%s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s), CURRENT_TIMESTAMP + make_interval(secs => %s))
+            ON CONFLICT (key) DO UPDATE
+            SET response = NULL,
+                locked_until = EXCLUDED.locked_until,
+                expires_at = EXCLUDED.expires_at,
+                created_at = CURRENT_TIMESTAMP
+            WHERE idempotency_keys.expires_at <= CURRENT_TIMESTAMP
+               OR (idempotency_keys.response IS NULL AND idempotency_keys.locked_until <= CURRENT_TIMESTAMP)
+            RETURNING key
+            """,
+            (key.digest, key.scope, LOCK_SECONDS, key.ttl)
+        )
+        if cursor.fetchone():
+            return None
+        cursor.execute('SELECT response FROM idempotency_keys WHERE key = %s', (key.digest,))
+        row = cursor.fetchone()
+        return row[0] if row and row[0] is not None else in_progress()
+
+
+def claim(key: RequestKey):
+    '''Берёт заявку в обработку; для повтора возвращает готовый ответ (сохранённый или 409), иначе None'''
+    cached = responses.get(key.digest)
+    if cached is not None:
+        return replayed(cached)
+    if not is_persistent():
+        return None
+
+    with span('idempotency'):
+        response = get_pool().run(lambda conn: _claim_row(conn, key))
+    if response is None or response['statusCode'] == 409:
+        return response
+    responses.set(key.digest, response, ttl=key.ttl)
+    return replayed(response)
+
+
+def stored(key: RequestKey):
+    '''Сохранённый ответ заявки, не беря её в обработку; None, если ответа нет'''
+    cached = responses.get(key.digest)
+    if cached is not None:
+        return replayed(cached)
+    if not is_persistent():
+        return None
+
+    def select(conn):
+        with conn, conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT response FROM idempotency_keys
+                WHERE key = %s AND response IS NOT NULL AND expires_at > CURRENT_TIMESTAMP
+                """,
+                (key.digest,)
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    with span('idempotency'):
+        response = get_pool().run(select)
+    if response is None:
+        return None
+    responses.set(key.digest, response, ttl=key.ttl)
+    return replayed(response)
+
+
+def complete(key: RequestKey, response: dict) -> None:
+    '''Сохраняет ответ, который получат повторы этой заявки'''
+    responses.set(key.digest, response, ttl=key.ttl)
+    if not is_persistent():
+        return
+
+    def save(conn) -> None:
+        with conn, conn.cursor() as cursor:
+            cursor.execute(
+                'UPDATE idempotency_keys SET response = %s WHERE key = %s',
+                (json.dumps(response), key.digest)
+            )
+
+    with span('idempotency'):
+        get_pool().run(save)
+
+
+def release(key: RequestKey) -> None:
+    '''Снимает блокировку после ошибки, чтобы повтор заявки мог её отправить'''
+    responses.pop(key.digest)
+    if not is_persistent():
+        return
+
+    def delete(conn) -> None:
+        with conn, conn.cursor() as cursor:
+            cursor.execute('DELETE FROM idempotency_keys WHERE key = %s AND response IS NULL', (key.digest,))
+
+    get_pool().run(delete)
@@ -0,0 +1,59 @@
+from shared import outbox
+from shared.attachments import describe
+from shared.db import get_pool
+
+# Системы, которые можно выбрать в форме send-email: код - название
+SYSTEMS_LABELS = {
+    'sks': 'СКС - Структурированные кабельные системы',
+    'saps': 'САПС - Система автоматической пожарной сигнализации',
+    'soue': 'СОУЭ - Система оповещения и управления эвакуацией',
+    'skud': 'СКУД - Система контроля и управления доступом',
+    'sots': 'СОТС - Система охранно-тревожной сигнализации',
+    'sot': 'СОТ - Система охранного телевидения',
+    'askue': 'АСКУЭ - Автоматизированная система коммерческого учета электроэнергии',
+    'eom': 'ЭОМ - Электрооборудование и молниезащита',
+    'ovik': 'ОВИК - Отопление, вентиляция и кондиционирование'
+}
+
+# Предельные длины полей формы - по столбцам таблицы leads; email - по RFC 5321
+FIELD_LIMITS = {'name': 255, 'email': 254, 'phone': 100, 'company': 255}
+
+# Письмо и заявка сохраняются одним запросом: хранение заявок не добавляет обращений к базе
+ENQUEUE_QUERY = f"""
+    WITH queued AS ({outbox.ENQUEUE_QUERY})
+    INSERT INTO leads (source, name, email, phone, company, message, systems, attachments, outbox_id)
+    SELECT %s, %s, %s, %s, %s, %s, %s, %s, id FROM queued
+    RETURNING outbox_id
+"""
+
+
+def too_long(fields: dict):
+    '''Первое поле формы, длиннее допустимого, или None'''
+    return next((name for name, limit in FIELD_LIMITS.items() if len(str(fields.get(name) or '')) > limit), None)
+
+
+def lead_params(source: str, fields: dict, systems=(), attachments=()) -> tuple:
+    '''Параметры строки leads: пустые телефон и компания хранятся как NULL, вложения - только описанием'''
+    from psycopg2.extras import Json
+    return (
+        source,
+        fields['name'],
+        fields['email'],
+        fields.get('phone') or None,
+        fields.get('company') or None,
+        fields['message'],
+        [str(sys_id) for sys_id in systems],
+        Json([describe(part) for part in attachments])
+    )
+
+
+def enqueue(msg, source: str, account: str, fields: dict, systems=(), attachments=()) -> int:
+    '''Ставит письмо в mail_outbox и сохраняет заявку; возвращает id письма в очереди'''
+    params = outbox.enqueue_params(msg, source, account) + lead_params(source, fields, systems, attachments)
+
+    def insert(conn) -> int:
+        with conn, conn.cursor() as cursor:
+            cursor.execute(ENQUEUE_QUERY, params)
+            return cursor.fetchone()[0]
+
+    return get_pool().run(insert)
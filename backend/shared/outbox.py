@@ -0,0 +1,127 @@
+import os
+import random
+
+from shared.db import get_pool
+from shared.smtp_pool import EOL, message_bytes
+
+MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+BACKOFF_BASE = 30
+BACKOFF_MAX = 6 * 60 * 60
+LEASE_SECONDS = 300
+
+
+def is_enabled() -> bool:
+    '''Очередь включается, если функции доступна база данных'''
+    return bool(os.environ.get('DATABASE_URL'))
+
+
+ENQUEUE_QUERY = """
+    INSERT INTO mail_outbox (source, smtp_account, sender, recipients, subject, message)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    RETURNING id
+"""
+
+
+def enqueue_params(msg, source: str, account: str) -> tuple:
+    '''Параметры ENQUEUE_QUERY для готового письма; account - логин SMTP, от имени которого оно уйдёт'''
+    import psycopg2
+    recipients = [addr.strip() for addr in str(msg['To']).split(',') if addr.strip()]
+    return source, account, str(msg['From']), recipients, str(msg['Subject']), psycopg2.Binary(message_bytes(msg))
+
+
+def enqueue(msg, source: str, account: str) -> int:
+    '''Сохраняет готовое письмо в mail_outbox и возвращает id записи'''
+    params = enqueue_params(msg, source, account)
+
+    def insert(conn) -> int:
+        with conn, conn.cursor() as cursor:
+            cursor.execute(ENQUEUE_QUERY, params)
+            return cursor.fetchone()[0]
+
+    return get_pool().run(insert)
+
+
+def backoff_seconds(attempts: int) -> int:
+    '''Экспоненциальная задержка перед повтором с небольшим разбросом'''
+    delay = min(BACKOFF_BASE * 2 ** max(attempts - 1, 0), BACKOFF_MAX)
+    return int(delay * random.uniform(0.8, 1.2))
+
+
+def claim_batch(conn, account: str, limit: int) -> list:
+    '''Берёт в работу пачку писем учётной записи, срок которых подошёл, не блокируя параллельные обработчики'''
+    with conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE mail_outbox
+            SET status = 'sending',
+                attempts = attempts + 1,
+                next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            WHERE id IN (
+                SELECT id FROM mail_outbox
+                WHERE smtp_account = %s
+                  AND status IN ('pending', 'sending') AND next_attempt_at <= CURRENT_TIMESTAMP
+                ORDER BY next_attempt_at, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, sender, recipients, message, attempts
+            """,
+            (LEASE_SECONDS, account, limit)
+        )
+        return sorted(cursor.fetchall())
+
+
+def mark_sent(conn, outbox_id: int) -> None:
+    with conn, conn.cursor() as cursor:
+        cursor.execute(
+            "UPDATE mail_outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL WHERE id = %s",
+            (outbox_id,)
+        )
+
+
+def mark_failed(conn, outbox_id: int, attempts: int, error: str) -> str:
+    '''Откладывает письмо на повтор или переводит его в dead после исчерпания попыток'''
+    status = 'dead' if attempts >= MAX_ATTEMPTS else 'pending'
+    with conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE mail_outbox
+            SET status = %s,
+                last_error = %s,
+                next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            WHERE id = %s
+            """,
+            (status, error[:2000], backoff_seconds(attempts), outbox_id)
+        )
+    return status
+
+
+def drain(conn, pool, account: str, limit: int = 50) -> dict:
+    '''Отправляет пачку писем учётной записи account через одну SMTP-сессию пула'''
+    stats = {'sent': 0, 'retry': 0, 'dead': 0}
+    rows = claim_batch(conn, account, limit)
+    if not rows:
+        return stats
+
+    import smtplib
+    # Ошибки, после которых SMTP-сессия остаётся пригодной для следующих писем
+    message_errors = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+    server = None
+    for outbox_id, sender, recipients, message, attempts in rows:
+        try:
+            if server is None:
+                server = pool.acquire()
+            # Письма, поставленные в очередь до перехода на CRLF, хранятся с LF
+            server.sendmail(sender, list(recipients), EOL.sub(b'\r\n', bytes(message)))
+        except Exception as e:
+            if server is not None and not isinstance(e, message_errors):
+                pool.release(server, broken=True)
+                server = None
+            stats['retry' if mark_failed(conn, outbox_id, attempts, str(e)) == 'pending' else 'dead'] += 1
+        else:
+            mark_sent(conn, outbox_id)
+            stats['sent'] += 1
+
+    if server is not None:
+        pool.release(server)
+    return stats
@@ -0,0 +1,150 @@
+import hashlib
+import math
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+
+from shared.cache import TTLCache
+from shared.db import get_pool
+from shared.http import JSON_HEADERS, error
+from shared.telemetry import span
+
+Limit = namedtuple('Limit', 'capacity period')
+PURGE_PROBABILITY = 0.01
+# Остаток токенов строки rate_limits с учётом пополнения с момента updated_at
+REFILLED = ('LEAST(%(capacity)s::float8, rate_limits.tokens'
+            ' + EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - rate_limits.updated_at) * %(rate)s)')
+
+
+def parse_limit(value: str) -> Limit:
+    '''Лимит в виде "количество/секунды": 5/600 - не больше 5 заявок за 10 минут'''
+    count, _, seconds = value.partition('/')
+    return Limit(int(count), float(seconds or 60))
+
+
+# Нулевое количество отключает проверку
+LIMITS = {
+    'ip': parse_limit(os.environ.get('RATE_LIMIT_PER_IP', '5/600')),
+    'email': parse_limit(os.environ.get('RATE_LIMIT_PER_EMAIL', '3/3600'))
+}
+
+buckets = TTLCache(maxsize=int(os.environ.get('RATE_LIMIT_CACHE_SIZE', '4096')),
+                   ttl=max(limit.period for limit in LIMITS.values()))
+_lock = threading.Lock()
+UNKNOWN_IP = 'unknown'
+
+
+def is_persistent() -> bool:
+    return bool(os.environ.get('DATABASE_URL'))
+
+
+def source_ip(event: dict) -> str:
+    '''IP клиента, переданный платформой. X-Forwarded-For не используется: его задаёт сам клиент.
+
+    Запросы без IP делят одну корзину UNKNOWN_IP, а не проходят без лимита.
+    '''
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    return identity.get('sourceIp') or UNKNOWN_IP
+
+
+def bucket_key(scope: str, kind: str, value: str) -> str:
+    '''Ключ корзины фиксированной длины: email приходит от клиента и может не поместиться в rate_limits.key'''
+    digest = hashlib.sha256(value.strip().lower().encode('utf-8', 'surrogateescape')).hexdigest()
+    return f'{scope}:{kind}:{digest}'
+
+
+def too_many_requests(retry_after: float) -> dict:
+    return error(429, 'Слишком много заявок, попробуйте позже',
+                 {**JSON_HEADERS, 'Retry-After': str(math.ceil(retry_after))})
+
+
+def _take_local(key: str, limit: Limit) -> tuple:
+    '''Берёт токен из корзины экземпляра; возвращает (пропущен ли запрос, остаток токенов)'''
+    rate = limit.capacity / limit.period
+    now = time.monotonic()
+    with _lock:
+        state = buckets.get(key)
+        if state is None:
+            state = [float(limit.capacity), now]
+            buckets.set(key, state, ttl=limit.period)
+        tokens = min(limit.capacity, state[0] + (now - state[1]) * rate)
+        allowed = tokens >= 1
+        state[0], state[1] = tokens - 1 if allowed else tokens, now
+        return allowed, state[0]
+
+
+def _take_shared(conn, key: str, limit: Limit) -> tuple:
+    '''То же в общей таблице rate_limits; upsert блокирует строку, списания параллельных запросов не теряются'''
+    with conn, conn.cursor() as cursor:
+        if random.random() < PURGE_PROBABILITY:
+            cursor.execute(
+                'DELETE FROM rate_limits WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)',
+                (buckets.ttl,)
+            )
+        cursor.execute(
+            f"""
+            INSERT INTO rate_limits (key, tokens, allowed, updated_at)
+            VALUES (%(key)s, %(capacity)s - 1, TRUE, CURRENT_TIMESTAMP)
+            ON CONFLICT (key) DO UPDATE
+            SET tokens = {REFILLED} - CASE WHEN {REFILLED} >= 1 THEN 1 ELSE 0 END,
+                allowed = {REFILLED} >= 1,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING allowed, tokens
+            """,
+            {'key': key, 'capacity': limit.capacity, 'rate': limit.capacity / limit.period}
+        )
+        return cursor.fetchone()
+
+
+def check(scope: str, kind: str, value: str):
+    '''Учитывает заявку по ключу (IP или email); при превышении лимита возвращает ответ 429, иначе None.
+
+    Корзина экземпляра отсекает частые повторы без обращения к базе; общая
+    таблица считает заявки, пришедшие на разные экземпляры функции.
+    '''
+    limit = LIMITS[kind]
+    if not value or limit.capacity <= 0:
+        return None
+    key = bucket_key(scope, kind, value)
+
+    allowed, tokens = _take_local(key, limit)
+    if allowed and is_persistent():
+        with span('ratelimit'):
+            allowed, tokens = get_pool().run(lambda conn: _take_shared(conn, key, limit))
+        with _lock:
+            state = buckets.get(key)
+            if state is not None:
+                state[0] = min(state[0], tokens)
+    if allowed:
+        return None
+    return too_many_requests((1 - tokens) * limit.period / limit.capacity)
+
+
+def refund(scope: str, *checks) -> None:
+    '''Возвращает токены, списанные check для пар (kind, value): повтор уже принятой заявки лимит не расходует'''
+    keys = []
+    for kind, value in checks:
+        limit = LIMITS[kind]
+        if not value or limit.capacity <= 0:
+            continue
+        key = bucket_key(scope, kind, value)
+        keys.append((key, limit))
+        with _lock:
+            state = buckets.get(key)
+            if state is not None:
+                state[0] = min(limit.capacity, state[0] + 1)
+    if not keys or not is_persistent():
+        return
+
+    def give_back(conn) -> None:
+        with conn, conn.cursor() as cursor:
+            for key, limit in keys:
+                cursor.execute(
+                    'UPDATE rate_limits SET tokens = LEAST(%s::float8, tokens + 1) WHERE key = %s',
+                    (limit.capacity, key)
+                )
+
+    with span('ratelimit'):
+        get_pool().run(give_back)
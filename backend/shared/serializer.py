@@ -0,0 +1,87 @@
+import datetime
+import decimal
+import json
+import os
+
+# JSON_BACKEND=json отключает orjson даже при наличии пакета (для сравнения и отладки)
+PREFERRED = os.environ.get('JSON_BACKEND', 'orjson')
+
+_orjson = None
+_resolved = False
+
+# Столько значащих цифр double передаёт без искажений: DECIMAL(15, 2) всегда в них помещается
+EXACT_DIGITS = 15
+
+
+def encode_decimal(value: decimal.Decimal):
+    '''Decimal числом, если float передаёт его точно; длинные значения - строкой, чтобы не терять точность'''
+    if not value.is_finite():
+        return None
+    text = str(value)
+    # Цифры считаются по строке: as_tuple() заметно дороже на больших ответах
+    digits = len(value.as_tuple().digits) if 'E' in text else len(text) - text.startswith('-') - ('.' in text)
+    return float(value) if digits <= EXACT_DIGITS else text
+
+
+# Кодировщики по точному типу: словарь быстрее цепочки isinstance в горячем default
+ENCODERS = {
+    decimal.Decimal: encode_decimal,
+    datetime.date: datetime.date.isoformat,
+    datetime.datetime: datetime.datetime.isoformat,
+    datetime.time: datetime.time.isoformat
+}
+
+
+def _default(value):
+    encoder = ENCODERS.get(type(value))
+    if encoder is None:
+        for base, candidate in ENCODERS.items():
+            if isinstance(value, base):
+                encoder = candidate
+                break
+        else:
+            raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+    return encoder(value)
+
+
+def fast_encoder():
+    '''Модуль orjson, если он установлен и не отключён, иначе None.
+
+    Импорт orjson тянет uuid, zoneinfo и enum (~10 мс), поэтому он выполняется при первой
+    сериализации, а не при импорте функции: OPTIONS и прочие вызовы без JSON его не ждут.
+    '''
+    global _orjson, _resolved
+    if not _resolved:
+        if PREFERRED == 'orjson':
+            try:
+                import orjson
+                _orjson = orjson
+            except ImportError:
+                pass
+        _resolved = True
+    return _orjson
+
+
+def use(preferred: str) -> None:
+    '''Переключает сериализатор ('orjson' или 'json'); для бенчмарков и отладки'''
+    global PREFERRED, _orjson, _resolved
+    PREFERRED, _orjson, _resolved = preferred, None, False
+
+
+def backend() -> str:
+    return 'orjson' if fast_encoder() else 'json'
+
+
+def dumps(value) -> str:
+    '''JSON без пробелов и с UTF-8 как есть; Decimal, date и datetime кодируются без подготовки данных'''
+    encoder = fast_encoder()
+    if encoder is not None:
+        return encoder.dumps(value, default=_default).decode()
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads(data):
+    encoder = fast_encoder()
+    if encoder is not None:
+        return encoder.loads(data)
+    return json.loads(data)
@@ -0,0 +1,247 @@
+import io
+import os
+import re
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from shared.telemetry import span
+
+# Части больше этого размера не сериализуются целиком, а передаются в DATA кусками
+STREAM_THRESHOLD = 64 * 1024
+STREAM_CHUNK = 64 * 1024
+EOL = re.compile(rb'\r\n|\r|\n')
+LINE_START_DOT = re.compile(rb'(?m)^\.')
+
+
+def to_wire(data: bytes) -> bytes:
+    '''CRLF-переводы строк и экранирование точки в начале строки для команды DATA'''
+    return LINE_START_DOT.sub(b'..', EOL.sub(b'\r\n', data))
+
+
+def _iter_payload(part):
+    '''Текст большой части кусками по границам строк; base64 без переносов (wrap_at) разбивается на строки на лету'''
+    payload = part._payload
+    wrap_at = getattr(part, 'wrap_at', None)
+    if wrap_at:
+        step = wrap_at * (STREAM_CHUNK // wrap_at)
+        for start in range(0, len(payload), step):
+            piece = payload[start:start + step]
+            yield ('\n'.join([piece[i:i + wrap_at] for i in range(0, len(piece), wrap_at)]) + '\n').encode('ascii')
+        return
+    start = 0
+    while start < len(payload):
+        end = payload.rfind('\n', start, start + STREAM_CHUNK) + 1
+        if end <= start:
+            end = min(start + STREAM_CHUNK, len(payload))
+        yield payload[start:end].encode('ascii', 'surrogateescape')
+        start = end
+
+
+def iter_message(msg):
+    '''Сериализует письмо кусками: заголовки и мелкие части целиком, большие части и base64 с wrap_at - отдельно'''
+    from email.generator import BytesGenerator
+    streamed = {}
+    for part in msg.walk():
+        if part.is_multipart() or not isinstance(part._payload, str):
+            continue
+        # base64 без переносов (wrap_at) разбивается на строки при любом размере: одной строкой
+        # даже небольшое вложение превышает предел длины строки SMTP
+        if len(part._payload) > STREAM_THRESHOLD or getattr(part, 'wrap_at', None):
+            token = f'stream-part-{os.urandom(16).hex()}'
+            streamed[token] = (part, part._payload)
+            part._payload = token
+    try:
+        skeleton = io.BytesIO()
+        BytesGenerator(skeleton, mangle_from_=False).flatten(msg, linesep='\n')
+    finally:
+        for part, payload in streamed.values():
+            part._payload = payload
+
+    for index, piece in enumerate(re.split(rb'(stream-part-[0-9a-f]{32})', skeleton.getvalue())):
+        if index % 2:
+            yield from _iter_payload(streamed[piece.decode()][0])
+        elif piece:
+            yield piece
+
+
+def message_bytes(msg) -> bytes:
+    '''Письмо целиком с CRLF-переводами строк: smtplib.sendmail отправляет bytes как есть, экранируя только точки'''
+    return EOL.sub(b'\r\n', b''.join(iter_message(msg)))
+
+
+def envelope(msg, from_addr: str = None, to_addrs=None) -> tuple:
+    '''Отправитель и получатели SMTP-конверта; по умолчанию берутся из From, To и Cc письма'''
+    from email.utils import getaddresses
+    if from_addr is None:
+        from_addr = getaddresses([str(msg['From'])])[0][1]
+    if to_addrs is None:
+        to_addrs = [addr for _, addr in getaddresses([str(value) for value in msg.get_all('To', []) + msg.get_all('Cc', [])])]
+    elif isinstance(to_addrs, str):
+        to_addrs = [to_addrs]
+    return from_addr, to_addrs
+
+
+def stream_message(server: 'smtplib.SMTP', msg, from_addr: str = None, to_addrs=None) -> dict:
+    '''Отправляет письмо, не собирая его целиком в памяти: большие части (вложения) идут в сокет кусками'''
+    import smtplib
+    from_addr, to_addrs = envelope(msg, from_addr, to_addrs)
+
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(from_addr)
+    if code != 250:
+        server.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    refused = {}
+    for addr in to_addrs:
+        code, resp = server.rcpt(addr)
+        if code not in (250, 251):
+            refused[addr] = (code, resp)
+    if len(refused) == len(to_addrs):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    code, resp = server.docmd('data')
+    if code != 354:
+        server.rset()
+        raise smtplib.SMTPDataError(code, resp)
+
+    # Последний кусок уходит одним send вместе с точкой: иначе маленькое письмо и терминатор
+    # идут двумя сегментами, и алгоритм Нейгла ждёт отложенного ACK сервера (~40 мс)
+    pending = b''
+    for chunk in iter_message(msg):
+        if pending:
+            server.send(pending)
+        pending = to_wire(chunk)
+    server.send(pending + (b'.\r\n' if not pending or pending.endswith(b'\n') else b'\r\n.\r\n'))
+    code, resp = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
+
+
+class SMTPPool:
+    '''Пул авторизованных SMTP-сессий, переживающий тёплые вызовы функции'''
+
+    def __init__(self, host: str, port: int, user: str, password: str,
+                 size: int = 2, max_idle: float = 60.0, max_age: float = 300.0,
+                 timeout: float = 15.0, starttls: bool = None, connect_timeout: float = None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.size = size
+        self.max_idle = max_idle
+        self.max_age = max_age
+        # timeout - на каждую операцию после подключения; connect_timeout - на подключение и TLS
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout or timeout
+        # SMTP_STARTTLS=0 - для локальных SMTP-заглушек без TLS (стенд нагрузочного тестирования)
+        self.starttls = os.environ.get('SMTP_STARTTLS', '1') != '0' if starttls is None else starttls
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> 'smtplib.SMTP':
+        # smtplib (и ssl) загружаются при первой отправке, а не при импорте функции
+        import smtplib
+        with span('smtp.connect'):
+            if self.port == 465:
+                server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.connect_timeout)
+            else:
+                server = smtplib.SMTP(self.host, self.port, timeout=self.connect_timeout)
+                if self.starttls:
+                    server.starttls()
+        server.sock.settimeout(self.timeout)
+        # DATA передаётся несколькими send подряд - без задержек Нейгла на неполных сегментах
+        server.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with span('smtp.login'):
+            server.login(self.user, self.password)
+        server._pool_created_at = time.monotonic()
+        return server
+
+    @staticmethod
+    def _discard(server: 'smtplib.SMTP') -> None:
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _is_alive(server: 'smtplib.SMTP') -> bool:
+        import smtplib
+        try:
+            with span('smtp.noop'):
+                return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def acquire(self) -> 'smtplib.SMTP':
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, released_at = self._idle.pop()
+            expired = (now - released_at > self.max_idle
+                       or now - server._pool_created_at > self.max_age)
+            if not expired and self._is_alive(server):
+                return server
+            self._discard(server)
+        return self._connect()
+
+    def release(self, server: 'smtplib.SMTP', broken: bool = False) -> None:
+        if not broken and time.monotonic() - server._pool_created_at <= self.max_age:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append((server, time.monotonic()))
+                    return
+        self._discard(server)
+
+    @contextmanager
+    def connection(self):
+        import smtplib
+        server = self.acquire()
+        try:
+            yield server
+        except (smtplib.SMTPServerDisconnected, OSError):
+            self.release(server, broken=True)
+            raise
+        except Exception:
+            self.release(server)
+            raise
+        else:
+            self.release(server)
+
+    def send_message(self, msg, from_addr: str = None, to_addrs=None) -> dict:
+        import smtplib
+        try:
+            with self.connection() as server, span('smtp.send'):
+                return stream_message(server, msg, from_addr, to_addrs)
+        except smtplib.SMTPServerDisconnected:
+            with self.connection() as server, span('smtp.send'):
+                return stream_message(server, msg, from_addr, to_addrs)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._discard(server)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host: str, port: int, user: str, password: str, **options) -> SMTPPool:
+    '''Возвращает пул для учётной записи, создавая его при первом обращении'''
+    key = (host, port, user)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.password != password:
+            if pool is not None:
+                pool.close()
+            pool = SMTPPool(host, port, user, password, **options)
+            _pools[key] = pool
+        return pool
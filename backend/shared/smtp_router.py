@@ -0,0 +1,207 @@
+import json
+import os
+import threading
+import time
+
+from shared.telemetry import annotate
+
+# Дополнительные провайдеры на случай отказа основного: JSON-список
+# [{"host": ..., "port": 465, "user": ..., "password": ..., "from": ...}, ...]
+PROVIDERS_ENV = 'SMTP_PROVIDERS'
+CONNECT_TIMEOUT = float(os.environ.get('SMTP_CONNECT_TIMEOUT', '5'))
+SEND_TIMEOUT = float(os.environ.get('SMTP_SEND_TIMEOUT', '15'))
+BREAKER_FAILURES = int(os.environ.get('SMTP_BREAKER_FAILURES', '3'))
+BREAKER_COOLDOWN = float(os.environ.get('SMTP_BREAKER_COOLDOWN', '30'))
+# Вес последнего замера в EWMA: 0.3 сглаживает единичные выбросы и за несколько писем догоняет деградацию
+EWMA_ALPHA = 0.3
+
+
+class ProvidersUnavailable(OSError):
+    '''Ни один провайдер не принял письмо или все отключены автоматом'''
+
+
+class Provider:
+    '''Учётная запись SMTP с оценкой задержки (EWMA) и автоматом отключения при серии отказов'''
+
+    def __init__(self, host: str, port: int, user: str, password: str, sender: str = None):
+        self.host = host
+        self.port = int(port)
+        self.user = user
+        self.password = password
+        # sender=None - адрес отправителя берётся из заголовка From письма, как без маршрутизатора
+        self.sender = sender
+        self.name = f'{host}:{self.port}'
+        self.latency = None
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def rank(self) -> float:
+        # Без замеров провайдер идёт первым: иначе он никогда не получит письмо и оценку
+        return self.latency or 0.0
+
+    def allow(self) -> bool:
+        '''Можно ли отправлять: автомат закрыт, или истёк перерыв и пробное письмо ещё не в пути'''
+        with self._lock:
+            if self.failures < BREAKER_FAILURES:
+                return True
+            if self.probing or time.monotonic() < self.open_until:
+                return False
+            self.probing = True
+            return True
+
+    def succeeded(self, elapsed: float = None) -> None:
+        with self._lock:
+            if elapsed is not None:
+                self.latency = elapsed if self.latency is None else EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.latency
+            self.failures = 0
+            self.probing = False
+
+    def failed(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= BREAKER_FAILURES:
+                self.open_until = time.monotonic() + BREAKER_COOLDOWN
+
+    def release_probe(self) -> None:
+        '''Снимает отметку пробного письма, если попытка не дошла до succeeded/failed (неожиданная ошибка)'''
+        with self._lock:
+            self.probing = False
+
+    def prepare(self, msg, original_from: str):
+        '''Письмо от имени учётной записи провайдера: чужой адрес в From почтовые сервисы отклоняют'''
+        sender = original_from
+        if self.sender is not None:
+            from email.utils import formataddr, parseaddr
+            sender = formataddr((parseaddr(original_from or '')[0], self.sender))
+        if msg.get('From') != sender:
+            del msg['From']
+            msg['From'] = sender
+        return msg
+
+    def pool(self, **options):
+        from shared.smtp_pool import get_pool
+        return get_pool(self.host, self.port, self.user, self.password,
+                        connect_timeout=CONNECT_TIMEOUT, timeout=SEND_TIMEOUT, **options)
+
+    def async_pool(self, **options):
+        from shared import aio_smtp
+        return aio_smtp.get_pool(self.host, self.port, self.user, self.password,
+                                 connect_timeout=CONNECT_TIMEOUT, timeout=SEND_TIMEOUT, **options)
+
+
+class SMTPRouter:
+    '''Отправка через самого быстрого исправного провайдера с переходом к следующему при отказе.
+
+    Письмо, ответ на DATA которого потерян по таймауту, может быть доставлено дважды:
+    следующий провайдер отправит его повторно (доставка "хотя бы один раз").
+    '''
+
+    def __init__(self, providers: list, **pool_options):
+        self.providers = providers
+        self.pool_options = pool_options
+
+    @property
+    def primary(self) -> Provider:
+        '''Собственная учётная запись функции (get_router ставит её первой)'''
+        return self.providers[0]
+
+    def candidates(self) -> list:
+        return sorted(self.providers, key=Provider.rank)
+
+    @staticmethod
+    def _unavailable(errors: list) -> ProvidersUnavailable:
+        return ProvidersUnavailable('; '.join(errors) or 'All SMTP providers are unavailable')
+
+    @staticmethod
+    def _error(provider: Provider, error: Exception) -> str:
+        return f'{provider.name}: {error or type(error).__name__}'
+
+    def send_message(self, msg) -> dict:
+        import smtplib
+        errors = []
+        original_from = msg.get('From')
+        for provider in self.candidates():
+            if not provider.allow():
+                continue
+            started = time.monotonic()
+            try:
+                pool = provider.pool(**self.pool_options)
+                refused = pool.send_message(provider.prepare(msg, original_from), provider.sender)
+            except smtplib.SMTPRecipientsRefused:
+                # Адресата отклонит и другой провайдер: это ошибка письма, а не отказ сервиса
+                provider.succeeded()
+                raise
+            except (smtplib.SMTPException, OSError) as e:
+                provider.failed()
+                errors.append(self._error(provider, e))
+                continue
+            else:
+                provider.succeeded(time.monotonic() - started)
+            finally:
+                # Иначе после ошибки письма (например, UnicodeEncodeError в адресе) провайдер
+                # с открытым автоматом навсегда остаётся "в пробе" и больше не выбирается
+                provider.release_probe()
+            annotate(smtp_provider=provider.name, smtp_failovers=len(errors))
+            return refused
+        raise self._unavailable(errors)
+
+    async def send_message_async(self, msg) -> dict:
+        '''send_message на пулах shared.aio_smtp; вызывается из цикла shared.aio'''
+        import asyncio
+        import smtplib
+        errors = []
+        original_from = msg.get('From')
+        for provider in self.candidates():
+            if not provider.allow():
+                continue
+            started = time.monotonic()
+            try:
+                pool = provider.async_pool(**self.pool_options)
+                refused = await pool.send_message(provider.prepare(msg, original_from), provider.sender)
+            except smtplib.SMTPRecipientsRefused:
+                provider.succeeded()
+                raise
+            except (smtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+                provider.failed()
+                errors.append(self._error(provider, e))
+                continue
+            else:
+                provider.succeeded(time.monotonic() - started)
+            finally:
+                provider.release_probe()
+            annotate(smtp_provider=provider.name, smtp_failovers=len(errors))
+            return refused
+        raise self._unavailable(errors)
+
+
+def configured_providers() -> list:
+    '''Провайдеры из SMTP_PROVIDERS; отправитель по умолчанию - логин учётной записи'''
+    raw = os.environ.get(PROVIDERS_ENV)
+    if not raw:
+        return []
+    return [
+        Provider(item['host'], item.get('port', 465), item['user'], item['password'], item.get('from') or item['user'])
+        for item in json.loads(raw)
+    ]
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(host: str, port: int, user: str, password: str, **pool_options) -> SMTPRouter:
+    '''Маршрутизатор функции: её собственная учётная запись и провайдеры из SMTP_PROVIDERS.
+
+    Создаётся один раз на экземпляр, чтобы оценки задержки и состояние автоматов
+    переживали тёплые вызовы.
+    '''
+    key = (host, port, user, password, os.environ.get(PROVIDERS_ENV), tuple(sorted(pool_options.items())))
+    with _routers_lock:
+        router = _routers.get(key)
+        if router is None:
+            router = SMTPRouter([Provider(host, port, user, password)] + configured_providers(), **pool_options)
+            _routers[key] = router
+        return router
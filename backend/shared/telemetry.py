@@ -0,0 +1,185 @@
+import bisect
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+# TELEMETRY=0 отключает замеры: span() возвращает общий пустой контекст, лог не пишется
+ENABLED = os.environ.get('TELEMETRY', '1') != '0'
+# TELEMETRY_LOG=0 оставляет только гистограммы, без строки лога на вызов (нагрузочные тесты)
+LOG_ENABLED = os.environ.get('TELEMETRY_LOG', '1') != '0'
+# Раз в столько вызовов в лог выводятся накопленные гистограммы экземпляра (0 - никогда)
+DUMP_EVERY = int(os.environ.get('TELEMETRY_DUMP_EVERY', '100'))
+# С этим значением в X-Metrics-Token GET-запрос к любой функции возвращает гистограммы (пусто - выключено)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Верхние границы корзин гистограмм, мс
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+
+_current = contextvars.ContextVar('telemetry_trace', default=None)
+_histograms = {}
+# Источники счётчиков экземпляра для prometheus(): имя пула -> функция, возвращающая {счётчик: значение}
+_pool_stats = {}
+_lock = threading.Lock()
+_invocations = 0
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace: 'Trace', name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        phases = self.trace.phases
+        phases[self.name] = phases.get(self.name, 0.0) + elapsed
+        return False
+
+
+class Trace:
+    '''Замеры одного вызова функции: длительности фаз (суммируются при повторе) и произвольные поля'''
+
+    __slots__ = ('function', 'cold', 'started', 'phases', 'fields')
+
+    def __init__(self, function: str, cold: bool):
+        self.function = function
+        self.cold = cold
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.fields = {}
+
+    def record(self) -> dict:
+        return {
+            'fn': self.function,
+            'cold': self.cold,
+            'ms': round((time.perf_counter() - self.started) * 1e3, 3),
+            **self.fields,
+            'phases': {name: round(value * 1e3, 3) for name, value in self.phases.items()}
+        }
+
+
+def span(name: str):
+    '''Контекст замера фазы текущего вызова; вне вызова или при TELEMETRY=0 ничего не делает.
+
+    Фазы могут быть вложенными (db.acquire включает db.connect) - в логе каждая считается отдельно.
+    '''
+    trace = _current.get()
+    return NULL_SPAN if trace is None else _Span(trace, name)
+
+
+def annotate(**fields) -> None:
+    '''Добавляет поля (размеры, статусы, счётчики) в лог текущего вызова'''
+    trace = _current.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+def observe(function: str, phase: str, ms: float) -> None:
+    with _lock:
+        histogram = _histograms.get((function, phase))
+        if histogram is None:
+            histogram = _histograms[(function, phase)] = [[0] * len(BUCKETS_MS), 0, 0.0]
+        histogram[0][bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        histogram[1] += 1
+        histogram[2] += ms
+
+
+def histograms() -> dict:
+    '''Снимок гистограмм экземпляра: {функция: {фаза: {buckets, count, sum_ms}}}, корзины накопительные'''
+    with _lock:
+        items = [(key, list(value[0]), value[1], value[2]) for key, value in _histograms.items()]
+    snapshot = {}
+    for (function, phase), counts, count, total in items:
+        cumulative, running = {}, 0
+        for bound, value in zip(BUCKETS_MS, counts):
+            running += value
+            cumulative['+Inf' if bound == float('inf') else str(bound)] = running
+        snapshot.setdefault(function, {})[phase] = {'buckets': cumulative, 'count': count, 'sum_ms': round(total, 3)}
+    return snapshot
+
+
+def reset() -> None:
+    with _lock:
+        _histograms.clear()
+
+
+def register_pool(name: str, stats) -> None:
+    '''Подключает статистику пула (shared.db, shared.aio_db) к prometheus(): в ответы функций она не попадает'''
+    with _lock:
+        _pool_stats[name] = stats
+
+
+def prometheus() -> str:
+    '''Гистограммы и статистика пулов в текстовом формате Prometheus'''
+    lines = ['# TYPE handler_phase_ms histogram']
+    for function, phases in histograms().items():
+        for phase, data in phases.items():
+            labels = f'function="{function}",phase="{phase}"'
+            for bound, value in data['buckets'].items():
+                lines.append(f'handler_phase_ms_bucket{{{labels},le="{bound}"}} {value}')
+            lines.append(f'handler_phase_ms_sum{{{labels}}} {data["sum_ms"]}')
+            lines.append(f'handler_phase_ms_count{{{labels}}} {data["count"]}')
+    with _lock:
+        pools = list(_pool_stats.items())
+    if pools:
+        lines.append('# TYPE db_pool gauge')
+        for name, stats in pools:
+            for key, value in stats().items():
+                lines.append(f'db_pool{{pool="{name}",stat="{key}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def emit(record: dict) -> None:
+    sys.stdout.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+
+def traced(function: str, fn):
+    '''Оборачивает handler: один JSON-лог на вызов с фазами, размерами запроса/ответа и признаком холодного старта'''
+    if not ENABLED:
+        return fn
+
+    def handler(event: dict, context) -> dict:
+        global _invocations
+        with _lock:
+            _invocations += 1
+            invocation = _invocations
+        trace = Trace(function, cold=invocation == 1)
+        token = _current.set(trace)
+        status = None
+        try:
+            result = fn(event, context)
+            status = result.get('statusCode')
+            trace.fields['bytes_out'] = len(result.get('body') or '')
+            return result
+        finally:
+            _current.reset(token)
+            trace.fields['status'] = status if status is not None else 'exception'
+            trace.fields['bytes_in'] = len(event.get('body') or '')
+            record = trace.record()
+            if LOG_ENABLED:
+                emit(record)
+            observe(function, 'total', record['ms'])
+            for phase, ms in record['phases'].items():
+                observe(function, phase, ms)
+            if LOG_ENABLED and DUMP_EVERY and invocation % DUMP_EVERY == 0:
+                emit({'fn': function, 'histograms': histograms().get(function, {})})
+    return handler
@@ -0,0 +1,123 @@
+import html
+import re
+from collections import namedtuple
+
+PLACEHOLDER = re.compile(r'\{\{\s*(\w+)(\|raw)?\s*\}\}')
+
+
+class Rendered(namedtuple('Rendered', 'html text')):
+    '''Результат отрисовки: HTML и соответствующий ему простой текст'''
+
+    def mime(self):
+        '''Часть multipart/alternative: сначала текст, затем HTML'''
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+        part = MIMEMultipart('alternative')
+        part.attach(MIMEText(self.text, 'plain', 'utf-8'))
+        part.attach(MIMEText(self.html, 'html', 'utf-8'))
+        return part
+
+
+def html_to_text(source: str) -> str:
+    '''Преобразует HTML-разметку шаблона в простой текст; выполняется один раз при компиляции'''
+    text = re.sub(r'(?is)<(head|style|script)\b.*?</\1>', '', source)
+    text = ' '.join(text.split())
+    text = re.sub(r'(?i)<li\b[^>]*>', '\n- ', text)
+    text = re.sub(r'(?i)<br\s*/?>|</tr>|<(p|div|h\d|table)\b[^>]*>', '\n', text)
+    text = re.sub(r'(?i)</(p|div|h\d|table|ul)>', '\n\n', text)
+    text = re.sub(r'<[^>]+>', '', text)
+    text = html.unescape(text)
+    text = '\n'.join(line.strip() for line in text.split('\n'))
+    text = re.sub(r'\n{3,}', '\n\n', text).strip() + '\n'
+    # Вставки |raw занимают целые строки: их текст сам заканчивается переводом строки
+    text = re.sub(r'\s*(\{\{\s*\w+\|raw\s*\}\})\s*', r'\n\1', text)
+    return re.sub(r'(\|raw\s*\}\})\n(?=\{\{)', r'\1', text).lstrip('\n')
+
+
+def compile_parts(source: str) -> tuple:
+    '''Разбивает шаблон на статичные строки и поля: чётные элементы - текст, нечётные - (имя, raw)'''
+    parts = []
+    position = 0
+    for match in PLACEHOLDER.finditer(source):
+        parts.append(source[position:match.start()])
+        parts.append((match.group(1), bool(match.group(2))))
+        position = match.end()
+    parts.append(source[position:])
+    return tuple(parts)
+
+
+def _field_expr(name: str, raw: bool, as_html: bool) -> str:
+    if raw:
+        return f'_raw_html({name})' if as_html else f'_raw_text({name})'
+    return f'_escape(str({name}))' if as_html else f'str({name})'
+
+
+def _raw_html(value) -> str:
+    return value.html if isinstance(value, Rendered) else str(value)
+
+
+def _raw_text(value) -> str:
+    return value.text if isinstance(value, Rendered) else str(value)
+
+
+def compile_renderer(html_parts: tuple, text_parts: tuple):
+    '''Генерирует функцию отрисовки: одна склейка кортежа на каждую версию письма, без циклов по шаблону'''
+    names = sorted({part[0] for part in html_parts[1::2] + text_parts[1::2]})
+
+    def join_expr(parts: tuple, as_html: bool) -> str:
+        items = [repr(part) if index % 2 == 0 else _field_expr(part[0], part[1], as_html)
+                 for index, part in enumerate(parts) if index % 2 or part]
+        return "''.join((" + ''.join(item + ', ' for item in items) + '))'
+
+    signature = ''.join(f"{name}='', " for name in names) + '**_'
+    source = (f'def render({signature}):\n'
+              f'    return _Rendered({join_expr(html_parts, True)}, {join_expr(text_parts, False)})\n')
+    namespace = {'_Rendered': Rendered, '_escape': html.escape, '_raw_html': _raw_html, '_raw_text': _raw_text}
+    exec(compile(source, '<email-template>', 'exec'), namespace)
+    return namespace['render']
+
+
+class EmailTemplate:
+    '''Шаблон письма, компилируемый один раз при импорте.
+
+    Поля {{ name }} экранируются, поля {{ name|raw }} принимают Rendered
+    от другого шаблона и вставляются как есть. Текстовая версия письма
+    строится из той же разметки автоматически.
+    '''
+
+    def __init__(self, source: str, text_source: str = None):
+        self.source = source
+        self._html = compile_parts(source)
+        self._text = compile_parts(text_source if text_source is not None else html_to_text(source))
+        self.render = compile_renderer(self._html, self._text)
+
+    def bind(self, **fields) -> 'EmailTemplate':
+        '''Новый шаблон с заранее подставленными полями (например, одинаковыми для всей рассылки)'''
+        bound = EmailTemplate.__new__(EmailTemplate)
+        bound.source = self.source
+        bound._html = _bind_parts(self._html, fields, True)
+        bound._text = _bind_parts(self._text, fields, False)
+        bound.render = compile_renderer(bound._html, bound._text)
+        return bound
+
+
+def _bind_parts(parts: tuple, fields: dict, as_html: bool) -> tuple:
+    merged = [parts[0]]
+    for index in range(1, len(parts), 2):
+        name, raw = parts[index]
+        if name in fields:
+            value = fields[name]
+            if raw:
+                value = _raw_html(value) if as_html else _raw_text(value)
+            elif as_html:
+                value = html.escape(str(value))
+            merged[-1] += str(value) + parts[index + 1]
+        else:
+            merged.extend((parts[index], parts[index + 1]))
+    return tuple(merged)
+
+
+def join(fragments) -> Rendered:
+    '''Склеивает несколько отрисованных фрагментов в один'''
+    fragments = list(fragments)
+    return Rendered(''.join(f.html for f in fragments), ''.join(f.text for f in fragments))
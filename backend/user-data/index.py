@@ -1,116 +1,397 @@
+import base64
+import hashlib
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import re
+from datetime import date, datetime
+from shared import aio, serializer
+from shared.cache import TTLCache
+from shared.db import get_pool
+from shared.http import HttpError, endpoint, request_headers, response
+from shared.telemetry import annotate, span
 
-def handler(event: dict, context) -> dict:
-    '''API для получения данных пользователя: проекты и юридические лица'''
+PROJECTS_QUERY = """
+    SELECT 
+        p.id as project_id,
+        p.title,
+        p.description,
+        p.status,
+        p.start_date,
+        p.end_date,
+        p.budget,
+        p.created_at,
+        up.role as user_role,
+        le.id as legal_entity_id,
+        le.name as legal_entity_name,
+        le.inn,
+        le.kpp,
+        le.ogrn,
+        le.legal_address,
+        le.actual_address,
+        le.director_name,
+        le.phone as legal_entity_phone,
+        le.email as legal_entity_email
+    FROM user_projects up
+    JOIN projects p ON up.project_id = p.id
+    LEFT JOIN legal_entities le ON p.legal_entity_id = le.id
+    WHERE up.user_email = %s {conditions}
+    ORDER BY p.created_at DESC, p.id DESC
+    {limit}
+"""
+# Сводка user_project_summaries пересчитывается триггерами при любом изменении проектов
+# и юрлиц пользователя: её версия - отпечаток для ETag и страниц, и полного списка
+VERSION_QUERY = "SELECT version FROM user_project_summaries WHERE user_email = %s"
+# Готовое тело полного ответа; ::text - чтобы psycopg2 не разбирал JSON в словари
+SUMMARY_QUERY = "SELECT version, {column}::text FROM user_project_summaries WHERE user_email = %s"
+# Пакетный режим (?emails=a,b,c): все сводки одним запросом с ANY
+BATCH_QUERY = "SELECT user_email, version, {column}::text FROM user_project_summaries WHERE user_email = ANY(%s)"
+MAX_PAGE_SIZE = 200
+BATCH_LIMIT = int(os.environ.get('USER_DATA_BATCH_LIMIT', '100'))
+# Фильтры списка проектов: параметр запроса -> условие; даты - границы включительно
+DATE_FILTERS = {
+    'start_from': 'p.start_date >= %s',
+    'start_to': 'p.start_date <= %s',
+    'end_from': 'p.end_date >= %s',
+    'end_to': 'p.end_date <= %s'
+}
+FILTERS = ('status', *DATE_FILTERS, 'legal_entity_id', 'inn', 'q')
+# То же выражение, что в индексе idx_projects_search (V0008)
+SEARCH_CONDITION = (
+    "to_tsvector('russian', coalesce(p.title, '') || ' ' || coalesce(p.description, '')) "
+    "@@ to_tsquery('russian', %s)"
+)
+SEARCH_WORD = re.compile(r'\w+')
+# Сколько сводок серверный курсор отдаёт за один обмен с базой
+BATCH_FETCH = 20
+
+response_cache = TTLCache(
+    maxsize=int(os.environ.get('USER_DATA_CACHE_SIZE', '256')),
+    ttl=float(os.environ.get('USER_DATA_CACHE_TTL', '60'))
+)
+
+def encode_cursor(row: dict) -> str:
+    raw = json.dumps([row['created_at'].isoformat(), row['project_id']])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> tuple:
+    created_at, project_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    return datetime.fromisoformat(created_at), int(project_id)
+
+def project_payload(row: dict) -> dict:
+    return {
+        'id': row['project_id'],
+        'title': row['title'],
+        'description': row['description'],
+        'status': row['status'],
+        'startDate': row['start_date'],
+        'endDate': row['end_date'],
+        'budget': row['budget'] or None,
+        'userRole': row['user_role']
+    }
+
+def legal_entity_payload(row: dict) -> dict:
+    return {
+        'id': row['legal_entity_id'],
+        'name': row['legal_entity_name'],
+        'inn': row['inn'],
+        'kpp': row['kpp'],
+        'ogrn': row['ogrn'],
+        'legalAddress': row['legal_address'],
+        'actualAddress': row['actual_address'],
+        'directorName': row['director_name'],
+        'phone': row['legal_entity_phone'],
+        'email': row['legal_entity_email']
+    }
+
+def read_filters(params: dict) -> dict:
+    '''Фильтры из параметров запроса в типах для SQL; неверные значения - HttpError 400'''
+    filters = {}
+    if params.get('status'):
+        filters['status'] = tuple(sorted({status.strip() for status in params['status'].split(',') if status.strip()}))
+    try:
+        for name in DATE_FILTERS:
+            if params.get(name):
+                filters[name] = date.fromisoformat(params[name])
+        if params.get('legal_entity_id'):
+            filters['legal_entity_id'] = int(params['legal_entity_id'])
+    except ValueError:
+        raise HttpError(400, 'Invalid filter value')
+    if params.get('inn'):
+        filters['inn'] = params['inn'].strip()
+    if params.get('q'):
+        # Каждое слово - префикс: "монт слабот" находит "Монтаж слаботочных систем"
+        words = SEARCH_WORD.findall(params['q'])
+        if not words:
+            raise HttpError(400, 'Invalid filter value')
+        filters['q'] = ' & '.join(f'{word}:*' for word in words)
+    return filters
+
+def projects_query(user_email: str, after: tuple = None, limit: int = None, filters: dict = None) -> tuple:
+    '''Запрос страницы проектов пользователя по ключу (created_at, id) с фильтрами; без limit - все проекты'''
+    params = [user_email]
+    conditions = []
+    filters = filters or {}
+    if 'status' in filters:
+        conditions.append('p.status = ANY(%s)')
+        params.append(list(filters['status']))
+    for name, condition in DATE_FILTERS.items():
+        if name in filters:
+            conditions.append(condition)
+            params.append(filters[name])
+    if 'legal_entity_id' in filters:
+        conditions.append('p.legal_entity_id = %s')
+        params.append(filters['legal_entity_id'])
+    if 'inn' in filters:
+        conditions.append('le.inn = %s')
+        params.append(filters['inn'])
+    if 'q' in filters:
+        conditions.append(SEARCH_CONDITION)
+        params.append(filters['q'])
+    if after:
+        conditions.append('(p.created_at, p.id) < (%s, %s)')
+        params.extend(after)
+    limit_sql = ''
+    if limit:
+        limit_sql = 'LIMIT %s'
+        params.append(limit)
+    return PROJECTS_QUERY.format(conditions=''.join(f'AND {condition} ' for condition in conditions),
+                                 limit=limit_sql), params
+
+def fetch_projects(conn, user_email: str, after: tuple = None, limit: int = None, filters: dict = None) -> list:
+    from psycopg2.extras import RealDictCursor
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(*projects_query(user_email, after, limit, filters))
+        return cursor.fetchall()
+
+def fetch_version(conn, user_email: str) -> tuple:
+    '''Дешёвый отпечаток данных пользователя: меняется при любом изменении его проектов и юрлиц'''
+    with conn.cursor() as cursor:
+        cursor.execute(VERSION_QUERY, (user_email,))
+        return cursor.fetchone()
+
+def summary_column(params: dict) -> str:
+    return 'normalized' if params.get('format') == 'normalized' else 'nested'
+
+def summary_query(params: dict) -> str:
+    return SUMMARY_QUERY.format(column=summary_column(params))
+
+def fetch_summary(conn, user_email: str, params: dict) -> tuple:
+    '''(version, тело ответа) из сводки; None, если у пользователя нет проектов'''
+    with conn.cursor() as cursor:
+        cursor.execute(summary_query(params), (user_email,))
+        return cursor.fetchone()
+
+def make_etag(cache_key: tuple, version: tuple) -> str:
+    digest = hashlib.sha1(repr((cache_key, version)).encode()).hexdigest()
+    return f'"{digest[:24]}"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+def response_headers(etag: str, cache: str = None) -> dict:
+    '''Заголовки ответа с ETag; cache (HIT/MISS) - только для ответов с телом.
+
+    Статистика пула отдаётся метриками (X-Metrics-Token), а не заголовком каждого ответа.
+    '''
+    headers = {
+        'ETag': etag,
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag'
+    }
+    if cache:
+        headers['Content-Type'] = 'application/json'
+        headers['X-Cache'] = cache
+    return headers
+
+def read_batch(params: dict) -> list:
+    '''Email из ?emails= через запятую без повторов; пакет без пагинации и не больше BATCH_LIMIT'''
+    emails = list(dict.fromkeys(email.strip() for email in params['emails'].split(',') if email.strip()))
+    if len(emails) > BATCH_LIMIT:
+        raise HttpError(400, f'Batch limit is {BATCH_LIMIT}')
+    if params.get('limit') or params.get('cursor'):
+        raise HttpError(400, 'Pagination is not supported for batch requests')
+    if any(params.get(name) for name in FILTERS):
+        raise HttpError(400, 'Filters are not supported for batch requests')
+    return emails
+
+def render_batch(rows, emails: list, params: dict) -> tuple:
+    '''(версии, тело) пакетного ответа: готовые сводки склеиваются по мере чтения строк, без разбора JSON'''
+    versions = {}
+    parts = ['{"users": {']
+    for email, version, summary in rows:
+        if versions:
+            parts.append(', ')
+        versions[email] = version
+        parts.extend((json.dumps(email), ': ', summary))
+    for email in emails:
+        if email not in versions:
+            if len(parts) > 1:
+                parts.append(', ')
+            parts.extend((json.dumps(email), ': ', render_empty(email, params)))
+    parts.append('}}')
+    return tuple(sorted(versions.items())), ''.join(parts)
+
+def fetch_batch(conn, emails: list, params: dict) -> tuple:
+    # Именованный (серверный) курсор: большие пакеты читаются порциями по BATCH_FETCH строк
+    with conn.cursor(name='user_data_batch') as cursor:
+        cursor.itersize = BATCH_FETCH
+        cursor.execute(BATCH_QUERY.format(column=summary_column(params)), (emails,))
+        return render_batch(cursor, emails, params)
+
+def batch_response(event: dict, emails: list, params: dict, batch: tuple) -> dict:
+    versions, body = batch
+    etag = make_etag(('batch', tuple(emails), params.get('format')), versions)
+    annotate(batch=len(emails), found=len(versions))
+    if etag_matches(request_headers(event).get('if-none-match', ''), etag):
+        return response(304, headers=response_headers(etag), body='')
+    return response(200, headers=response_headers(etag, 'MISS'), body=body)
+
+def read_request(event: dict) -> tuple:
+    '''Email пользователя, параметры запроса, размер страницы, курсор и фильтры; ошибки - HttpError 400'''
+    params = event.get('queryStringParameters') or {}
+    user_email = (event.get('headers') or {}).get('X-User-Email') or params.get('email')
     
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Email'
-            },
-            'body': ''
-        }
+    if not user_email:
+        raise HttpError(400, 'User email is required')
     
-    if method != 'GET':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+    limit = None
+    after = None
+    try:
+        if params.get('limit') or params.get('cursor'):
+            limit = min(max(int(params.get('limit') or 50), 1), MAX_PAGE_SIZE)
+        if params.get('cursor'):
+            after = decode_cursor(params['cursor'])
+    except (ValueError, TypeError):
+        raise HttpError(400, 'Invalid limit or cursor')
     
-    user_email = event.get('headers', {}).get('X-User-Email') or event.get('queryStringParameters', {}).get('email')
+    return user_email, params, limit, after, read_filters(params)
+
+def cached_response(event: dict, cache_key: tuple, etag: str):
+    '''304 или ответ из кэша экземпляра, если данные не менялись; иначе None'''
+    if etag_matches(request_headers(event).get('if-none-match', ''), etag):
+        annotate(cache='NOT_MODIFIED')
+        return response(304, headers=response_headers(etag), body='')
     
-    if not user_email:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'User email is required'})
-        }
+    cached = response_cache.get(cache_key)
+    if cached is not None and cached[0] == etag:
+        annotate(cache='HIT')
+        return response(200, headers=response_headers(etag, 'HIT'), body=cached[1])
+    return None
+
+def render_response(rows: list, user_email: str, params: dict, limit: int, cache_key: tuple, etag: str) -> dict:
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
     
-    try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        query = """
-            SELECT 
-                p.id as project_id,
-                p.title,
-                p.description,
-                p.status,
-                p.start_date,
-                p.end_date,
-                p.budget,
-                up.role as user_role,
-                le.id as legal_entity_id,
-                le.name as legal_entity_name,
-                le.inn,
-                le.kpp,
-                le.ogrn,
-                le.legal_address,
-                le.actual_address,
-                le.director_name,
-                le.phone as legal_entity_phone,
-                le.email as legal_entity_email
-            FROM user_projects up
-            JOIN projects p ON up.project_id = p.id
-            LEFT JOIN legal_entities le ON p.legal_entity_id = le.id
-            WHERE up.user_email = %s
-            ORDER BY p.created_at DESC
-        """
-        
-        cursor.execute(query, (user_email,))
-        rows = cursor.fetchall()
-        
+    if params.get('format') == 'normalized':
         projects = []
+        legal_entities = {}
         for row in rows:
-            projects.append({
-                'project': {
-                    'id': row['project_id'],
-                    'title': row['title'],
-                    'description': row['description'],
-                    'status': row['status'],
-                    'startDate': str(row['start_date']) if row['start_date'] else None,
-                    'endDate': str(row['end_date']) if row['end_date'] else None,
-                    'budget': float(row['budget']) if row['budget'] else None,
-                    'userRole': row['user_role']
-                },
-                'legalEntity': {
-                    'id': row['legal_entity_id'],
-                    'name': row['legal_entity_name'],
-                    'inn': row['inn'],
-                    'kpp': row['kpp'],
-                    'ogrn': row['ogrn'],
-                    'legalAddress': row['legal_address'],
-                    'actualAddress': row['actual_address'],
-                    'directorName': row['director_name'],
-                    'phone': row['legal_entity_phone'],
-                    'email': row['legal_entity_email']
-                } if row['legal_entity_id'] else None
-            })
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'userEmail': user_email,
-                'projects': projects
-            })
+            legal_entity_id = row['legal_entity_id']
+            if legal_entity_id and str(legal_entity_id) not in legal_entities:
+                legal_entities[str(legal_entity_id)] = legal_entity_payload(row)
+            projects.append({'project': project_payload(row), 'legalEntityId': legal_entity_id})
+        payload = {
+            'userEmail': user_email,
+            'projects': projects,
+            'legalEntities': legal_entities,
+            'nextCursor': next_cursor
         }
-        
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)})
+    else:
+        payload = {
+            'userEmail': user_email,
+            'projects': [
+                {
+                    'project': project_payload(row),
+                    'legalEntity': legal_entity_payload(row) if row['legal_entity_id'] else None
+                }
+                for row in rows
+            ],
+            'nextCursor': next_cursor
         }
+    
+    with span('serialize'):
+        body = serializer.dumps(payload)
+    annotate(cache='MISS', rows=len(rows))
+    response_cache.set(cache_key, (etag, body))
+    
+    return response(200, headers=response_headers(etag, 'MISS'), body=body)
+
+def summary_response(user_email: str, params: dict, cache_key: tuple, summary: tuple) -> dict:
+    '''Полный список проектов из сводки: тело собрано в базе и уходит клиенту без разбора'''
+    if summary is None:
+        version, body = None, render_empty(user_email, params)
+    else:
+        version, body = (summary[0],), summary[1]
+    # Тот же отпечаток, что у fetch_version, - иначе следующий запрос не совпал бы по ETag
+    etag = make_etag(cache_key, version)
+    annotate(cache='MISS', summary=True)
+    response_cache.set(cache_key, (etag, body))
+    return response(200, headers=response_headers(etag, 'MISS'), body=body)
+
+def render_empty(user_email: str, params: dict) -> str:
+    payload = {'userEmail': user_email, 'projects': [], 'nextCursor': None}
+    if params.get('format') == 'normalized':
+        payload = {'userEmail': user_email, 'projects': [], 'legalEntities': {}, 'nextCursor': None}
+    return serializer.dumps(payload)
+
+async def handle_async(event: dict, context) -> dict:
+    '''Тот же запрос через асинхронный пул: пока база отвечает, цикл обслуживает другие вызовы'''
+    from shared import aio_db
+    params = event.get('queryStringParameters') or {}
+    if params.get('emails'):
+        emails = read_batch(params)
+        pool = aio_db.get_pool()
+        rows = await pool.fetch(BATCH_QUERY.format(column=summary_column(params)), (emails,))
+        return batch_response(event, emails, params,
+                              render_batch((tuple(row.values()) for row in rows), emails, params))
+    
+    user_email, params, limit, after, filters = read_request(event)
+    
+    pool = aio_db.get_pool()
+    cache_key = (user_email, params.get('format'), limit, params.get('cursor'), tuple(sorted(filters.items())))
+    version = await pool.fetchone(VERSION_QUERY, (user_email,))
+    etag = make_etag(cache_key, tuple(version.values()) if version else None)
+    
+    cached = cached_response(event, cache_key, etag)
+    if cached is not None:
+        return cached
+    
+    if limit is None and not filters:
+        summary = await pool.fetchone(summary_query(params), (user_email,))
+        return summary_response(user_email, params, cache_key, tuple(summary.values()) if summary else None)
+    
+    rows = await pool.fetch(*projects_query(user_email, after, limit + 1 if limit else None, filters))
+    return render_response(rows, user_email, params, limit, cache_key, etag)
+
+@endpoint(methods=('GET',), allow_headers='Content-Type, X-User-Email, If-None-Match', default_method='GET')
+def handler(event: dict, context) -> dict:
+    '''API для получения данных пользователя: проекты и юридические лица'''
+    if aio.ENABLED:
+        return aio.run(handle_async(event, context))
+    
+    params = event.get('queryStringParameters') or {}
+    if params.get('emails'):
+        emails = read_batch(params)
+        pool = get_pool()
+        return batch_response(event, emails, params,
+                              pool.run(lambda conn: fetch_batch(conn, emails, params)))
+    
+    user_email, params, limit, after, filters = read_request(event)
+    
+    pool = get_pool()
+    cache_key = (user_email, params.get('format'), limit, params.get('cursor'), tuple(sorted(filters.items())))
+    etag = make_etag(cache_key, pool.run(lambda conn: fetch_version(conn, user_email)))
+    
+    cached = cached_response(event, cache_key, etag)
+    if cached is not None:
+        return cached
+    
+    if limit is None and not filters:
+        summary = pool.run(lambda conn: fetch_summary(conn, user_email, params))
+        return summary_response(user_email, params, cache_key, summary)
+    
+    rows = pool.run(lambda conn: fetch_projects(conn, user_email, after, limit + 1 if limit else None, filters))
+    return render_response(rows, user_email, params, limit, cache_key, etag)
@@ -0,0 +1,25 @@
+-- Очередь исходящих писем: обработчики форм пишут сюда, отправляет функция mail-outbox
+CREATE TABLE IF NOT EXISTS mail_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    source VARCHAR(50) NOT NULL,
+    sender VARCHAR(255) NOT NULL,
+    recipients TEXT[] NOT NULL,
+    subject VARCHAR(998),
+    message BYTEA NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+-- Индекс для выборки писем, готовых к отправке
+CREATE INDEX IF NOT EXISTS idx_mail_outbox_due ON mail_outbox(next_attempt_at, id)
+    WHERE status IN ('pending', 'sending');
+
+-- Комментарии
+COMMENT ON TABLE mail_outbox IS 'Очередь исходящих писем';
+COMMENT ON COLUMN mail_outbox.source IS 'Функция, поставившая письмо в очередь: contact, send-email';
+COMMENT ON COLUMN mail_outbox.status IS 'Статус: pending (ожидает), sending (взято в работу), sent (отправлено), dead (исчерпаны попытки)';
+COMMENT ON COLUMN mail_outbox.next_attempt_at IS 'Время следующей попытки; для sending - срок аренды записи обработчиком';
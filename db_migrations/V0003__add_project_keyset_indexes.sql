@@ -0,0 +1,9 @@
+-- Ключ постраничной выборки (created_at, id) не должен содержать NULL
+UPDATE projects SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+ALTER TABLE projects ALTER COLUMN created_at SET NOT NULL;
+
+-- Покрывающий индекс связи пользователь-проект: выборка без обращения к таблице
+CREATE INDEX IF NOT EXISTS idx_user_projects_email_project ON user_projects(user_email, project_id) INCLUDE (role);
+
+-- Индекс для keyset-пагинации проектов по (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_projects_created_at_id ON projects(created_at DESC, id DESC);
@@ -0,0 +1,21 @@
+-- Автоматическое обновление updated_at: по нему user-data строит ETag и сбрасывает кэш
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE user_projects ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+DROP TRIGGER IF EXISTS trg_legal_entities_updated_at ON legal_entities;
+CREATE TRIGGER trg_legal_entities_updated_at BEFORE UPDATE ON legal_entities
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+DROP TRIGGER IF EXISTS trg_projects_updated_at ON projects;
+CREATE TRIGGER trg_projects_updated_at BEFORE UPDATE ON projects
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+DROP TRIGGER IF EXISTS trg_user_projects_updated_at ON user_projects;
+CREATE TRIGGER trg_user_projects_updated_at BEFORE UPDATE ON user_projects
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
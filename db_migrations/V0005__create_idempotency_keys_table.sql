@@ -0,0 +1,18 @@
+-- Ключи идемпотентности форм: повтор заявки в пределах окна возвращает сохранённый ответ без отправки письма
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key CHAR(64) PRIMARY KEY,
+    scope VARCHAR(50) NOT NULL,
+    response JSONB,
+    locked_until TIMESTAMP NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Индекс для удаления просроченных ключей
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys(expires_at);
+
+-- Комментарии
+COMMENT ON TABLE idempotency_keys IS 'Обработанные заявки форм contact и send-email';
+COMMENT ON COLUMN idempotency_keys.key IS 'sha256 от заголовка Idempotency-Key или от имени, email и сообщения';
+COMMENT ON COLUMN idempotency_keys.response IS 'Сохранённый ответ функции; NULL, пока заявка обрабатывается';
+COMMENT ON COLUMN idempotency_keys.locked_until IS 'Срок, после которого незавершённую заявку может взять повторный запрос';
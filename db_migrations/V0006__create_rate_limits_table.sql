@@ -0,0 +1,16 @@
+-- Общие для всех экземпляров функций счётчики ограничения частоты заявок (token bucket)
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key VARCHAR(400) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    allowed BOOLEAN NOT NULL DEFAULT TRUE,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Индекс для удаления давно не обновлявшихся счётчиков
+CREATE INDEX IF NOT EXISTS idx_rate_limits_updated_at ON rate_limits(updated_at);
+
+-- Комментарии
+COMMENT ON TABLE rate_limits IS 'Ограничение частоты заявок форм contact и send-email по IP и email';
+COMMENT ON COLUMN rate_limits.key IS 'Функция, тип ключа и значение: contact:ip:1.2.3.4, send-email:email:user@example.com';
+COMMENT ON COLUMN rate_limits.tokens IS 'Остаток токенов на момент updated_at';
+COMMENT ON COLUMN rate_limits.allowed IS 'Был ли пропущен последний запрос';
@@ -0,0 +1,147 @@
+-- Готовые ответы user-data для полного списка проектов: JSON собирается в базе при изменении данных,
+-- функция отдаёт его одной строкой по первичному ключу, без join и сборки в Python
+CREATE TABLE IF NOT EXISTS user_project_summaries (
+    user_email VARCHAR(255) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    projects_count INTEGER NOT NULL,
+    nested JSON NOT NULL,
+    normalized JSON NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION refresh_user_project_summary(p_email VARCHAR) RETURNS VOID AS $$
+BEGIN
+    -- Пересчёты одного пользователя идут по очереди: иначе транзакция, начавшая пересчёт раньше
+    -- коммита соседней, перезаписала бы сводку данными без её изменений
+    PERFORM pg_advisory_xact_lock(hashtext('user_project_summaries:' || p_email));
+
+    WITH rows AS (
+        SELECT
+            p.id,
+            p.created_at,
+            le.id AS legal_entity_id,
+            json_build_object(
+                'id', p.id,
+                'title', p.title,
+                'description', p.description,
+                'status', p.status,
+                'startDate', p.start_date::text,
+                'endDate', p.end_date::text,
+                'budget', NULLIF(p.budget, 0)::float8,
+                'userRole', up.role
+            ) AS project,
+            CASE WHEN le.id IS NOT NULL THEN json_build_object(
+                'id', le.id,
+                'name', le.name,
+                'inn', le.inn,
+                'kpp', le.kpp,
+                'ogrn', le.ogrn,
+                'legalAddress', le.legal_address,
+                'actualAddress', le.actual_address,
+                'directorName', le.director_name,
+                'phone', le.phone,
+                'email', le.email
+            ) END AS legal_entity
+        FROM user_projects up
+        JOIN projects p ON up.project_id = p.id
+        LEFT JOIN legal_entities le ON p.legal_entity_id = le.id
+        WHERE up.user_email = p_email
+    ),
+    summary AS (
+        SELECT
+            count(*) AS projects_count,
+            json_build_object(
+                'userEmail', p_email,
+                'projects', COALESCE(json_agg(
+                    json_build_object('project', project, 'legalEntity', legal_entity)
+                    ORDER BY created_at DESC, id DESC
+                ), '[]'),
+                'nextCursor', NULL
+            ) AS nested,
+            json_build_object(
+                'userEmail', p_email,
+                'projects', COALESCE(json_agg(
+                    json_build_object('project', project, 'legalEntityId', legal_entity_id)
+                    ORDER BY created_at DESC, id DESC
+                ), '[]'),
+                'legalEntities', COALESCE((
+                    SELECT json_object_agg(entity.legal_entity_id::text, entity.legal_entity)
+                    FROM (
+                        SELECT DISTINCT ON (legal_entity_id) legal_entity_id, legal_entity
+                        FROM rows
+                        WHERE legal_entity_id IS NOT NULL
+                        ORDER BY legal_entity_id
+                    ) entity
+                ), '{}'),
+                'nextCursor', NULL
+            ) AS normalized
+        FROM rows
+    )
+    INSERT INTO user_project_summaries (user_email, projects_count, nested, normalized)
+    SELECT p_email, projects_count, nested, normalized FROM summary WHERE projects_count > 0
+    ON CONFLICT (user_email) DO UPDATE SET
+        version = user_project_summaries.version + 1,
+        projects_count = EXCLUDED.projects_count,
+        nested = EXCLUDED.nested,
+        normalized = EXCLUDED.normalized,
+        updated_at = CURRENT_TIMESTAMP;
+
+    DELETE FROM user_project_summaries
+    WHERE user_email = p_email
+      AND NOT EXISTS (SELECT 1 FROM user_projects WHERE user_email = p_email);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION refresh_summaries_for_user_projects() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM refresh_user_project_summary(OLD.user_email);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.user_email IS DISTINCT FROM OLD.user_email) THEN
+        PERFORM refresh_user_project_summary(NEW.user_email);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION refresh_summaries_for_projects() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_user_project_summary(emails.user_email)
+    FROM (SELECT DISTINCT user_email FROM user_projects WHERE project_id = OLD.id) emails;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION refresh_summaries_for_legal_entities() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_user_project_summary(emails.user_email)
+    FROM (
+        SELECT DISTINCT up.user_email
+        FROM projects p
+        JOIN user_projects up ON up.project_id = p.id
+        WHERE p.legal_entity_id = OLD.id
+    ) emails;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_user_projects_summary ON user_projects;
+CREATE TRIGGER trg_user_projects_summary AFTER INSERT OR UPDATE OR DELETE ON user_projects
+    FOR EACH ROW EXECUTE FUNCTION refresh_summaries_for_user_projects();
+
+DROP TRIGGER IF EXISTS trg_projects_summary ON projects;
+CREATE TRIGGER trg_projects_summary AFTER UPDATE OR DELETE ON projects
+    FOR EACH ROW EXECUTE FUNCTION refresh_summaries_for_projects();
+
+DROP TRIGGER IF EXISTS trg_legal_entities_summary ON legal_entities;
+CREATE TRIGGER trg_legal_entities_summary AFTER UPDATE OR DELETE ON legal_entities
+    FOR EACH ROW EXECUTE FUNCTION refresh_summaries_for_legal_entities();
+
+SELECT refresh_user_project_summary(user_email) FROM (SELECT DISTINCT user_email FROM user_projects) emails;
+
+CREATE INDEX IF NOT EXISTS idx_user_projects_project ON user_projects(project_id);
+
+COMMENT ON TABLE user_project_summaries IS 'Готовые JSON-ответы user-data по пользователям, обновляются триггерами';
+COMMENT ON COLUMN user_project_summaries.version IS 'Увеличивается при каждом пересчёте, входит в ETag';
+COMMENT ON COLUMN user_project_summaries.nested IS 'Ответ без format: проекты с вложенными юрлицами';
+COMMENT ON COLUMN user_project_summaries.normalized IS 'Ответ с format=normalized: юрлица отдельным словарём';
@@ -0,0 +1,8 @@
+-- Фильтры user-data по статусу и срокам проекта
+CREATE INDEX IF NOT EXISTS idx_projects_status_start_date ON projects(status, start_date);
+CREATE INDEX IF NOT EXISTS idx_projects_end_date ON projects(end_date);
+
+-- Поиск по названию и описанию (?q=): полнотекстовый индекс, pg_trgm не требуется.
+-- Выражение должно совпадать с условием в user-data/index.py, иначе индекс не используется
+CREATE INDEX IF NOT EXISTS idx_projects_search ON projects
+    USING GIN (to_tsvector('russian', coalesce(title, '') || ' ' || coalesce(description, '')));
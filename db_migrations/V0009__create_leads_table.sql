@@ -0,0 +1,24 @@
+-- Заявки с форм contact и send-email: сохраняются тем же запросом, что ставит письмо в mail_outbox
+CREATE TABLE IF NOT EXISTS leads (
+    id BIGSERIAL PRIMARY KEY,
+    source VARCHAR(50) NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    email VARCHAR(255) NOT NULL,
+    phone VARCHAR(100),
+    company VARCHAR(255),
+    message TEXT NOT NULL,
+    systems TEXT[] NOT NULL DEFAULT '{}',
+    attachments JSONB NOT NULL DEFAULT '[]',
+    outbox_id BIGINT REFERENCES mail_outbox(id) ON DELETE SET NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Индекс для выгрузки за период в порядке поступления (keyset-пагинация по created_at, id)
+CREATE INDEX IF NOT EXISTS idx_leads_created_at ON leads(created_at, id);
+
+-- Комментарии
+COMMENT ON TABLE leads IS 'Заявки с форм сайта';
+COMMENT ON COLUMN leads.source IS 'Функция, принявшая заявку: contact, send-email';
+COMMENT ON COLUMN leads.systems IS 'Коды интересующих систем (sks, skud, ...)';
+COMMENT ON COLUMN leads.attachments IS 'Вложения без содержимого: [{"name", "type", "size"}]';
+COMMENT ON COLUMN leads.outbox_id IS 'Письмо с заявкой в mail_outbox - по нему видно, доставлено ли оно';
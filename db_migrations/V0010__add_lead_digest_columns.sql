@@ -0,0 +1,14 @@
+-- Сводные уведомления о заявках: заявка ждёт отправки в общем письме, пока в группе не наберётся
+-- LEAD_DIGEST_MAX заявок или не пройдёт LEAD_DIGEST_WINDOW секунд с самой старой
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS digest_pending BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS digest_sender VARCHAR(255);
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS digest_recipient VARCHAR(255);
+
+-- Индекс по ожидающим заявкам: их немного, остальная таблица в него не попадает
+CREATE INDEX IF NOT EXISTS idx_leads_digest_pending ON leads(source, digest_sender, digest_recipient, id)
+    WHERE digest_pending;
+
+-- Комментарии
+COMMENT ON COLUMN leads.digest_pending IS 'Заявка ждёт сводного письма; outbox_id заполняется при его постановке в очередь';
+COMMENT ON COLUMN leads.digest_sender IS 'Отправитель сводного письма (From письма заявки)';
+COMMENT ON COLUMN leads.digest_recipient IS 'Получатель сводного письма (To письма заявки)';
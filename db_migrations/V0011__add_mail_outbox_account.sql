@@ -0,0 +1,12 @@
+-- Учётная запись SMTP, от имени которой письмо должно уйти: contact и send-email пишут в очередь
+-- от разных ящиков, и чужой адрес в From почтовый сервис отклонит
+ALTER TABLE mail_outbox ADD COLUMN IF NOT EXISTS smtp_account VARCHAR(255);
+UPDATE mail_outbox SET smtp_account = sender WHERE smtp_account IS NULL;
+ALTER TABLE mail_outbox ALTER COLUMN smtp_account SET NOT NULL;
+
+-- Выборка готовых писем идёт по учётной записи
+DROP INDEX IF EXISTS idx_mail_outbox_due;
+CREATE INDEX IF NOT EXISTS idx_mail_outbox_due ON mail_outbox(smtp_account, next_attempt_at, id)
+    WHERE status IN ('pending', 'sending');
+
+COMMENT ON COLUMN mail_outbox.smtp_account IS 'Логин SMTP, через который отправляется письмо; mail-outbox берёт только письма своих учётных записей';
@@ -0,0 +1,87 @@
+-- Сводки user_project_summaries пересчитываются один раз на пользователя за оператор, а не на каждую
+-- изменённую строку: массовая вставка или обновление N проектов пользователя стоили N полных пересборок.
+-- Затронутые пользователи берутся из таблиц переходов (REFERENCING OLD/NEW TABLE); пересчёт идёт
+-- в порядке email, чтобы параллельные операторы брали advisory-блокировки в одном порядке
+
+CREATE OR REPLACE FUNCTION refresh_summaries_for_user_projects() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_user_project_summary(emails.user_email)
+        FROM (SELECT DISTINCT user_email FROM new_rows ORDER BY user_email) emails;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_user_project_summary(emails.user_email)
+        FROM (SELECT DISTINCT user_email FROM old_rows ORDER BY user_email) emails;
+    ELSE
+        PERFORM refresh_user_project_summary(emails.user_email)
+        FROM (
+            SELECT user_email FROM old_rows
+            UNION
+            SELECT user_email FROM new_rows
+            ORDER BY user_email
+        ) emails;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION refresh_summaries_for_projects() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_user_project_summary(emails.user_email)
+    FROM (
+        SELECT DISTINCT up.user_email
+        FROM user_projects up
+        WHERE up.project_id IN (SELECT id FROM old_rows)
+        ORDER BY up.user_email
+    ) emails;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION refresh_summaries_for_legal_entities() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_user_project_summary(emails.user_email)
+    FROM (
+        SELECT DISTINCT up.user_email
+        FROM projects p
+        JOIN user_projects up ON up.project_id = p.id
+        WHERE p.legal_entity_id IN (SELECT id FROM old_rows)
+        ORDER BY up.user_email
+    ) emails;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер с таблицами переходов срабатывает только на одно событие, поэтому на каждое событие свой
+DROP TRIGGER IF EXISTS trg_user_projects_summary ON user_projects;
+DROP TRIGGER IF EXISTS trg_user_projects_summary_insert ON user_projects;
+CREATE TRIGGER trg_user_projects_summary_insert AFTER INSERT ON user_projects
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_summaries_for_user_projects();
+DROP TRIGGER IF EXISTS trg_user_projects_summary_update ON user_projects;
+CREATE TRIGGER trg_user_projects_summary_update AFTER UPDATE ON user_projects
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_summaries_for_user_projects();
+DROP TRIGGER IF EXISTS trg_user_projects_summary_delete ON user_projects;
+CREATE TRIGGER trg_user_projects_summary_delete AFTER DELETE ON user_projects
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_summaries_for_user_projects();
+
+DROP TRIGGER IF EXISTS trg_projects_summary ON projects;
+DROP TRIGGER IF EXISTS trg_projects_summary_update ON projects;
+CREATE TRIGGER trg_projects_summary_update AFTER UPDATE ON projects
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_summaries_for_projects();
+DROP TRIGGER IF EXISTS trg_projects_summary_delete ON projects;
+CREATE TRIGGER trg_projects_summary_delete AFTER DELETE ON projects
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_summaries_for_projects();
+
+DROP TRIGGER IF EXISTS trg_legal_entities_summary ON legal_entities;
+DROP TRIGGER IF EXISTS trg_legal_entities_summary_update ON legal_entities;
+CREATE TRIGGER trg_legal_entities_summary_update AFTER UPDATE ON legal_entities
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_summaries_for_legal_entities();
+DROP TRIGGER IF EXISTS trg_legal_entities_summary_delete ON legal_entities;
+CREATE TRIGGER trg_legal_entities_summary_delete AFTER DELETE ON legal_entities
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_summaries_for_legal_entities();
@@ -0,0 +1,98 @@
+-- Версия сводки берётся из общей последовательности. Раньше сводка пользователя без проектов
+-- удалялась, а при новом проекте создавалась заново с version = 1 и повторяла прежний ETag:
+-- клиент получал 304 с устаревшими данными, а кэш экземпляра user-data - старое тело.
+-- Последовательность начинается с текущего времени в миллисекундах - больше любой ранее выданной версии
+CREATE SEQUENCE IF NOT EXISTS user_project_summaries_version_seq;
+SELECT setval(
+    'user_project_summaries_version_seq',
+    GREATEST(
+        (SELECT COALESCE(max(version), 0) FROM user_project_summaries),
+        (EXTRACT(EPOCH FROM clock_timestamp()) * 1000)::BIGINT
+    )
+);
+ALTER TABLE user_project_summaries ALTER COLUMN version SET DEFAULT nextval('user_project_summaries_version_seq');
+
+CREATE OR REPLACE FUNCTION refresh_user_project_summary(p_email VARCHAR) RETURNS VOID AS $$
+BEGIN
+    -- Пересчёты одного пользователя идут по очереди: иначе транзакция, начавшая пересчёт раньше
+    -- коммита соседней, перезаписала бы сводку данными без её изменений
+    PERFORM pg_advisory_xact_lock(hashtext('user_project_summaries:' || p_email));
+
+    WITH rows AS (
+        SELECT
+            p.id,
+            p.created_at,
+            le.id AS legal_entity_id,
+            json_build_object(
+                'id', p.id,
+                'title', p.title,
+                'description', p.description,
+                'status', p.status,
+                'startDate', p.start_date::text,
+                'endDate', p.end_date::text,
+                'budget', NULLIF(p.budget, 0)::float8,
+                'userRole', up.role
+            ) AS project,
+            CASE WHEN le.id IS NOT NULL THEN json_build_object(
+                'id', le.id,
+                'name', le.name,
+                'inn', le.inn,
+                'kpp', le.kpp,
+                'ogrn', le.ogrn,
+                'legalAddress', le.legal_address,
+                'actualAddress', le.actual_address,
+                'directorName', le.director_name,
+                'phone', le.phone,
+                'email', le.email
+            ) END AS legal_entity
+        FROM user_projects up
+        JOIN projects p ON up.project_id = p.id
+        LEFT JOIN legal_entities le ON p.legal_entity_id = le.id
+        WHERE up.user_email = p_email
+    ),
+    summary AS (
+        SELECT
+            count(*) AS projects_count,
+            json_build_object(
+                'userEmail', p_email,
+                'projects', COALESCE(json_agg(
+                    json_build_object('project', project, 'legalEntity', legal_entity)
+                    ORDER BY created_at DESC, id DESC
+                ), '[]'),
+                'nextCursor', NULL
+            ) AS nested,
+            json_build_object(
+                'userEmail', p_email,
+                'projects', COALESCE(json_agg(
+                    json_build_object('project', project, 'legalEntityId', legal_entity_id)
+                    ORDER BY created_at DESC, id DESC
+                ), '[]'),
+                'legalEntities', COALESCE((
+                    SELECT json_object_agg(entity.legal_entity_id::text, entity.legal_entity)
+                    FROM (
+                        SELECT DISTINCT ON (legal_entity_id) legal_entity_id, legal_entity
+                        FROM rows
+                        WHERE legal_entity_id IS NOT NULL
+                        ORDER BY legal_entity_id
+                    ) entity
+                ), '{}'),
+                'nextCursor', NULL
+            ) AS normalized
+        FROM rows
+    )
+    INSERT INTO user_project_summaries (user_email, projects_count, nested, normalized)
+    SELECT p_email, projects_count, nested, normalized FROM summary WHERE projects_count > 0
+    ON CONFLICT (user_email) DO UPDATE SET
+        version = nextval('user_project_summaries_version_seq'),
+        projects_count = EXCLUDED.projects_count,
+        nested = EXCLUDED.nested,
+        normalized = EXCLUDED.normalized,
+        updated_at = CURRENT_TIMESTAMP;
+
+    DELETE FROM user_project_summaries
+    WHERE user_email = p_email
+      AND NOT EXISTS (SELECT 1 FROM user_projects WHERE user_email = p_email);
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON COLUMN user_project_summaries.version IS 'Номер из user_project_summaries_version_seq, новый при каждом пересчёте; входит в ETag';